@@ -0,0 +1,171 @@
+"""Computes the tutor metrics of many recorded EVH sessions and compares novice and expert cohorts.
+
+Sessions are the folders written by the tutor's session logger: numbered samples-*.npy chunks,
+events.jsonl with the cut events and summary.json with the experience level. The sessions are
+read by a pool of worker processes, Slicer is not needed.
+
+Example:
+  python analyzeSessions.py --output-dir Cohorts Data/Evh-Session-*
+  python analyzeSessions.py --output-dir Cohorts Data
+"""
+
+from __future__ import print_function
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import sys
+
+import numpy
+
+TARGET_ANGLE_RANGE = (0.0, 20.0) # same default as the tutor
+COHORTS = ['Novice', 'Expert']
+
+
+def findSessionDirectories(paths):
+  sessionDirectories = []
+  for path in paths:
+    if glob.glob(os.path.join(path, 'samples-*.npy')):
+      sessionDirectories.append(path)
+    elif os.path.isdir(path):
+      # folder of sessions
+      for name in sorted(os.listdir(path)):
+        if glob.glob(os.path.join(path, name, 'samples-*.npy')):
+          sessionDirectories.append(os.path.join(path, name))
+  return sessionDirectories
+
+
+def loadSession(sessionDirectory):
+  """Returns the concatenated samples, the list of events and the summary of a session folder."""
+  chunkPaths = sorted(glob.glob(os.path.join(sessionDirectory, 'samples-*.npy')))
+  samples = numpy.concatenate([numpy.load(chunkPath) for chunkPath in chunkPaths])
+  events = []
+  eventsPath = os.path.join(sessionDirectory, 'events.jsonl')
+  if os.path.exists(eventsPath):
+    with open(eventsPath) as f:
+      events = [json.loads(line) for line in f if line.strip()]
+  summary = {}
+  summaryPath = os.path.join(sessionDirectory, 'summary.json')
+  if os.path.exists(summaryPath):
+    with open(summaryPath) as f:
+      summary = json.load(f)
+  return samples, events, summary
+
+
+def computeSessionMetrics(task):
+  sessionDirectory, targetAngleRange = task
+  samples, events, summary = loadSession(sessionDirectory)
+  timestamps = samples['timestamp']
+  positions = samples['position']
+  angles = samples['retractorAngle']
+
+  cuts = [event for event in events if event.get('event') == 'cut']
+  cutDistances = numpy.array([cut['cutDistance'] for cut in cuts]) if cuts else numpy.zeros(1)
+  stumpLengths = numpy.array([cut.get('stumpLength', numpy.nan) for cut in cuts]) if cuts else numpy.full(1, numpy.nan)
+
+  # each sample holds until the next one
+  durations = numpy.diff(timestamps)
+  inRange = (angles[:-1] >= targetAngleRange[0]) & (angles[:-1] <= targetAngleRange[1])
+  totalTime = timestamps[-1] - timestamps[0]
+  timeInRange = durations[inRange].sum()
+  percentiles = numpy.percentile(angles, [5, 50, 95])
+  # x and y of the cutter tip, slope of the linear trajectory as computed by the tutor
+  A = numpy.vstack([positions[:, 0], numpy.ones(len(positions))]).T
+  slope = numpy.linalg.lstsq(A, positions[:, 1], rcond=None)[0][0] if len(positions) > 1 else 0.0
+
+  return {
+    'session': sessionDirectory,
+    'experience': summary.get('experience', ''),
+    'vesselSet': summary.get('vesselSet', ''),
+    'procedureTime': totalTime,
+    'samples': len(samples),
+    'branchesCut': len(cuts),
+    'minDistance': cutDistances.min(),
+    'maxDistance': cutDistances.max(),
+    'meanDistance': cutDistances.mean(),
+    'stdDevCutDistances': cutDistances.std(),
+    'meanStumpLength': numpy.nanmean(stumpLengths) if numpy.isfinite(stumpLengths).any() else numpy.nan,
+    'minAngle': angles.min(),
+    'maxAngle': angles.max(),
+    'angle5thPercentile': percentiles[0],
+    'medianAngle': percentiles[1],
+    'angle95thPercentile': percentiles[2],
+    'fractionInTargetAngleRange': timeInRange / totalTime if totalTime > 0 else 0.0,
+    'trajectorySlope': slope
+  }
+
+
+def computeCohortStatistics(sessionMetrics, metricNames):
+  """Mean, standard deviation, median and quartiles of each metric per cohort, and Welch's t statistic
+  of the expert and novice means."""
+  statistics = {}
+  for metricName in metricNames:
+    statistics[metricName] = {}
+    for cohort in COHORTS:
+      values = numpy.array([metrics[metricName] for metrics in sessionMetrics if metrics['experience'] == cohort], dtype=float)
+      values = values[numpy.isfinite(values)]
+      if len(values) == 0:
+        continue
+      q1, median, q3 = numpy.percentile(values, [25, 50, 75])
+      statistics[metricName][cohort] = {'n': len(values), 'mean': values.mean(), 'std': values.std(ddof=1) if len(values) > 1 else 0.0,
+        'median': median, 'q1': q1, 'q3': q3}
+    novice = statistics[metricName].get('Novice')
+    expert = statistics[metricName].get('Expert')
+    if novice and expert and novice['n'] > 1 and expert['n'] > 1:
+      standardError = numpy.sqrt(novice['std'] ** 2 / novice['n'] + expert['std'] ** 2 / expert['n'])
+      statistics[metricName]['welchT'] = (expert['mean'] - novice['mean']) / standardError if standardError > 0 else 0.0
+  return statistics
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Compute metrics of recorded EVH sessions and compare novice and expert cohorts.')
+  parser.add_argument('sessions', nargs='+', help='session folders, or folders containing session folders')
+  parser.add_argument('--output-dir', default='.', help='folder for sessions.csv, cohorts.csv and cohorts.json')
+  parser.add_argument('--target-angle-range', type=float, nargs=2, default=TARGET_ANGLE_RANGE, metavar=('MIN', 'MAX'),
+    help='retractor to vessel angles in degrees counted as time in range')
+  parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+  args = parser.parse_args(argv)
+
+  sessionDirectories = findSessionDirectories(args.sessions)
+  if not sessionDirectories:
+    print('No sessions found')
+    return 1
+  if not os.path.isdir(args.output_dir):
+    os.makedirs(args.output_dir)
+
+  pool = multiprocessing.Pool(max(1, args.workers))
+  try:
+    sessionMetrics = pool.map(computeSessionMetrics, [(path, args.target_angle_range) for path in sessionDirectories])
+  finally:
+    pool.close()
+    pool.join()
+  print('Analyzed', len(sessionMetrics), 'sessions')
+
+  fieldNames = sorted(sessionMetrics[0].keys())
+  with open(os.path.join(args.output_dir, 'sessions.csv'), 'w') as f:
+    writer = csv.DictWriter(f, fieldnames=fieldNames)
+    writer.writeheader()
+    for metrics in sessionMetrics:
+      writer.writerow(metrics)
+
+  metricNames = [name for name in fieldNames if name not in ('session', 'experience', 'vesselSet')]
+  statistics = computeCohortStatistics(sessionMetrics, metricNames)
+  with open(os.path.join(args.output_dir, 'cohorts.json'), 'w') as f:
+    json.dump(statistics, f, indent=2, sort_keys=True)
+  with open(os.path.join(args.output_dir, 'cohorts.csv'), 'w') as f:
+    writer = csv.writer(f)
+    writer.writerow(['Metric', 'Cohort', 'N', 'Mean', 'Std', 'Median', 'Q1', 'Q3', 'Welch t'])
+    for metricName in metricNames:
+      for cohort in COHORTS:
+        values = statistics[metricName].get(cohort)
+        if values:
+          writer.writerow([metricName, cohort, values['n'], values['mean'], values['std'], values['median'], values['q1'], values['q3'],
+            statistics[metricName].get('welchT', '')])
+  print('Cohort statistics written to', os.path.join(args.output_dir, 'cohorts.csv'))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
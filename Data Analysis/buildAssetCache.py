@@ -0,0 +1,48 @@
+"""Fills the binary asset cache of the tutor, so module startup on a training cart only reads the cache.
+
+Run once after installing or updating the module, or after changing the CAD models. A headless Slicer
+process parses the CAD models, vessel sets and fiducial lists with VesselHarvestingTutorLogic.buildAssetCache
+and writes them to the asset cache in the Slicer temporary folder, where the module reads them at startup.
+The module also fills the cache on first use, this only moves that work out of the first session.
+
+Example:
+  python buildAssetCache.py --slicer /opt/Slicer/Slicer
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import subprocess
+import sys
+
+DEFAULT_MODULE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'VesselHarvestingTutor')
+
+BUILD_CODE = """
+import traceback
+import slicer
+from VesselHarvestingTutor import VesselHarvestingTutorLogic
+try:
+  VesselHarvestingTutorLogic().buildAssetCache()
+except Exception:
+  traceback.print_exc()
+  slicer.app.exit(1)
+else:
+  slicer.app.exit(0)
+"""
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Build the asset cache of the Vessel Harvesting Tutor module.')
+  parser.add_argument('--slicer', required=True, help='Slicer executable')
+  parser.add_argument('--module-path', default=DEFAULT_MODULE_PATH, help='folder of the VesselHarvestingTutor module')
+  args = parser.parse_args(argv)
+
+  command = [args.slicer, '--no-splash', '--no-main-window',
+    '--additional-module-paths', os.path.abspath(args.module_path), '--python-code', BUILD_CODE]
+  returnCode = subprocess.call(command)
+  print('Asset cache built' if returnCode == 0 else 'Failed to build the asset cache')
+  return returnCode
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -1,44 +1,152 @@
-import math
-import statistics
-from vtk import vtkMath
-n = 43 # points sampled on grid
-
-cutterPoints = getNode('C')
-orderedGrid = []
-row = []
-for i in range(1, n):
-    f = [0, 0, 0, 0]
-    cutterPoints.GetNthFiducialWorldCoordinates(i-1, f)    
-    row.append(f[:-1]) 
-    if i  % 6 == 0:
-        if len(orderedGrid) % 2 == 1:
-            row.reverse()
-        orderedGrid.append(row)
-        row = []
-
-rows = len(orderedGrid)
-cols = len(orderedGrid[1])
-distances = []
-
-for i in range(rows):
-    for j in range(1,cols):
-        f1 = orderedGrid[i][j]
-        f2 = orderedGrid[i][j-1]
-        distance = math.sqrt(vtkMath.Distance2BetweenPoints(f1, f2))
-        distances.append(distance)
-
-for i in range(1,rows):
-    for j in range(cols):
-        f1 = orderedGrid[i-1][j]
-        f2 = orderedGrid[i][j]
-        distance = math.sqrt(vtkMath.Distance2BetweenPoints(f1, f2))
-        distances.append(distance)
-
-mean = sum(distances) / len(distances)
-print 'Mean: ', mean
-print 'Stdev: ', math.sqrt(sum(pow(x-mean,2) for x in distances) / len(distances)) # square root of variance
-
-
-errors = [ math.abs(x - mean) for x in distances]
-errorMean = sum(errors) /len(errors)
-errorStdev = math.sqrt(sum(pow(x-mean,2) for x in errors) / len(errors))
\ No newline at end of file
+"""Checks tracking accuracy from points collected with the cutter tip on a calibration grid.
+
+The grid points are read from a markups fiducial list (.fcsv) in the order they were collected,
+row by row with every other row collected backwards (serpentine). Distances between all
+horizontal and vertical grid neighbors are compared to the nominal grid spacing, or to their
+mean when the spacing is not given.
+
+Several grids, each collected with a tracker configuration from Config, can be checked at once
+with a batch file, a CSV file with the columns grid, config, columns, spacing (config, columns
+and spacing may be left empty).
+
+Examples:
+  python calculateGridDistance.py --columns 6 --spacing 30 CutterTipPoints.fcsv
+  python calculateGridDistance.py --batch grids.csv --output gridAccuracy.csv
+
+Inside Slicer, getGridFromMarkupsNode(getNode('C')) gives the grid points of a markups node.
+"""
+
+from __future__ import print_function
+import argparse
+import csv
+import os
+import sys
+import xml.etree.ElementTree as ElementTree
+
+import numpy
+
+DEFAULT_COLUMNS = 6
+
+
+def readGrid(fcsvPath):
+  """Positions of a markups fiducial list as an (N,3) array."""
+  return numpy.genfromtxt(fcsvPath, delimiter=',', comments='#', usecols=(1, 2, 3), ndmin=2)
+
+
+def getGridFromMarkupsNode(markupsNode):
+  """World positions of the fiducials of a markups node as an (N,3) array."""
+  try:
+    import slicer
+    return slicer.util.arrayFromMarkupsControlPoints(markupsNode, world=True)
+  except (ImportError, AttributeError):
+    pass
+  # Slicer before 4.11 has no bulk access to the control points
+  positions = numpy.zeros((markupsNode.GetNumberOfFiducials(), 4))
+  for i in range(len(positions)):
+    markupsNode.GetNthFiducialWorldCoordinates(i, positions[i])
+  return positions[:, :3]
+
+
+def orderGrid(points, columns, serpentine=True):
+  """Arranges collected points into a (rows, columns, 3) grid, dropping an incomplete last row."""
+  rows = len(points) // columns
+  grid = numpy.array(points[:rows * columns]).reshape(rows, columns, 3)
+  if serpentine:
+    grid[1::2] = grid[1::2, ::-1]
+  return grid
+
+
+def computeNeighborDistances(grid):
+  """Distances between horizontal and between vertical grid neighbors."""
+  horizontal = numpy.linalg.norm(numpy.diff(grid, axis=1), axis=2).ravel()
+  vertical = numpy.linalg.norm(numpy.diff(grid, axis=0), axis=2).ravel()
+  return horizontal, vertical
+
+
+def computeErrorStatistics(distances, spacing=None):
+  reference = distances.mean() if spacing is None else spacing
+  errors = numpy.abs(distances - reference)
+  return {
+    'meanDistance': distances.mean(),
+    'stdDevDistance': distances.std(),
+    'meanError': errors.mean(),
+    'stdDevError': errors.std(),
+    'rmsError': numpy.sqrt(numpy.mean((distances - reference) ** 2)),
+    'maxError': errors.max()
+  }
+
+
+def readTrackerConfig(configPath):
+  """Name of the device set and settings of the tracker device of a PLUS configuration file."""
+  root = ElementTree.parse(configPath).getroot()
+  deviceSet = root.find('DataCollection/DeviceSet')
+  tracker = root.find("DataCollection/Device[@Id='TrackerDevice']")
+  config = {'deviceSet': deviceSet.get('Name', '') if deviceSet is not None else ''}
+  if tracker is not None:
+    for attribute in ['Type', 'AcquisitionRate', 'FilterAcWideNotch', 'FilterAlpha', 'FilterDcAdaptive']:
+      config['tracker' + attribute] = tracker.get(attribute, '')
+  return config
+
+
+def analyzeGrid(gridPath, columns=DEFAULT_COLUMNS, spacing=None, configPath=None, serpentine=True):
+  grid = orderGrid(readGrid(gridPath), columns, serpentine)
+  horizontal, vertical = computeNeighborDistances(grid)
+  result = {'grid': gridPath, 'rows': grid.shape[0], 'columns': grid.shape[1], 'config': configPath or ''}
+  if configPath:
+    result.update(readTrackerConfig(configPath))
+  for prefix, distances in [('', numpy.concatenate([horizontal, vertical])), ('horizontal', horizontal), ('vertical', vertical)]:
+    if len(distances) == 0:
+      continue
+    for name, value in computeErrorStatistics(distances, spacing).items():
+      result[prefix + name[0].upper() + name[1:] if prefix else name] = value
+  return result
+
+
+def readBatch(batchPath, defaultColumns, defaultSpacing):
+  tasks = []
+  batchDirectory = os.path.dirname(os.path.abspath(batchPath))
+  with open(batchPath) as f:
+    for row in csv.DictReader(f):
+      tasks.append({
+        'gridPath': os.path.join(batchDirectory, row['grid']),
+        'configPath': os.path.join(batchDirectory, row['config']) if row.get('config') else None,
+        'columns': int(row['columns']) if row.get('columns') else defaultColumns,
+        'spacing': float(row['spacing']) if row.get('spacing') else defaultSpacing
+      })
+  return tasks
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Check tracking accuracy from points collected on a calibration grid.')
+  parser.add_argument('grids', nargs='*', help='markups fiducial lists (.fcsv) of collected grid points')
+  parser.add_argument('--batch', help='CSV file with the columns grid, config, columns, spacing')
+  parser.add_argument('--config', help='PLUS configuration the grids were collected with')
+  parser.add_argument('--columns', type=int, default=DEFAULT_COLUMNS, help='grid points per row')
+  parser.add_argument('--spacing', type=float, default=None, help='nominal distance between grid neighbors, mean distance if not given')
+  parser.add_argument('--no-serpentine', dest='serpentine', action='store_false', help='all rows were collected in the same direction')
+  parser.add_argument('--output', help='CSV file for the results')
+  args = parser.parse_args(argv)
+
+  tasks = [{'gridPath': gridPath, 'configPath': args.config, 'columns': args.columns, 'spacing': args.spacing} for gridPath in args.grids]
+  if args.batch:
+    tasks += readBatch(args.batch, args.columns, args.spacing)
+  if not tasks:
+    parser.error('no grids given')
+
+  results = [analyzeGrid(serpentine=args.serpentine, **task) for task in tasks]
+  for result in results:
+    print('{grid} ({rows}x{columns}): mean {meanDistance:.3f}, stdev {stdDevDistance:.3f}, '
+      'mean error {meanError:.3f}, stdev error {stdDevError:.3f}, RMS error {rmsError:.3f}, max error {maxError:.3f}'.format(**result))
+
+  if args.output:
+    fieldNames = sorted(set(key for result in results for key in result))
+    with open(args.output, 'w') as f:
+      writer = csv.DictWriter(f, fieldnames=fieldNames)
+      writer.writeheader()
+      for result in results:
+        writer.writerow(result)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,102 @@
+"""Re-scores recorded EVH practice sessions without the GUI.
+
+Every recording (PLUS sequence metafile or CSV of TriggerToCutter, CutterToRetractor and
+VesselToRetractor matrices) is replayed by VesselHarvestingTutorLogic.replaySession in its own
+headless Slicer process, and the sessions are spread over a pool of worker processes.
+
+Example:
+  python replaySessions.py --slicer /opt/Slicer/Slicer --output-dir Rescored --branch-cut-radius 250 Recordings/*.mha
+"""
+
+from __future__ import print_function
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+
+DEFAULT_MODULE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'VesselHarvestingTutor')
+
+REPLAY_CODE = """
+import json, traceback
+import slicer
+from VesselHarvestingTutor import VesselHarvestingTutorLogic
+try:
+  logic = VesselHarvestingTutorLogic()
+  logic.loadTransforms()
+  logic.loadModels()
+  metrics = logic.replaySession({inputPath!r}, branchCutRadius={branchCutRadius!r}, cutDebounceSec={cutDebounceSec!r},
+    vesselSetName={vesselSetName!r})
+  with open({outputPath!r}, 'w') as f:
+    json.dump(metrics, f)
+except Exception:
+  traceback.print_exc()
+  slicer.app.exit(1)
+else:
+  slicer.app.exit(0)
+"""
+
+
+def replaySession(task):
+  inputPath, outputPath, args = task
+  code = REPLAY_CODE.format(inputPath=os.path.abspath(inputPath), outputPath=os.path.abspath(outputPath),
+    branchCutRadius=args.branch_cut_radius, cutDebounceSec=args.cut_debounce, vesselSetName=args.vessel_set)
+  command = [args.slicer, '--no-splash', '--no-main-window',
+    '--additional-module-paths', os.path.abspath(args.module_path), '--python-code', code]
+  with open(outputPath + '.log', 'w') as log:
+    returnCode = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT)
+  return inputPath, outputPath, returnCode
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Re-score recorded EVH sessions in headless Slicer processes.')
+  parser.add_argument('recordings', nargs='+', help='PLUS sequence metafiles or CSV transform recordings')
+  parser.add_argument('--slicer', required=True, help='Slicer executable')
+  parser.add_argument('--module-path', default=DEFAULT_MODULE_PATH, help='folder of the VesselHarvestingTutor module')
+  parser.add_argument('--output-dir', default='.', help='folder for the per-session JSON metrics and the summary CSV')
+  parser.add_argument('--branch-cut-radius', type=float, default=280.0)
+  parser.add_argument('--cut-debounce', type=float, default=3.0, help='shortest time between two cuts in seconds')
+  parser.add_argument('--vessel-set', default=None, help='vessel anatomy the sessions were recorded on, e.g. "Original Branches"')
+  parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+  args = parser.parse_args(argv)
+
+  if not os.path.isdir(args.output_dir):
+    os.makedirs(args.output_dir)
+  tasks = []
+  for inputPath in args.recordings:
+    name = os.path.splitext(os.path.basename(inputPath))[0]
+    tasks.append((inputPath, os.path.join(args.output_dir, name + '-metrics.json'), args))
+
+  results = []
+  pool = multiprocessing.Pool(max(1, args.workers))
+  try:
+    for inputPath, outputPath, returnCode in pool.imap_unordered(replaySession, tasks):
+      if returnCode != 0 or not os.path.exists(outputPath):
+        print('Failed to replay', inputPath, '- see', outputPath + '.log')
+        continue
+      with open(outputPath) as f:
+        metrics = json.load(f)
+      metrics.pop('points', None)
+      metrics['recording'] = inputPath
+      results.append(metrics)
+      print('Replayed', inputPath)
+  finally:
+    pool.close()
+    pool.join()
+
+  if results:
+    summaryPath = os.path.join(args.output_dir, 'summary.csv')
+    fieldNames = sorted(set(key for metrics in results for key in metrics))
+    with open(summaryPath, 'w') as f:
+      writer = csv.DictWriter(f, fieldnames=fieldNames)
+      writer.writeheader()
+      for metrics in sorted(results, key=lambda m: m['recording']):
+        writer.writerow(metrics)
+    print('Summary written to', summaryPath)
+  return 0 if len(results) == len(tasks) else 1
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
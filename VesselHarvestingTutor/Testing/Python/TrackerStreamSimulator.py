@@ -0,0 +1,147 @@
+"""Replays a recorded tracker stream over OpenIGTLink, in place of the PLUS server of the tutor station.
+
+The recording (PLUS sequence metafile or CSV of TriggerToCutter, CutterToRetractor and VesselToRetractor
+matrices, as read by TrackingRecording.readTrackingRecording) is sent as TRANSFORM messages at its
+recorded rate to the OpenIGTLink client connector of Slicer. Every message is stamped with the time it is sent,
+in the message header and, with --metadata, as the Timestamp metadata that the connector copies to the
+transform node, so the tutor uses tracker timestamps and measures its tracker-to-callback latency.
+This is a manual tool, it is not run by the tests.
+
+Example:
+  python TrackerStreamSimulator.py --port 18944 --metadata --loop TrackingRecording.mha
+  python TrackerStreamSimulator.py --speed 10 --prefix S2 TrackingRecording.csv
+
+Device names are limited to 20 characters, so prefixes of other stations are short, e.g. S2CutterToRetractor.
+Select the prefixed transforms for the station in the module panel.
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import socket
+import struct
+import sys
+import time
+
+import numpy
+
+# the recording reader of the tutor, two directories up in the source tree
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from TrackingRecording import readTrackingRecording
+
+TRANSFORM_NAMES = ['CutterToRetractor', 'VesselToRetractor', 'TriggerToCutter'] # TriggerToCutter last, it drives sampling
+TIMESTAMP_METADATA_KEY = 'Timestamp' # TRACKER_TIMESTAMP_ATTRIBUTE of the tutor
+HEADER_FORMAT = '>H12s20sQQQ'
+EXTENDED_HEADER_SIZE = 12
+METADATA_ENCODING_US_ASCII = 3
+CRC64_POLYNOMIAL = 0x42F0E1EBA9EA3693
+CRC64_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+def makeCrc64Table():
+  table = []
+  for i in range(256):
+    crc = i << 56
+    for _ in range(8):
+      crc = ((crc << 1) ^ CRC64_POLYNOMIAL) & CRC64_MASK if crc & (1 << 63) else (crc << 1) & CRC64_MASK
+    table.append(crc)
+  return table
+
+CRC64_TABLE = makeCrc64Table()
+
+
+def crc64(data):
+  """CRC-64 (ECMA-182) of a message body, as computed by OpenIGTLink."""
+  crc = 0
+  for byte in bytearray(data):
+    crc = CRC64_TABLE[((crc >> 56) ^ byte) & 0xFF] ^ ((crc << 8) & CRC64_MASK)
+  return crc
+
+
+def packTransformMessage(deviceName, matrix, timestamp, metadata=None):
+  """OpenIGTLink TRANSFORM message, header version 2 with metadata when metadata is given."""
+  # rotation column by column, then translation
+  content = struct.pack('>12f', *(list(matrix[:3, :3].T.ravel()) + list(matrix[:3, 3])))
+  version = 1
+  if metadata:
+    version = 2
+    keys = sorted(metadata)
+    values = [str(metadata[key]).encode('ascii') for key in keys]
+    keys = [key.encode('ascii') for key in keys]
+    metadataHeader = struct.pack('>H', len(keys)) + b''.join(
+      struct.pack('>HHI', len(key), METADATA_ENCODING_US_ASCII, len(value)) for key, value in zip(keys, values))
+    metadataBody = b''.join(key + value for key, value in zip(keys, values))
+    extendedHeader = struct.pack('>HHII', EXTENDED_HEADER_SIZE, len(metadataHeader), len(metadataBody), 0)
+    content = extendedHeader + content + metadataHeader + metadataBody
+  seconds = int(timestamp)
+  fraction = int((timestamp - seconds) * (1 << 32)) & 0xFFFFFFFF
+  header = struct.pack(HEADER_FORMAT, version, b'TRANSFORM', deviceName.encode('ascii'), (seconds << 32) | fraction,
+    len(content), crc64(content))
+  return header + content
+
+
+def streamRecording(connection, timestamps, matrices, prefix='', speed=1.0, metadata=False):
+  """Sends the frames paced by their recorded timestamps, returns the number of frames sent."""
+  startTime = time.time()
+  for i in range(len(timestamps)):
+    delay = startTime + (timestamps[i] - timestamps[0]) / speed - time.time()
+    if delay > 0:
+      time.sleep(delay)
+    sendTime = time.time()
+    messages = []
+    for name in TRANSFORM_NAMES:
+      matrix = matrices[name][i]
+      if numpy.isnan(matrix).any():
+        # PLUS sends valid transforms only
+        continue
+      messages.append(packTransformMessage(prefix + name, matrix, sendTime, {TIMESTAMP_METADATA_KEY: repr(sendTime)} if metadata else None))
+    connection.sendall(b''.join(messages))
+  return len(timestamps)
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Replay a recorded tracker stream to Slicer over OpenIGTLink.')
+  parser.add_argument('recording', help='PLUS sequence metafile or CSV transform recording')
+  parser.add_argument('--port', type=int, default=18944, help='port of the OpenIGTLink client connector in Slicer')
+  parser.add_argument('--prefix', default='', help='prepended to the transform names for another station, at most 3 characters')
+  parser.add_argument('--speed', type=float, default=1.0, help='replay speed relative to the recorded rate')
+  parser.add_argument('--metadata', action='store_true', help='send the timestamps as message metadata (OpenIGTLink version 3)')
+  parser.add_argument('--loop', action='store_true', help='replay the recording until interrupted')
+  args = parser.parse_args(argv)
+
+  for name in TRANSFORM_NAMES:
+    if len(args.prefix + name) > 20:
+      parser.error('device name {0} is longer than 20 characters'.format(args.prefix + name))
+  timestamps, matrices = readTrackingRecording(args.recording, TRANSFORM_NAMES)
+  if len(timestamps) == 0:
+    print('No tracking frames in', args.recording)
+    return 1
+
+  server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  server.bind(('', args.port))
+  server.listen(1)
+  print('Waiting for a connection on port', args.port)
+  try:
+    while True:
+      connection, address = server.accept()
+      connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      print('Streaming', len(timestamps), 'frames to', address[0])
+      try:
+        while True:
+          frameCount = streamRecording(connection, timestamps, matrices, args.prefix, args.speed, args.metadata)
+          print('Sent', frameCount, 'frames')
+          if not args.loop:
+            return 0
+      except socket.error as e:
+        print('Connection closed:', e)
+      finally:
+        connection.close()
+  except KeyboardInterrupt:
+    return 0
+  finally:
+    server.close()
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,49 @@
+"""Reader of recorded tracker transforms, shared by the tutor and the tracker stream simulator.
+Only depends on numpy, so it can be used outside of Slicer.
+"""
+
+import csv
+import os
+
+import numpy
+
+
+def readTrackingRecording(filePath, transformNames):
+  """Reads recorded tracker transforms from a PLUS sequence metafile (.mha/.mhd) or a CSV file.
+  CSV files have a Timestamp column and one column per transform in transformNames,
+  holding the 16 matrix elements in row-major order separated by spaces, as PLUS writes them.
+  Returns the timestamps and a dictionary of (N,4,4) matrix arrays, NaN where a transform was invalid.
+  """
+  if os.path.splitext(filePath)[1].lower() == '.csv':
+    with open(filePath, 'r') as f:
+      rows = list(csv.DictReader(f))
+    timestamps = numpy.array([float(row['Timestamp']) for row in rows])
+    matrices = {}
+    for name in transformNames:
+      elements = [row[name].split() if row.get(name) else [float('nan')] * 16 for row in rows]
+      matrices[name] = numpy.array(elements, dtype=float).reshape(-1, 4, 4)
+    return timestamps, matrices
+
+  # Sequence metafile, frame fields are stored in the text header as Seq_FrameNNNN_<Field> = <Value>
+  frameFields = {}
+  with open(filePath, 'rb') as f:
+    for line in f:
+      line = line.decode('latin-1').strip()
+      if line.startswith('ElementDataFile'):
+        break
+      if not line.startswith('Seq_Frame') or '=' not in line:
+        continue
+      key, value = [part.strip() for part in line.split('=', 1)]
+      frameName, fieldName = key[len('Seq_Frame'):].split('_', 1)
+      frameFields.setdefault(int(frameName), {})[fieldName] = value
+  frameNumbers = sorted(frameFields.keys())
+  timestamps = numpy.array([float(frameFields[n]['Timestamp']) for n in frameNumbers])
+  matrices = {}
+  for name in transformNames:
+    elements = []
+    for n in frameNumbers:
+      fields = frameFields[n]
+      valid = fields.get(name + 'TransformStatus', 'OK') == 'OK' and (name + 'Transform') in fields
+      elements.append(fields[name + 'Transform'].split() if valid else [float('nan')] * 16)
+    matrices[name] = numpy.array(elements, dtype=float).reshape(-1, 4, 4)
+  return timestamps, matrices
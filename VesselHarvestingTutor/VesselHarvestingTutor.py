@@ -8,9 +8,60 @@ import logging
 import time, datetime
 import math, numpy
 import csv
-
-NUM_MODELS = 9
-NUM_VESSEL_FIDS = 36
+import glob
+import hashlib
+import json
+import timeit
+import threading, Queue
+from vtk.util import numpy_support
+from TrackingRecording import readTrackingRecording
+
+DEFAULT_VESSEL_SET = 'Default' # vessel models in the top level of CadModels/vessel
+DEFAULT_STATION_NAME = 'Default' # station of the session without a name, whose nodes keep the names of a single station
+RECENTERING_DISTANCE = 400 # largest distance of the retractor reference point from the vessel axis before the vessel model is moved
+TRACKING_RATE_HZ = 50 # AcquisitionRate of the tracker device in Config/*.xml
+SAMPLE_BUFFER_SIZE = 10 * TRACKING_RATE_HZ # samples kept between two visualization updates, 10 seconds of tracking
+VISUALIZATION_INTERVAL_MS = 250
+MAXIMUM_RENDER_RATE_FPS = 20 # 3D view renders per second at most, independent of the tracking rate
+SCENE_UPDATE_ROLES = ['CutterMovingToCutterTip', 'SkeletonModel', 'VesselModelToVessel'] # nodes modified by the visualization stage
+BRANCH_CUT_RADIUS = 280 # largest distance from a branch start for a cut to remove the branch
+CUT_DEBOUNCE_SEC = 3 # shortest time between two cuts
+# Cutting edge of the closed jaws in CutterTip coordinates, from the hinge to the tip at the top, middle and bottom
+# of the CutterMovingModel, where it closes against the CutterBaseModel (x = 0)
+JAW_SEGMENTS_CUTTER_TIP = [((0.0, y, -20.0), (0.0, y, 0.0)) for y in (-3.2, 0.0, 2.8)]
+CLIP_POSITION_RESOLUTION = 1.0 # cut positions along a branch centerline are rounded to this length, so clipped branches can be reused
+REPLAY_TRANSFORM_NAMES = ['CutterToRetractor', 'VesselToRetractor', 'TriggerToCutter'] # TriggerToCutter last, it drives sampling
+# transforms observed for tracker messages, CutterToRetractor messages reach the TriggerToCutter observer as its parent
+TRACKING_OBSERVER_ROLES = ['TriggerToCutter', 'VesselToRetractor']
+SAMPLE_DTYPE = [
+  ('timestamp', 'f8'),
+  ('position', 'f8', (3,)), # cutter tip in RAS
+  ('triggerAngle', 'f8'), # degrees between trigger and cutter shaft
+  ('retractorAngle', 'f8'), # degrees between retractor and vessel axis, computed in batches
+  ('vesselToRas', 'f8', (16,)), # row-major 4x4 matrix
+  ('cutterToRas', 'f8', (16,)) # row-major 4x4 matrix
+]
+TARGET_ANGLE_RANGE = (0.0, 20.0) # degrees between retractor and vessel axis counted as time in range
+ASSET_CACHE_VERSION = '1' # increase when the cached asset format changes
+PROFILER_WINDOW_SIZE = 30 * TRACKING_RATE_HZ # durations kept per stage for the rolling statistics
+DEFAULT_OUTPUT_DIRECTORY = os.path.join(os.path.expanduser('~'), 'Documents', 'VesselHarvestingTutor', 'Data')
+OUTPUT_DIRECTORY_SETTING = 'VesselHarvestingTutor/OutputDirectory'
+PATH_TOLERANCE = 1.0 # largest distance of a smoothed cutter tip position from the simplified path
+PATH_MAX_POINTS = 2000 # the path tolerance is increased when the simplified path has more points
+PATH_MAX_PENDING = 5 * TRACKING_RATE_HZ # longest run of positions without a path point, bounds the work per sample
+SESSION_CHUNK_SIZE = 5 * TRACKING_RATE_HZ # samples per session log chunk, at most this many are lost on a crash
+WEBCAM_FRAME_RATE = 15 # frame rate of the WebcamStream in Config/Vessel_Harvest_Ascension_Webcam.xml
+WEBCAM_DEVICE_NAME = 'Webcam_Webcam' # PLUS names IMAGE devices <Name>_<EmbeddedTransformToFrame> of the ImageNames in Config/*.xml
+VIDEO_CHUNK_SIZE = 10 * WEBCAM_FRAME_RATE # webcam frames per memory-mapped chunk of the session video
+COVERAGE_BIN_LENGTH = 10.0 # arc length along the vessel axis per coverage cell
+COVERAGE_SECTORS = 8 # angular sectors around the vessel axis per coverage cell
+COVERAGE_RADIUS = 40.0 # samples farther from the vessel axis are outside the dissection tunnel
+COVERAGE_SATURATION_COUNT = TRACKING_RATE_HZ # samples in a cell for the full coverage color, one second of tracking
+COVERAGE_LEVELS = 16 # coverage colors shown on the main vessel
+COVERAGE_SCALAR_OFFSET = 100 # main vessel scalars from this value show coverage levels, lower values are vessel colors
+# node attribute holding the tracker timestamp of the latest transform, set by the OpenIGTLink connector
+# from the message metadata (see Testing/Python/TrackerStreamSimulator.py)
+TRACKER_TIMESTAMP_ATTRIBUTE = 'Timestamp'
 
 #
 # VesselHarvestingTutor
@@ -46,8 +97,7 @@ class VesselHarvestingTutorWidget(ScriptedLoadableModuleWidget):
 
   def setup(self):
     ScriptedLoadableModuleWidget.setup(self)
-    self.runTutor = False
-    self.cutterFiducial = slicer.modules.markups.logic().AddFiducial()
+    self.pathModel = None
     # Instantiate and connect widgets ...
 
     #
@@ -58,6 +108,29 @@ class VesselHarvestingTutorWidget(ScriptedLoadableModuleWidget):
     self.layout.addWidget(evhTutorCollapsibleButton)
     evhTutorFormLayout = qt.QFormLayout(evhTutorCollapsibleButton)
 
+    # Training station shown and controlled below, every station is scored in its own session
+    self.stationSelector = qt.QComboBox()
+    self.stationSelector.editable = True
+    self.stationSelector.toolTip = "Select the training station. Type a new name to add a station."
+    evhTutorFormLayout.addRow("Station:", self.stationSelector)
+
+    # Transforms streamed for the station, e.g. by its OpenIGTLink connection
+    self.inputSelectors = {}
+    for role, label, nodeType in [('CutterToRetractor', "Cutter transform:", 'vtkMRMLLinearTransformNode'),
+        ('TriggerToCutter', "Trigger transform:", 'vtkMRMLLinearTransformNode'),
+        ('VesselToRetractor', "Vessel transform:", 'vtkMRMLLinearTransformNode'),
+        ('Webcam', "Webcam image:", 'vtkMRMLVolumeNode')]:
+      inputSelector = slicer.qMRMLNodeComboBox()
+      inputSelector.nodeTypes = [nodeType]
+      # the webcam is optional and may connect later
+      inputSelector.noneEnabled = role == 'Webcam'
+      inputSelector.addEnabled = False
+      inputSelector.removeEnabled = False
+      inputSelector.setMRMLScene(slicer.mrmlScene)
+      inputSelector.toolTip = "Select the " + role + " node of the station."
+      evhTutorFormLayout.addRow(label, inputSelector)
+      self.inputSelectors[role] = inputSelector
+
     # Checkbox to indicate if user is a novice or expert 
     self.noviceCheckbox = qt.QRadioButton("Novice User")
     self.noviceCheckbox.connect('toggled(bool)', self.setNoviceExperience)
@@ -65,6 +138,24 @@ class VesselHarvestingTutorWidget(ScriptedLoadableModuleWidget):
     self.expertCheckbox.connect('toggled(bool)', self.setExpertExperience)
     evhTutorFormLayout.addRow(self.noviceCheckbox, self.expertCheckbox)
 
+    # Vessel anatomy used for the practice procedure
+    self.vesselSetSelector = qt.QComboBox()
+    self.vesselSetSelector.toolTip = "Select the vessel branch models to practice on."
+    evhTutorFormLayout.addRow("Vessel anatomy:", self.vesselSetSelector)
+
+    # Folder of the session logs and saved metrics
+    self.outputDirectorySelector = ctk.ctkPathLineEdit()
+    self.outputDirectorySelector.filters = ctk.ctkPathLineEdit.Dirs
+    self.outputDirectorySelector.toolTip = "Folder where session recordings and metrics are saved."
+    self.outputDirectorySelector.currentPath = qt.QSettings().value(OUTPUT_DIRECTORY_SETTING, DEFAULT_OUTPUT_DIRECTORY)
+    self.outputDirectorySelector.connect('currentPathChanged(QString)', self.onOutputDirectoryChanged)
+    evhTutorFormLayout.addRow("Output folder:", self.outputDirectorySelector)
+
+    # Checkbox to move the vessel model along with the retractor
+    self.recenteringCheckbox = qt.QCheckBox("Keep vessel in view")
+    self.recenteringCheckbox.toolTip = "Move the vessel model to the retractor when the retractor gets far from the vessel axis."
+    evhTutorFormLayout.addRow(self.recenteringCheckbox)
+
     # Button to start recording with EVH tutor
     self.runTutorButton = qt.QPushButton("Start Recording")
     self.runTutorButton.toolTip = "Starts EVH tutor and recording practice procedure."
@@ -144,6 +235,31 @@ class VesselHarvestingTutorWidget(ScriptedLoadableModuleWidget):
     self.numVesselsCutValueLabel.setAlignment(0x0002) # Align right
     evhTutorFormLayout.addRow(self.numVesselsCutLabel, self.numVesselsCutValueLabel)
 
+    # Fraction of the vessel tunnel visited by the retractor
+    self.coverageDescriptionLabel = qt.QLabel("Dissected Vessel Tunnel:")
+    self.coverageDescriptionLabel.setVisible(False)
+    self.coverageValueLabel = qt.QLabel("")
+    self.coverageValueLabel.setVisible(False)
+    self.coverageValueLabel.setAlignment(0x0002) # Align right
+    evhTutorFormLayout.addRow(self.coverageDescriptionLabel, self.coverageValueLabel)
+
+    self.metricsLabels = [
+      self.minAngleDescriptionLabel, self.minAngleValueLabel,
+      self.maxAngleDescriptionLabel, self.maxAngleValueLabel,
+      self.minDistanceDescriptionLabel, self.minDistanceValueLabel,
+      self.maxDistanceDescriptionLabel, self.maxDistanceValueLabel,
+      self.avgDistanceDescriptionLabel, self.avgDistanceValueLabel,
+      self.stdevDistanceDescriptionLabel, self.stdevDistanceValueLabel,
+      self.trajectorySlopeDescriptionLabel, self.trajectorySlopeValueLabel,
+      self.procedureTimeDescriptionLabel, self.procedureTimeValueLabel,
+      self.numVesselsCutLabel, self.numVesselsCutValueLabel,
+      self.coverageDescriptionLabel, self.coverageValueLabel
+    ]
+    # Metrics are refreshed from the running estimators while recording
+    self.metricsTimer = qt.QTimer()
+    self.metricsTimer.setInterval(1000)
+    self.metricsTimer.connect('timeout()', self.onMetricsTimer)
+
     # Button to display retractor trajectory 
     self.showPathButton = qt.QPushButton("Reconstruct retractor trajectory")
     self.showPathButton.toolTip = "Visualize retractor trajectory overlayed on vessel model."
@@ -154,7 +270,7 @@ class VesselHarvestingTutorWidget(ScriptedLoadableModuleWidget):
 
     # Button to save metrics of practice EVH run
     self.saveButton= qt.QPushButton("Save metrics")
-    self.saveButton.toolTip = "Save performance metrics to CSV file."
+    self.saveButton.toolTip = "Save performance metrics to CSV and JSON files."
     self.saveButton.setVisible(False)
     self.saveButton.enabled = True
     self.saveButton.connect('clicked()', self.onSaveButton)
@@ -167,19 +283,124 @@ class VesselHarvestingTutorWidget(ScriptedLoadableModuleWidget):
     self.resetButton.connect('clicked(bool)', self.onResetTutorButton)
     evhTutorFormLayout.addRow(self.resetButton)
 
+    #
+    # Performance Accordion
+    #
+    performanceCollapsibleButton = ctk.ctkCollapsibleButton()
+    performanceCollapsibleButton.text = "Performance"
+    performanceCollapsibleButton.collapsed = True
+    self.layout.addWidget(performanceCollapsibleButton)
+    performanceFormLayout = qt.QFormLayout(performanceCollapsibleButton)
+
+    # Checkbox to time the stages of the tracking callback
+    self.profilingCheckbox = qt.QCheckBox("Time tracking callback stages")
+    self.profilingCheckbox.toolTip = "Measure the time spent in each stage of tracker frame processing."
+    self.profilingCheckbox.connect('toggled(bool)', self.onProfilingToggled)
+    performanceFormLayout.addRow(self.profilingCheckbox)
+
+    # Per-stage timing statistics
+    self.profilingStatisticsLabel = qt.QLabel("")
+    self.profilingStatisticsLabel.setTextInteractionFlags(qt.Qt.TextSelectableByMouse)
+    performanceFormLayout.addRow(self.profilingStatisticsLabel)
+    self.profilingStatisticsTimer = qt.QTimer()
+    self.profilingStatisticsTimer.setInterval(1000)
+    self.profilingStatisticsTimer.connect('timeout()', self.updateProfilingStatistics)
+
+    # Cap on the 3D view frame rate
+    self.renderRateSpinBox = qt.QSpinBox()
+    self.renderRateSpinBox.setRange(1, 60)
+    self.renderRateSpinBox.suffix = " fps"
+    self.renderRateSpinBox.value = MAXIMUM_RENDER_RATE_FPS
+    self.renderRateSpinBox.toolTip = "Render the 3D views at most this many times per second, lower it if the view stutters while recording."
+    performanceFormLayout.addRow("Maximum render rate:", self.renderRateSpinBox)
+
+    # Button to save the timing statistics
+    self.exportProfilingButton = qt.QPushButton("Export timings")
+    self.exportProfilingButton.toolTip = "Save per-stage timing statistics to JSON and CSV files next to the metrics."
+    self.exportProfilingButton.connect('clicked()', self.onExportProfilingButton)
+    performanceFormLayout.addRow(self.exportProfilingButton)
+
     # Add vertical spacing in EVH Tutor accordion 
     self.layout.addStretch(35)
 
-    global logic 
-    logic = VesselHarvestingTutorLogic()
-    logic.loadTransforms()
-    logic.loadModels()
-    logic.resetModels()
+    self.logics = {} # session of each station by station name
+    self.logic = self.getStationLogic('')
+    self.renderRateSpinBox.value = self.logic.getRenderMonitor().maximumRenderRate
+    self.renderRateSpinBox.connect('valueChanged(int)', self.logic.getRenderMonitor().setMaximumRenderRate)
+    self.recenteringCheckbox.connect('toggled(bool)', self.onRecenteringToggled)
+
+    self.vesselSetSelector.addItems(self.logic.getVesselSetNames())
+    self.vesselSetSelector.connect('currentIndexChanged(QString)', self.onVesselSetChanged)
+    self.stationSelector.addItem(DEFAULT_STATION_NAME)
+    self.stationSelector.connect('currentIndexChanged(QString)', self.onStationChanged)
+    for role, inputSelector in self.inputSelectors.items():
+      inputSelector.connect('currentNodeChanged(vtkMRMLNode*)', lambda node, role=role: self.onInputNodeChanged(role, node))
+    self.updateStationWidgets()
+    # parse the other anatomies in the background so switching between them is instant
+    qt.QTimer.singleShot(0, self.logic.preloadVesselSets)
+
+  def getStationLogic(self, stationName):
+    """Session of a station, loaded when the station is first selected."""
+    if stationName not in self.logics:
+      logic = VesselHarvestingTutorLogic(stationName)
+      logic.loadTransforms()
+      logic.loadModels()
+      logic.resetModels()
+      self.logics[stationName] = logic
+    return self.logics[stationName]
+
+
+  def onStationChanged(self, stationName):
+    # the other stations keep recording
+    self.logic = self.getStationLogic('' if stationName == DEFAULT_STATION_NAME else stationName)
+    self.updateStationWidgets()
+
+
+  def onInputNodeChanged(self, role, node):
+    if node is not None and node.GetID() != self.logic.nodes.getID(role):
+      self.logic.setInputNode(role, node)
+
+
+  def onRecenteringToggled(self, enabled):
+    self.logic.setRecenteringEnabled(enabled)
+
+
+  def updateStationWidgets(self):
+    """Shows the inputs, settings and recording state of the selected station."""
+    for role, inputSelector in self.inputSelectors.items():
+      wasBlocked = inputSelector.blockSignals(True)
+      inputSelector.setCurrentNode(self.logic.nodes.get(role))
+      inputSelector.blockSignals(wasBlocked)
+    wasBlocked = self.vesselSetSelector.blockSignals(True)
+    self.vesselSetSelector.setCurrentIndex(self.vesselSetSelector.findText(self.logic.vesselSetName))
+    self.vesselSetSelector.blockSignals(wasBlocked)
+    wasBlocked = self.recenteringCheckbox.blockSignals(True)
+    self.recenteringCheckbox.checked = self.logic.recenteringEnabled
+    self.recenteringCheckbox.blockSignals(wasBlocked)
+    wasBlocked = self.profilingCheckbox.blockSignals(True)
+    self.profilingCheckbox.checked = self.logic.profiler.enabled
+    self.profilingCheckbox.blockSignals(wasBlocked)
+    if self.logic.profiler.enabled:
+      self.profilingStatisticsTimer.start()
+    else:
+      self.profilingStatisticsTimer.stop()
+      self.profilingStatisticsLabel.setText("")
+
+    self.runTutorButton.setText("Stop Recording" if self.logic.tutorRunning else "Start Recording")
+    self.showPathButton.setVisible(False)
+    self.saveButton.setVisible(False)
+    for label in self.metricsLabels:
+      label.setVisible(self.logic.tutorRunning)
+    if self.logic.tutorRunning:
+      self.onMetricsTimer()
+      self.metricsTimer.start()
+    else:
+      self.metricsTimer.stop()
+
 
   def getDistance(self):
       cutterTipWorld = [0,0,0,0]
-      fiducial = slicer.util.getNode("F")
-      fiducial.GetNthFiducialWorldCoordinates(0,cutterTipWorld)
+      self.logic.nodes.get('CutterTipFiducial').GetNthFiducialWorldCoordinates(0,cutterTipWorld)
 
       # get fiducial 
 
@@ -194,16 +415,25 @@ class VesselHarvestingTutorWidget(ScriptedLoadableModuleWidget):
 
 
   def onResetTutorButton(self):
-      logic.resetMetrics()
-      logic.resetModels()
+      self.logic.resetMetrics()
+      self.logic.resetModels()
       # delete the path 
-      pathModel = slicer.util.getNode('Path Trajectory')
-      if pathModel: 
-        slicer.mrmlScene.RemoveNode(pathModel)
+      if self.pathModel: 
+        slicer.mrmlScene.RemoveNode(self.pathModel)
+        self.pathModel = None
+
+
+  def onOutputDirectoryChanged(self, path):
+    qt.QSettings().setValue(OUTPUT_DIRECTORY_SETTING, path)
+
+
+  def onVesselSetChanged(self, setName):
+    self.logic.setVesselSet(setName)
+    self.onResetTutorButton()
 
 
   def onRunTutorButton(self):
-    if not self.runTutor: # if tutor is not running, start it 
+    if not self.logic.tutorRunning: # if tutor is not running, start it 
       #logic.runTutor = True
       self.onStartTutorButton()
     else: # stop active tutor 
@@ -215,132 +445,1045 @@ class VesselHarvestingTutorWidget(ScriptedLoadableModuleWidget):
       self.onResetTutorButton()
       self.runTutorButton.setText("Stop Recording")
       self.runTutorButton.toolTip = "Stops EVH tutor and recording practice procedure."
-      self.runTutor = not self.runTutor
-
-      self.minAngleDescriptionLabel.setVisible(False)
-      self.minAngleValueLabel.setVisible(False)
-
-      self.maxAngleDescriptionLabel.setVisible(False)
-      self.maxAngleValueLabel.setVisible(False)
-
-      self.minDistanceDescriptionLabel.setVisible(False)
-      self.minDistanceValueLabel.setVisible(False)
-
-      self.maxDistanceDescriptionLabel.setVisible(False)
-      self.maxDistanceValueLabel.setVisible(False)
-
-      self.avgDistanceDescriptionLabel.setVisible(False)
-      self.avgDistanceValueLabel.setVisible(False)
-
-      self.stdevDistanceDescriptionLabel.setVisible(False)
-      self.stdevDistanceValueLabel.setVisible(False)
-
-      self.trajectorySlopeDescriptionLabel.setVisible(False)
-      self.trajectorySlopeValueLabel.setVisible(False)
-
-      self.procedureTimeDescriptionLabel.setVisible(False)
-      self.procedureTimeValueLabel.setVisible(False)
-
-      self.numVesselsCutLabel.setVisible(False)
-      self.numVesselsCutValueLabel.setVisible(False)
 
       self.showPathButton.setVisible(False)
       self.saveButton.setVisible(False)
 
-      self.startTime = time.time()
+      self.logic.startSessionLog(self.getOutputFilename('Evh-Session-', ''))
+      self.logic.tutorRunning = True 
 
-      global logic
-      logic.tutorRunning = True 
+      self.updateMetricsLabels(self.logic.getRunningMetrics(), self.logic.getTimestamp(0, self.logic.getSessionElapsed()))
+      for label in self.metricsLabels:
+        label.setVisible(True)
+      self.metricsTimer.start()
   
 
   def onStopTutorButton(self):    
     self.runTutorButton.setText("Start Recording")
-    self.runTutor = not self.runTutor
     
-    global logic
-    logic.tutorRunning = False 
+    self.logic.tutorRunning = False 
+    self.metricsTimer.stop()
     
     # Calculate total procedure time 
-    stopTime = time.time() 
-    timeTaken = logic.getTimestamp(self.startTime, stopTime)
-    metrics = logic.getDistanceMetrics()
+    timeTaken = self.logic.getTimestamp(0, self.logic.getSessionElapsed())
+    # process the samples still waiting for the visualization stage
+    self.logic.updateVisualization()
+    metrics = self.logic.getDistanceMetrics()
+    self.logic.stopSessionLog(self.getSessionSummary(metrics, timeTaken))
+    self.updateMetricsLabels(metrics, timeTaken)
 
-    self.minAngleDescriptionLabel.setVisible(True)
-    self.minAngleValueLabel.setText(str(metrics['minAngle']) + ' degrees')
-    self.minAngleValueLabel.setVisible(True)
+    self.showPathButton.setVisible(True)
+    self.saveButton.setVisible(True)
 
-    self.maxAngleDescriptionLabel.setVisible(True)
-    self.maxAngleValueLabel.setText(str(metrics['maxAngle']) + ' degrees')
-    self.maxAngleValueLabel.setVisible(True)
 
-    self.minDistanceDescriptionLabel.setVisible(True)
-    self.minDistanceValueLabel.setText(str(metrics['minDistance']))
-    self.minDistanceValueLabel.setVisible(True)
+  def onMetricsTimer(self):
+    self.updateMetricsLabels(self.logic.getRunningMetrics(), self.logic.getTimestamp(0, self.logic.getSessionElapsed()))
 
-    self.maxDistanceDescriptionLabel.setVisible(True)
-    self.maxDistanceValueLabel.setText(str(metrics['maxDistance']))
-    self.maxDistanceValueLabel.setVisible(True)
 
-    self.avgDistanceDescriptionLabel.setVisible(True)
+  def updateMetricsLabels(self, metrics, timeTaken):
+    self.minAngleValueLabel.setText(str(metrics['minAngle']) + ' degrees')
+    self.maxAngleValueLabel.setText(str(metrics['maxAngle']) + ' degrees')
+    self.minDistanceValueLabel.setText(str(metrics['minDistance']))
+    self.maxDistanceValueLabel.setText(str(metrics['maxDistance']))
     self.avgDistanceValueLabel.setText(str(metrics['meanDistance']))
-    self.avgDistanceValueLabel.setVisible(True)
-
-    self.stdevDistanceDescriptionLabel.setVisible(True)
     self.stdevDistanceValueLabel.setText(str(metrics['stdDevCutDistances']))
-    self.stdevDistanceValueLabel.setVisible(True)
-
-    self.trajectorySlopeDescriptionLabel.setVisible(True)
     self.trajectorySlopeValueLabel.setText(str(metrics['trajectorySlope']))
-    self.trajectorySlopeValueLabel.setVisible(True)
-
     self.procedureTimeValueLabel.setText(timeTaken)
-    self.procedureTimeDescriptionLabel.setVisible(True)
-    self.procedureTimeValueLabel.setVisible(True)
-
     self.numVesselsCutValueLabel.setText(str(metrics['branchesCut']))
-    self.numVesselsCutLabel.setVisible(True)
-    self.numVesselsCutValueLabel.setVisible(True)
-
-    self.showPathButton.setVisible(True)
-    self.saveButton.setVisible(True)
+    self.coverageValueLabel.setText('{0:.0f}%'.format(100.0 * metrics.get('dissectionCoverage', 0)))
 
 
   def onShowPathButton(self):
     print 'Reconstructing retractor trajectory ...'
-    fidNode = slicer.util.getNode('MarkupsFiducial_*')
-    if fidNode == None:
-      slicer.util.CreateNodeByClass('vtkMRMLMarkupsFiducialNode')
-      fidNode = slicer.util.getNode('MarkupsFiducial_*')
-    outputModel = slicer.mrmlScene.AddNode(slicer.vtkMRMLModelNode())
-    outputModel.SetName('Path Trajectory')
-    outputModel.CreateDefaultDisplayNodes()
-    outputModel.GetDisplayNode().SetSliceIntersectionVisibility(True)
-    outputModel.GetDisplayNode().SetColor(1,1,0)
-
-    markupsToModel = slicer.mrmlScene.AddNode(slicer.vtkMRMLMarkupsToModelNode())
-    markupsToModel.SetAutoUpdateOutput(True)
-    markupsToModel.SetAndObserveModelNodeID(outputModel.GetID())
-    markupsToModel.SetAndObserveMarkupsNodeID(fidNode.GetID())
-    markupsToModel.SetModelType(slicer.vtkMRMLMarkupsToModelNode.Curve)
-    markupsToModel.SetCurveType(slicer.vtkMRMLMarkupsToModelNode.CardinalSpline)
+    # the simplified path is kept up to date while recording, the tube follows it
+    tubeFilter = vtk.vtkTubeFilter()
+    tubeFilter.SetInputData(self.logic.pathSimplifier.polyData)
+    tubeFilter.SetRadius(1.0)
+    tubeFilter.SetNumberOfSides(8)
+
+    if self.pathModel:
+      slicer.mrmlScene.RemoveNode(self.pathModel)
+    self.pathModel = slicer.mrmlScene.AddNode(slicer.vtkMRMLModelNode())
+    self.pathModel.SetName(self.logic.getNodeName('Path Trajectory'))
+    self.pathModel.SetPolyDataConnection(tubeFilter.GetOutputPort())
+    self.pathModel.CreateDefaultDisplayNodes()
+    self.pathModel.GetDisplayNode().SetSliceIntersectionVisibility(True)
+    self.pathModel.GetDisplayNode().SetColor(1,1,0)
     print 'Reconstruction complete'
 
   
-  def onSaveButton(self):
+  def getOutputFilename(self, prefix, extension):
+    outputDirectory = self.outputDirectorySelector.currentPath
+    if not os.path.isdir(outputDirectory):
+      os.makedirs(outputDirectory)
     timestamp = time.strftime("%H:%M:%S").replace(':', '-')
-    filename = "C:/Users/christina/Documents/VesselHarvestingTutor/Data/Evh-Metrics-" + str(datetime.date.today()) + ' ' + timestamp + '.csv'
-    metrics = logic.getDistanceMetrics()
-    with open(filename, 'w+') as f:  
-      writer = csv.writer(f, delimiter=',')
-      writer.writerow(['Metric', 'Value']) 
-      writer.writerow(['Experience', self.experienceLevel]) 
-      for key, value in metrics.items():
-        writer.writerow([key, value]) 
+    return os.path.join(outputDirectory, prefix + str(datetime.date.today()) + ' ' + timestamp + extension)
+
+
+  def getSessionSummary(self, metrics, timeTaken):
+    summary = dict(metrics)
+    summary['experience'] = getattr(self, 'experienceLevel', '')
+    summary['procedureTime'] = timeTaken
+    summary['vesselSet'] = self.logic.vesselSetName
+    return summary
+
+
+  def onSaveButton(self):
+    filename = self.getOutputFilename('Evh-Metrics-', '.csv')
+    summary = self.getSessionSummary(self.logic.getDistanceMetrics(), self.procedureTimeValueLabel.text)
+    writeSummary(os.path.splitext(filename)[0], summary)
     print "Results successfully saved."
 
 
+  def onProfilingToggled(self, enabled):
+    self.logic.profiler.enabled = enabled
+    if enabled:
+      self.logic.profiler.reset()
+      self.profilingStatisticsTimer.start()
+    else:
+      self.profilingStatisticsTimer.stop()
+
+
+  def updateProfilingStatistics(self):
+    lines = []
+    for stage, statistics in sorted(self.logic.getProfilingStatistics().items()):
+      if isinstance(statistics, dict):
+        lines.append('{0}: p50 {1:.3f} ms, p95 {2:.3f} ms, max {3:.3f} ms'.format(stage, statistics['p50'], statistics['p95'], statistics['max']))
+      else:
+        lines.append('{0}: {1}'.format(stage, statistics))
+    self.profilingStatisticsLabel.setText('\n'.join(lines))
+
+
+  def onExportProfilingButton(self):
+    filename = self.getOutputFilename('Evh-Timings-', '.json')
+    self.logic.profiler.exportStatistics(filename, self.logic.getProfilingCounters())
+    self.logic.profiler.exportStatistics(os.path.splitext(filename)[0] + '.csv', self.logic.getProfilingCounters())
+    print "Timings saved to " + filename
+
+
   def cleanup(self):
-    pass
+    self.metricsTimer.stop()
+    self.profilingStatisticsTimer.stop()
+    for logic in self.logics.values():
+      logic.cleanup()
+
+
+#
+# SampleRingBuffer
+#
+
+class SampleRingBuffer(object):
+  """Preallocated buffer of tracker samples. Written at tracking rate by the sample
+  processing stage and drained by the throttled visualization stage.
+  """
+
+  def __init__(self, capacity, dtype):
+    self.capacity = capacity
+    self.samples = numpy.zeros(capacity, dtype=dtype)
+    self.writeCount = 0
+    self.readCount = 0
+    self.droppedCount = 0
+
+
+  def push(self, sample):
+    if self.writeCount - self.readCount >= self.capacity:
+      # buffer full, the oldest unread sample is overwritten
+      self.readCount += 1
+      self.droppedCount += 1
+    self.samples[self.writeCount % self.capacity] = sample
+    self.writeCount += 1
+
+
+  def replaceLast(self, sample):
+    """Overwrites the latest sample if it was not drained yet, returns False if it was."""
+    if self.writeCount == self.readCount:
+      return False
+    self.samples[(self.writeCount - 1) % self.capacity] = sample
+    return True
+
+
+  def drain(self):
+    """Returns a copy of all samples written since the last drain, oldest first."""
+    indices = numpy.arange(self.readCount, self.writeCount) % self.capacity
+    self.readCount = self.writeCount
+    return self.samples[indices]
+
+
+  def clear(self):
+    self.readCount = self.writeCount
+
+
+#
+# TrajectoryStore
+#
+
+class TrajectoryStore(object):
+  """Growable array of all tracker samples recorded during a practice procedure.
+  """
+
+  def __init__(self, dtype, initialCapacity=4096):
+    self.samples = numpy.zeros(initialCapacity, dtype=dtype)
+    self.count = 0
+
+
+  def __len__(self):
+    return self.count
+
+
+  def extend(self, samples):
+    newCount = self.count + len(samples)
+    if newCount > len(self.samples):
+      # grow geometrically so appending stays amortized constant time
+      grown = numpy.zeros(max(newCount, 2 * len(self.samples)), dtype=self.samples.dtype)
+      grown[:self.count] = self.samples[:self.count]
+      self.samples = grown
+    self.samples[self.count:newCount] = samples
+    self.count = newCount
+
+
+  def getSamples(self):
+    """Returns a view of the recorded samples, valid until the next extend."""
+    return self.samples[:self.count]
+
+
+  def clear(self):
+    self.count = 0
+
+
+#
+# RunningStatistics
+#
+
+class RunningStatistics(object):
+  """Count, mean, variance (Welford's algorithm), minimum and maximum of a stream of values, updated in constant time.
+  """
+
+  def __init__(self):
+    self.count = 0
+    self.mean = 0.0
+    self.sumSquaredDifferences = 0.0
+    self.minimum = float('inf')
+    self.maximum = float('-inf')
+
+
+  def add(self, value):
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta / self.count
+    self.sumSquaredDifferences += delta * (value - self.mean)
+    self.minimum = min(self.minimum, value)
+    self.maximum = max(self.maximum, value)
+
+
+  def getStandardDeviation(self):
+    # population standard deviation, same as numpy.std
+    return math.sqrt(self.sumSquaredDifferences / self.count) if self.count > 0 else 0.0
+
+
+#
+# RunningLinearFit
+#
+
+class RunningLinearFit(object):
+  """Least-squares slope of y over x from running sums, updated with each batch of points.
+  Sums are taken relative to the first point, so they stay accurate far from the origin.
+  """
+
+  def __init__(self):
+    self.origin = None
+    self.count = 0
+    self.sumX = 0.0
+    self.sumY = 0.0
+    self.sumXX = 0.0
+    self.sumXY = 0.0
+
+
+  def addPoints(self, x, y):
+    if len(x) == 0:
+      return
+    if self.origin is None:
+      self.origin = (x[0], y[0])
+    x = x - self.origin[0]
+    y = y - self.origin[1]
+    self.count += len(x)
+    self.sumX += x.sum()
+    self.sumY += y.sum()
+    self.sumXX += x.dot(x)
+    self.sumXY += x.dot(y)
+
+
+  def getSlope(self):
+    denominator = self.count * self.sumXX - self.sumX * self.sumX
+    if self.count < 2 or denominator == 0:
+      return 0.0
+    return (self.count * self.sumXY - self.sumX * self.sumY) / denominator
+
+
+#
+# PathSimplifier
+#
+
+class PathSimplifier(object):
+  """Bounded polyline of the cutter tip path, built incrementally while recording.
+  Positions are smoothed by a one-euro filter. A path point is kept when the smoothed positions since the
+  last path point no longer fit within tolerance of a straight line. When the path grows past maxPoints,
+  the tolerance is doubled and the path is simplified again with Ramer-Douglas-Peucker.
+  """
+
+  def __init__(self, tolerance=PATH_TOLERANCE, maxPoints=PATH_MAX_POINTS, minCutoff=1.0, beta=0.007, derivativeCutoff=1.0):
+    self.initialTolerance = tolerance
+    self.maxPoints = maxPoints
+    self.minCutoff = minCutoff
+    self.beta = beta
+    self.derivativeCutoff = derivativeCutoff
+    self.polyData = vtk.vtkPolyData()
+    self.reset()
+
+
+  def reset(self):
+    self.tolerance = self.initialTolerance
+    self.filteredPosition = None
+    self.derivative = numpy.zeros(3)
+    self.lastTimestamp = None
+    self.pathPoints = []
+    self.pendingPositions = []
+    self.updatePolyData()
+
+
+  def getAlpha(self, timeStep, cutoff):
+    tau = 1.0 / (2 * math.pi * cutoff)
+    return 1.0 / (1.0 + tau / timeStep)
+
+
+  def filterPosition(self, timestamp, position):
+    if self.filteredPosition is None:
+      self.filteredPosition = numpy.array(position, dtype=float)
+    elif timestamp > self.lastTimestamp:
+      timeStep = timestamp - self.lastTimestamp
+      self.derivative += self.getAlpha(timeStep, self.derivativeCutoff) * ((position - self.filteredPosition) / timeStep - self.derivative)
+      # less smoothing when moving fast, less lag
+      cutoff = self.minCutoff + self.beta * numpy.linalg.norm(self.derivative)
+      self.filteredPosition += self.getAlpha(timeStep, cutoff) * (position - self.filteredPosition)
+    self.lastTimestamp = timestamp
+    return self.filteredPosition.copy()
+
+
+  def getDistancesFromSegment(self, points, start, end):
+    segment = end - start
+    length2 = segment.dot(segment)
+    if length2 == 0:
+      return numpy.linalg.norm(points - start, axis=1)
+    t = numpy.clip((points - start).dot(segment) / length2, 0.0, 1.0)
+    return numpy.linalg.norm(points - (start + t[:, numpy.newaxis] * segment), axis=1)
+
+
+  def simplify(self, points, tolerance):
+    """Ramer-Douglas-Peucker simplification of an (N,3) array of points."""
+    keep = numpy.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    segments = [(0, len(points) - 1)]
+    while segments:
+      first, last = segments.pop()
+      if last - first < 2:
+        continue
+      distances = self.getDistancesFromSegment(points[first + 1:last], points[first], points[last])
+      farthest = numpy.argmax(distances)
+      if distances[farthest] > tolerance:
+        keep[first + 1 + farthest] = True
+        segments.append((first, first + 1 + farthest))
+        segments.append((first + 1 + farthest, last))
+    return points[keep]
+
+
+  def extend(self, timestamps, positions):
+    for timestamp, position in zip(timestamps, positions):
+      position = self.filterPosition(timestamp, position)
+      if not self.pathPoints:
+        self.pathPoints.append(position)
+        continue
+      self.pendingPositions.append(position)
+      if len(self.pendingPositions) < 2:
+        continue
+      distances = self.getDistancesFromSegment(numpy.array(self.pendingPositions[:-1]), self.pathPoints[-1], position)
+      if distances.max() > self.tolerance or len(self.pendingPositions) > PATH_MAX_PENDING:
+        self.pathPoints.append(self.pendingPositions[-2])
+        self.pendingPositions = self.pendingPositions[-1:]
+    if len(self.pathPoints) > self.maxPoints:
+      self.tolerance *= 2
+      self.pathPoints = list(self.simplify(numpy.array(self.pathPoints), self.tolerance))
+    self.updatePolyData()
+
+
+  def getPathPoints(self):
+    """Points of the simplified path, ending at the latest smoothed position."""
+    return numpy.array(self.pathPoints + self.pendingPositions[-1:]).reshape(-1, 3)
+
+
+  def updatePolyData(self):
+    pathPoints = self.getPathPoints()
+    points = vtk.vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(pathPoints, deep=True))
+    lines = vtk.vtkCellArray()
+    if len(pathPoints) > 1:
+      lines.InsertNextCell(len(pathPoints))
+      for i in range(len(pathPoints)):
+        lines.InsertCellPoint(i)
+    self.polyData.SetPoints(points)
+    self.polyData.SetLines(lines)
+
+
+#
+# CoverageMap
+#
+
+class CoverageMap(object):
+  """Dissection coverage of the vessel tunnel: samples counted in cells of arc length along the vessel axis
+  and angular sector around it, separately for each tool. The grid is sized by the axis length when created,
+  so memory does not grow with the session. A voxel lookup built with the map lists the axis segments that can be
+  closest to the points of each voxel, so a sample is projected onto a few segments, not the whole axis.
+  """
+
+  def __init__(self, axisPoints, binLength=COVERAGE_BIN_LENGTH, sectorCount=COVERAGE_SECTORS, radius=COVERAGE_RADIUS):
+    axisPoints = numpy.asarray(axisPoints, dtype=float)
+    self.segmentStarts = axisPoints[:-1]
+    segments = numpy.diff(axisPoints, axis=0)
+    self.segmentLengths = numpy.linalg.norm(segments, axis=1)
+    self.segmentDirections = segments / numpy.maximum(self.segmentLengths, 1e-9)[:, numpy.newaxis]
+    self.segmentArcLengths = numpy.concatenate([[0.0], numpy.cumsum(self.segmentLengths)[:-1]])
+    # sectors are measured from the coordinate axis most perpendicular to the vessel
+    axisDirection = axisPoints[-1] - axisPoints[0]
+    reference = numpy.identity(3)[numpy.argmin(numpy.abs(axisDirection))]
+    normals = reference - numpy.dot(self.segmentDirections, reference)[:, numpy.newaxis] * self.segmentDirections
+    self.segmentNormals = normals / numpy.linalg.norm(normals, axis=1)[:, numpy.newaxis]
+    self.segmentBinormals = numpy.cross(self.segmentDirections, self.segmentNormals)
+    self.binLength = binLength
+    self.sectorCount = sectorCount
+    self.radius = radius
+    self.binCount = max(1, int(math.ceil(self.segmentLengths.sum() / binLength)))
+    self.buildSegmentLookup(axisPoints, binLength)
+    self.counts = {}
+    self.reset()
+
+
+  def buildSegmentLookup(self, axisPoints, voxelSize, chunkSize=4096):
+    """Candidate closest segments of each voxel of a grid around the axis, padded by the radius. The segment closest
+    to a point is at most one voxel diagonal farther from the voxel center than the segment closest to the center.
+    Voxels entirely outside the radius only keep the segment closest to their center.
+    """
+    self.voxelSize = voxelSize
+    self.gridOrigin = axisPoints.min(axis=0) - self.radius - voxelSize
+    self.gridShape = numpy.ceil((axisPoints.max(axis=0) + self.radius + voxelSize - self.gridOrigin) / voxelSize).astype(int)
+    centers = self.gridOrigin + (numpy.indices(self.gridShape).reshape(3, -1).T + 0.5) * voxelSize
+    allSegments = numpy.arange(len(self.segmentStarts))
+    candidates = numpy.zeros((len(centers), len(allSegments)), dtype=bool)
+    for start in range(0, len(centers), chunkSize):
+      chunk = centers[start:start + chunkSize]
+      _, _, distances2 = self.projectOntoSegments(chunk, numpy.tile(allSegments, (len(chunk), 1)))
+      distances = numpy.sqrt(distances2)
+      minDistances = distances.min(axis=1)[:, numpy.newaxis]
+      candidates[start:start + chunkSize] = distances <= numpy.where(minDistances > self.radius + voxelSize * math.sqrt(3),
+        minDistances, minDistances + voxelSize * math.sqrt(3))
+    # candidates first, the remaining columns repeat the first candidate
+    candidateCount = candidates.sum(axis=1).max()
+    segmentIndices = numpy.argsort(~candidates, axis=1, kind='mergesort')[:, :candidateCount]
+    segmentIndices = numpy.where(candidates[numpy.arange(len(centers))[:, numpy.newaxis], segmentIndices],
+      segmentIndices, segmentIndices[:, :1])
+    self.voxelSegments = segmentIndices.reshape(tuple(self.gridShape) + (candidateCount,))
+
+
+  def projectOntoSegments(self, points, segmentIndices):
+    """Position along, offset from and squared distance to each of the (N,K) segments of the points."""
+    relative = points[:, numpy.newaxis, :] - self.segmentStarts[segmentIndices]
+    directions = self.segmentDirections[segmentIndices]
+    along = numpy.clip(numpy.einsum('nkd,nkd->nk', relative, directions), 0, self.segmentLengths[segmentIndices])
+    offsets = relative - along[:, :, numpy.newaxis] * directions
+    return along, offsets, numpy.einsum('nkd,nkd->nk', offsets, offsets)
+
+
+  def reset(self):
+    for source in self.counts:
+      self.counts[source][:] = 0
+
+
+  def getCells(self, points, radius=None):
+    """Arc length bin and sector of each point, and whether the point is within radius of the axis."""
+    points = numpy.asarray(points, dtype=float).reshape(-1, 3)
+    # the cell of points farther than the radius from the axis is approximate, outside the grid they use the closest voxel
+    voxels = numpy.clip(numpy.floor((points - self.gridOrigin) / self.voxelSize).astype(int), 0, self.gridShape - 1)
+    segmentIndices = self.voxelSegments[voxels[:, 0], voxels[:, 1], voxels[:, 2]]
+    along, offsets, distances2 = self.projectOntoSegments(points, segmentIndices)
+    closest = numpy.argmin(distances2, axis=1)
+    rows = numpy.arange(len(points))
+    closestSegments = segmentIndices[rows, closest]
+    offsets = offsets[rows, closest]
+    arcLengths = self.segmentArcLengths[closestSegments] + along[rows, closest]
+    angles = numpy.arctan2(numpy.einsum('nk,nk->n', offsets, self.segmentBinormals[closestSegments]),
+      numpy.einsum('nk,nk->n', offsets, self.segmentNormals[closestSegments]))
+    bins = numpy.minimum((arcLengths / self.binLength).astype(int), self.binCount - 1)
+    sectors = ((angles + math.pi) / (2 * math.pi) * self.sectorCount).astype(int) % self.sectorCount
+    inside = distances2[rows, closest] <= (self.radius if radius is None else radius) ** 2
+    return bins, sectors, inside
+
+
+  def add(self, source, points):
+    if source not in self.counts:
+      self.counts[source] = numpy.zeros((self.binCount, self.sectorCount), dtype=numpy.int64)
+    bins, sectors, inside = self.getCells(points)
+    numpy.add.at(self.counts[source], (bins[inside], sectors[inside]), 1)
+    return inside.any()
+
+
+  def getTotalCounts(self, sources=None):
+    total = numpy.zeros((self.binCount, self.sectorCount), dtype=numpy.int64)
+    for source, counts in self.counts.items():
+      if sources is None or source in sources:
+        total += counts
+    return total
+
+
+  def getCoveredFraction(self, sources=None):
+    """Fraction of the cells visited by the tools."""
+    return float(numpy.count_nonzero(self.getTotalCounts(sources))) / (self.binCount * self.sectorCount)
+
+
+  def getLevels(self, levelCount=COVERAGE_LEVELS, saturationCount=COVERAGE_SATURATION_COUNT):
+    """Coverage of each cell quantized to levelCount levels, flattened by bin and sector."""
+    total = self.getTotalCounts()
+    # a single sample already shows
+    return numpy.minimum((total * (levelCount - 1) + saturationCount - 1) // saturationCount, levelCount - 1).ravel()
+
+
+#
+# StageProfiler
+#
+
+class StageProfiler(object):
+  """High-resolution timers for the stages of tracker frame processing.
+  The latest durations of each stage are kept in a fixed size window for rolling statistics.
+  Timing calls return immediately while the profiler is disabled.
+  """
+
+  def __init__(self, windowSize=PROFILER_WINDOW_SIZE):
+    self.enabled = False
+    self.windowSize = windowSize
+    self.reset()
+
+
+  def reset(self):
+    self.durations = {}
+    self.counts = {}
+    self.startTimes = {}
+
+
+  def start(self, stage):
+    if self.enabled:
+      self.startTimes[stage] = timeit.default_timer()
+
+
+  def stop(self, stage):
+    if not self.enabled or stage not in self.startTimes:
+      return
+    self.addDuration(stage, timeit.default_timer() - self.startTimes.pop(stage))
+
+
+  def addDuration(self, stage, duration):
+    """Records a duration in seconds measured elsewhere, e.g. a latency between two clocks."""
+    if not self.enabled:
+      return
+    if stage not in self.durations:
+      self.durations[stage] = numpy.zeros(self.windowSize)
+      self.counts[stage] = 0
+    self.durations[stage][self.counts[stage] % self.windowSize] = duration
+    self.counts[stage] += 1
+
+
+  def getStatistics(self):
+    """Returns count, p50, p95, max and mean in milliseconds for each stage."""
+    statistics = {}
+    for stage, durations in self.durations.items():
+      count = self.counts[stage]
+      window = durations[:min(count, self.windowSize)] * 1000.0
+      p50, p95 = numpy.percentile(window, [50, 95])
+      statistics[stage] = {'count': count, 'p50': p50, 'p95': p95, 'max': window.max(), 'mean': window.mean()}
+    return statistics
+
+
+  def exportStatistics(self, filePath, counters=None):
+    """Writes the statistics and optional counters to a JSON or CSV file, depending on the file extension.
+    In CSV files counters are rows with only the name and count columns filled.
+    """
+    statistics = self.getStatistics()
+    if os.path.splitext(filePath)[1].lower() == '.json':
+      with open(filePath, 'w') as f:
+        json.dump({'stages': statistics, 'counters': counters or {}}, f, indent=2, sort_keys=True)
+      return
+    with open(filePath, 'w') as f:
+      writer = csv.writer(f, delimiter=',')
+      writer.writerow(['Stage', 'Count', 'P50 (ms)', 'P95 (ms)', 'Max (ms)', 'Mean (ms)'])
+      for stage, values in sorted(statistics.items()):
+        writer.writerow([stage, values['count'], values['p50'], values['p95'], values['max'], values['mean']])
+      for name, value in sorted((counters or {}).items()):
+        writer.writerow([name, value, '', '', '', ''])
+
+
+def writeSummary(basePath, summary):
+  """Writes session metrics to basePath.json and to basePath.csv with one metric per row."""
+  with open(basePath + '.json', 'w') as f:
+    json.dump(summary, f, indent=2, sort_keys=True)
+  with open(basePath + '.csv', 'w') as f:
+    writer = csv.writer(f, delimiter=',')
+    writer.writerow(['Metric', 'Value'])
+    for key, value in sorted(summary.items()):
+      writer.writerow([key, value])
+
+
+#
+# SessionLogger
+#
+
+class SessionLogger(object):
+  """Streams the samples of a recording session to a folder of numbered .npy chunks.
+  Samples are collected into chunks of chunkSize, which are written by a background thread together
+  with the cut events (events.jsonl, one JSON object per line) and the summary files at the end of the session.
+  """
+
+  def __init__(self, sessionDirectory, chunkSize=SESSION_CHUNK_SIZE):
+    self.sessionDirectory = sessionDirectory
+    if not os.path.isdir(self.sessionDirectory):
+      os.makedirs(self.sessionDirectory)
+    self.chunkSize = chunkSize
+    self.pendingSamples = []
+    self.pendingCount = 0
+    self.chunkCount = 0
+    self.sampleCount = 0
+    self.queue = Queue.Queue()
+    self.writerThread = threading.Thread(target=self.writeFiles, name='VesselHarvestingTutorSessionLogger')
+    self.writerThread.daemon = True
+    self.writerThread.start()
+
+
+  def write(self, samples):
+    self.pendingSamples.append(samples.copy())
+    self.pendingCount += len(samples)
+    self.sampleCount += len(samples)
+    if self.pendingCount >= self.chunkSize:
+      self.flush()
+
+
+  def flush(self):
+    if self.pendingCount == 0:
+      return
+    chunk = numpy.concatenate(self.pendingSamples)
+    self.pendingSamples = []
+    self.pendingCount = 0
+    self.queue.put(('chunk', os.path.join(self.sessionDirectory, 'samples-{0:05d}.npy'.format(self.chunkCount)), chunk))
+    self.chunkCount += 1
+
+
+  def logEvent(self, event):
+    self.queue.put(('event', os.path.join(self.sessionDirectory, 'events.jsonl'), event))
+
+
+  def close(self, summary=None):
+    self.flush()
+    if summary is not None:
+      summary = dict(summary, samples=self.sampleCount, chunks=self.chunkCount)
+      self.queue.put(('summary', os.path.join(self.sessionDirectory, 'summary'), summary))
+    self.queue.put(None)
+    self.writerThread.join()
+
+
+  def writeFiles(self):
+    while True:
+      item = self.queue.get()
+      if item is None:
+        return
+      kind, path, data = item
+      try:
+        if kind == 'chunk':
+          # chunks appear under their final name only when complete
+          with open(path + '.part', 'wb') as f:
+            numpy.save(f, data)
+          os.rename(path + '.part', path)
+        elif kind == 'event':
+          with open(path, 'a') as f:
+            f.write(json.dumps(data) + '\n')
+        elif kind == 'summary':
+          writeSummary(path, data)
+      except (IOError, OSError) as e:
+        logging.error('Could not write session log file ' + path + ': ' + str(e))
+
+
+#
+# VideoFrameStore
+#
+
+class VideoFrameStore(object):
+  """Webcam frames of a recording session in numbered, memory-mapped chunks of chunkSize frames (frames-*.npy),
+  each with the timestamps of its frames (frameTimestamps-*.npy) as the index. Frames are stamped on the same
+  clock as the tracker samples, so the frame of any sample or cut event is found without reading other frames.
+  """
+
+  def __init__(self, directory, chunkSize=VIDEO_CHUNK_SIZE):
+    self.directory = directory
+    self.chunkSize = chunkSize
+    self.frameCount = 0
+    self.chunkCount = 0
+    self.chunkFrames = None
+    self.chunkTimestamps = None
+    self.chunkFrameCount = 0
+    self.index = None
+    self.readChunks = {}
+
+
+  def addFrame(self, timestamp, frame):
+    """Copies a frame into the current chunk and returns its frame number."""
+    if self.chunkFrames is None or self.chunkFrameCount == self.chunkSize or self.chunkFrames.shape[1:] != frame.shape:
+      self.openChunk(frame.shape, frame.dtype)
+    self.chunkFrames[self.chunkFrameCount] = frame
+    self.chunkTimestamps[self.chunkFrameCount] = timestamp
+    self.chunkFrameCount += 1
+    self.frameCount += 1
+    return self.frameCount - 1
+
+
+  def openChunk(self, frameShape, dtype):
+    self.closeChunk()
+    if not os.path.isdir(self.directory):
+      os.makedirs(self.directory)
+    self.chunkFrames = numpy.lib.format.open_memmap(os.path.join(self.directory, 'frames-{0:05d}.npy'.format(self.chunkCount)),
+      mode='w+', dtype=dtype, shape=(self.chunkSize,) + tuple(frameShape))
+    # slots not filled when the session ends keep a NaN timestamp
+    self.chunkTimestamps = numpy.lib.format.open_memmap(os.path.join(self.directory, 'frameTimestamps-{0:05d}.npy'.format(self.chunkCount)),
+      mode='w+', dtype='f8', shape=(self.chunkSize,))
+    self.chunkTimestamps[:] = numpy.nan
+    self.chunkFrameCount = 0
+    self.chunkCount += 1
+
+
+  def closeChunk(self):
+    if self.chunkFrames is None:
+      return
+    # unmapped without a flush, the OS writes the shared pages back without blocking the recording
+    self.chunkFrames = None
+    self.chunkTimestamps = None
+
+
+  def close(self):
+    self.closeChunk()
+
+
+  def loadIndex(self):
+    """Reads the timestamps of all chunks of the folder, sorted by time."""
+    timestampPaths = sorted(glob.glob(os.path.join(self.directory, 'frameTimestamps-*.npy')))
+    rows = []
+    for timestampPath in timestampPaths:
+      chunkNumber = int(os.path.basename(timestampPath)[len('frameTimestamps-'):-len('.npy')])
+      timestamps = numpy.load(timestampPath)
+      slots = numpy.flatnonzero(numpy.isfinite(timestamps))
+      rows.append(numpy.column_stack([timestamps[slots], numpy.full(len(slots), chunkNumber), slots]))
+    self.index = numpy.concatenate(rows) if rows else numpy.zeros((0, 3))
+    self.index = self.index[numpy.argsort(self.index[:, 0], kind='mergesort')]
+    self.readChunks = {}
+
+
+  def getFrameNumber(self, timestamp):
+    """Number of the last frame at or before timestamp, or of the first frame for earlier timestamps."""
+    if self.index is None:
+      self.loadIndex()
+    if len(self.index) == 0:
+      return None
+    return max(0, numpy.searchsorted(self.index[:, 0], timestamp, side='right') - 1)
+
+
+  def getFrame(self, frameNumber):
+    """Returns the timestamp and the frame, read from the memory-mapped chunk without loading other frames."""
+    if self.index is None:
+      self.loadIndex()
+    timestamp, chunkNumber, slot = self.index[frameNumber]
+    chunkNumber = int(chunkNumber)
+    if chunkNumber not in self.readChunks:
+      self.readChunks[chunkNumber] = numpy.load(os.path.join(self.directory, 'frames-{0:05d}.npy'.format(chunkNumber)), mmap_mode='r')
+    return timestamp, self.readChunks[chunkNumber][int(slot)]
+
+
+  def getFrameAt(self, timestamp):
+    frameNumber = self.getFrameNumber(timestamp)
+    if frameNumber is None:
+      return None, None
+    return self.getFrame(frameNumber)
+
+
+#
+# NodeRegistry
+#
+
+class NodeRegistry(object):
+  """Nodes of a session by role, such as 'TriggerToCutter'. Nodes are held directly, and found by exact name
+  and class only when a role is registered, or after its node was removed from the scene. A node of the same
+  name and class added later replaces the removed one, and observers added through the registry move to it.
+  """
+
+  def __init__(self, scene):
+    self.scene = scene
+    self.nodes = {}
+    self.nodeIDs = {}
+    self.nodeNames = {}
+    self.nodeClasses = {}
+    self.observations = {} # role: list of [event, callback, observer tag]
+    self.sceneObserverTags = [
+      scene.AddObserver(slicer.vtkMRMLScene.NodeAddedEvent, self.onNodeAdded),
+      scene.AddObserver(slicer.vtkMRMLScene.NodeRemovedEvent, self.onNodeRemoved)
+    ]
+
+
+  def findNode(self, name, className):
+    """First node with exactly this name and of this class, without scanning for name patterns."""
+    return self.scene.GetFirstNode(name, className)
+
+
+  def register(self, role, node):
+    previousNode = self.nodes.get(role)
+    if previousNode is not None and previousNode.GetID() != node.GetID():
+      for observation in self.observations.get(role, []):
+        previousNode.RemoveObserver(observation[2])
+        observation[2] = None
+    self.nodes[role] = node
+    self.nodeIDs[role] = node.GetID()
+    self.nodeNames[role] = node.GetName()
+    self.nodeClasses[role] = node.GetClassName()
+    for observation in self.observations.get(role, []):
+      if observation[2] is None:
+        observation[2] = node.AddObserver(observation[0], observation[1])
+
+
+  def registerName(self, role, name, className):
+    """Registers a role whose node may be added to the scene later, e.g. by an OpenIGTLink connection."""
+    node = self.findNode(name, className)
+    if node is not None:
+      self.register(role, node)
+      return
+    self.nodes[role] = None
+    self.nodeIDs[role] = None
+    self.nodeNames[role] = name
+    self.nodeClasses[role] = className
+
+
+  def get(self, role):
+    node = self.nodes.get(role)
+    if node is None and role in self.nodeNames:
+      # removed from the scene, look for a replacement
+      node = self.findNode(self.nodeNames[role], self.nodeClasses[role])
+      if node is not None:
+        self.register(role, node)
+    return node
+
+
+  def getID(self, role):
+    node = self.get(role)
+    return node.GetID() if node is not None else None
+
+
+  def addObserver(self, role, event, callback):
+    observation = [event, callback, None]
+    self.observations.setdefault(role, []).append(observation)
+    node = self.get(role)
+    if node is not None:
+      observation[2] = node.AddObserver(event, callback)
+
+
+  def removeObserver(self, role, callback):
+    node = self.nodes.get(role)
+    for observation in list(self.observations.get(role, [])):
+      if observation[1] == callback:
+        if node is not None and observation[2] is not None:
+          node.RemoveObserver(observation[2])
+        self.observations[role].remove(observation)
+
+
+  def removeSceneObservers(self):
+    for tag in self.sceneObserverTags:
+      self.scene.RemoveObserver(tag)
+    self.sceneObserverTags = []
+
+
+  def removeAllObservers(self):
+    """Removes the node observers added through the registry and the scene observers, so nodes added later are not adopted."""
+    for role, observations in self.observations.items():
+      node = self.nodes.get(role)
+      for observation in observations:
+        if node is not None and observation[2] is not None:
+          node.RemoveObserver(observation[2])
+    self.observations = {}
+    self.removeSceneObservers()
+
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeRemoved(self, caller, event, removedNode):
+    for role, nodeID in self.nodeIDs.items():
+      node = self.nodes.get(role)
+      if node is not None and nodeID == removedNode.GetID():
+        # the node may be added back, it must not keep the observers when they move to a replacement
+        for observation in self.observations.get(role, []):
+          if observation[2] is not None:
+            node.RemoveObserver(observation[2])
+          observation[2] = None
+        self.nodes[role] = None
+
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeAdded(self, caller, event, addedNode):
+    for role, node in self.nodes.items():
+      if node is None and addedNode.GetName() == self.nodeNames[role] and addedNode.IsA(self.nodeClasses[role]):
+        self.register(role, addedNode)
+
+
+#
+# AssetCache
+#
+
+class AssetCache(object):
+  """Binary cache of parsed CAD models and fiducial lists, keyed by a hash of the source file.
+  Models are stored as uncompressed .vtp files with their point colors baked in,
+  fiducial positions as .npy arrays.
+  """
+
+  def __init__(self, cacheDirectory):
+    self.cacheDirectory = cacheDirectory
+    if not os.path.isdir(self.cacheDirectory):
+      os.makedirs(self.cacheDirectory)
+
+
+  def getCachePath(self, sourcePath, extension, *keyParts):
+    sha = hashlib.sha1(ASSET_CACHE_VERSION.encode())
+    for keyPart in keyParts:
+      sha.update(str(keyPart).encode())
+    with open(sourcePath, 'rb') as f:
+      sha.update(f.read())
+    return os.path.join(self.cacheDirectory, sha.hexdigest() + extension)
+
+
+  def getPolyData(self, sourcePath, pointScalarValue=None):
+    """Reads an STL model, with an integer point scalar array set to pointScalarValue if specified."""
+    cachePath = self.getCachePath(sourcePath, '.vtp', pointScalarValue)
+    if os.path.exists(cachePath):
+      reader = vtk.vtkXMLPolyDataReader()
+      reader.SetFileName(cachePath)
+      reader.Update()
+      return reader.GetOutput()
+
+    reader = vtk.vtkSTLReader()
+    reader.SetFileName(sourcePath)
+    reader.Update()
+    poly = reader.GetOutput()
+    if pointScalarValue is not None:
+      colors = vtk.vtkIntArray()
+      colors.SetNumberOfValues(poly.GetNumberOfPoints())
+      colors.FillComponent(0, pointScalarValue)
+      poly.GetPointData().SetScalars(colors)
+
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetFileName(cachePath)
+    writer.SetInputData(poly)
+    writer.SetDataModeToAppended()
+    writer.EncodeAppendedDataOff()
+    writer.SetCompressorTypeToNone()
+    if not writer.Write():
+      logging.warning('Could not write asset cache file ' + cachePath)
+    return poly
+
+
+  def getFiducialPositions(self, sourcePath):
+    """Reads the positions of a markups fiducial list (.fcsv) as an (N,3) array."""
+    cachePath = self.getCachePath(sourcePath, '.npy')
+    if os.path.exists(cachePath):
+      return numpy.load(cachePath)
+
+    positions = []
+    with open(sourcePath, 'r') as f:
+      for row in csv.reader(line for line in f if not line.startswith('#')):
+        if len(row) > 3:
+          positions.append([float(row[1]), float(row[2]), float(row[3])])
+    positions = numpy.array(positions, dtype=float).reshape(-1, 3)
+    numpy.save(cachePath, positions)
+    return positions
+
+
+#
+# RenderMonitor
+#
+
+class RenderMonitor(object):
+  """Frame rate cap and render latency measurement of the 3D views, shared by all sessions as the views are.
+  The original rates of the views are kept once and restored when the last session is removed.
+  """
+
+  def __init__(self, maximumRenderRate=MAXIMUM_RENDER_RATE_FPS):
+    self.maximumRenderRate = maximumRenderRate
+    self.defaultRenderRates = {} # view: maximum update rate before the cap was applied
+    self.renderObservation = None
+    self.sessions = []
+
+
+  def addSession(self, logic):
+    if logic not in self.sessions:
+      self.sessions.append(logic)
+    self.addRenderObserver()
+    self.setMaximumRenderRate(self.maximumRenderRate)
+
+
+  def removeSession(self, logic):
+    if logic in self.sessions:
+      self.sessions.remove(logic)
+    if not self.sessions:
+      self.removeRenderObserver()
+      self.restoreRenderRate()
+
+
+  def getThreeDViews(self):
+    layoutManager = slicer.app.layoutManager()
+    if layoutManager is None:
+      return []
+    return [layoutManager.threeDWidget(i).threeDView() for i in range(layoutManager.threeDViewCount)]
+
+
+  def setMaximumRenderRate(self, fps):
+    """Caps the frame rate of the 3D views, render requests in between are merged into the next render."""
+    self.maximumRenderRate = fps
+    for view in self.getThreeDViews():
+      if view not in self.defaultRenderRates:
+        self.defaultRenderRates[view] = view.maximumUpdateRate
+      view.maximumUpdateRate = fps
+
+
+  def restoreRenderRate(self):
+    for view, fps in self.defaultRenderRates.items():
+      view.maximumUpdateRate = fps
+    self.defaultRenderRates = {}
+
+
+  def addRenderObserver(self):
+    """Measures the time from the tracking callback of the latest sample of each session to the end of the next 3D view render."""
+    layoutManager = slicer.app.layoutManager()
+    if self.renderObservation is not None or layoutManager is None or layoutManager.threeDWidget(0) is None:
+      return
+    renderWindow = layoutManager.threeDWidget(0).threeDView().renderWindow()
+    self.renderObservation = (renderWindow, renderWindow.AddObserver(vtk.vtkCommand.EndEvent, self.onRenderEnd))
+
+
+  def removeRenderObserver(self):
+    if self.renderObservation is not None:
+      self.renderObservation[0].RemoveObserver(self.renderObservation[1])
+      self.renderObservation = None
+
+
+  def onRenderEnd(self, caller, event):
+    renderTime = time.time()
+    for logic in self.sessions:
+      if logic.renderPendingCallbackTime is None:
+        continue
+      logic.profiler.addDuration('callbackToRender', renderTime - logic.renderPendingCallbackTime)
+      logic.renderPendingCallbackTime = None
 
 
 #
@@ -348,21 +1491,115 @@ class VesselHarvestingTutorWidget(ScriptedLoadableModuleWidget):
 #
 
 class VesselHarvestingTutorLogic(ScriptedLoadableModuleLogic):
+  """Scores one practice session, on the tracked tools of one station. The incoming transforms of a session
+  are the nodes referenced by its parameter node, see setInputNode, so the sessions of several stations can be
+  scored in one scene whatever their OpenIGTLink device names. Nodes the session creates are named with the
+  session name as prefix, including default input transforms until other nodes are selected.
+  Vessel geometry and locators are shared by all sessions, they are not modified after loading.
+  """
+
+  sharedVesselSets = {}
+  sharedAssetCache = None
+  sharedRenderMonitor = None
 
   
-  def __init__(self):
+  def __init__(self, sessionName=''):
+    self.sessionName = sessionName
+    self.parameterNode = None
+    self.nodes = None # NodeRegistry of the session, created with the transforms
+    self.sampleBuffer = SampleRingBuffer(SAMPLE_BUFFER_SIZE, SAMPLE_DTYPE)
+    self.trajectory = TrajectoryStore(SAMPLE_DTYPE)
+    self.pathSimplifier = PathSimplifier()
+    self.coverage = None # CoverageMap around the main vessel, created with the vessel set
+    self.coveragePolydata = None # main vessel colored by coverage
+    self.coverageCells = None # coverage cell of each point of the main vessel
+    self.coverageModified = False
     self.resetMetrics()
     self.tutorRunning = False
     self.modelPolydata = {}
     self.visiblePolydata = {}
+    self.clippedPolydata = {}
     self.SKELETON_MODEL_NAME = 'Skeleton Model'
-    self.lastCutTimestamp = time.time()
+    self.latestTimestamp = None # tracker timestamp of the latest frame
+    self.latestCallbackTime = None
+    self.renderPendingCallbackTime = None # callback time of the latest sample handed to the renderer
+    self.skeletonModelPending = False
+    self.branchCutRadius = BRANCH_CUT_RADIUS
+    self.cutDebounceSec = CUT_DEBOUNCE_SEC
+    self.replayTimestamp = None # recorded timestamp of the frame being replayed, None when tracking live
+    self.sessionLogger = None
+    self.videoStore = None
+    self.vesselSets = VesselHarvestingTutorLogic.sharedVesselSets
+    self.vesselSetName = DEFAULT_VESSEL_SET
+
+    # Objects reused by the tracking callback, so no VTK objects are allocated per tracker frame
+    self.cutterTipWorld = [0,0,0,0]
+    self.shaftDirection_Cutter = [0,1,0]
+    self.triggerDirection_Trigger = [1,0,0]
+    self.openAngle = 0.0
+    self.displayedOpenAngle = None
+    self.cutterMovingToTipTransform = vtk.vtkTransform()
+    self.vesselToRas = vtk.vtkMatrix4x4()
+    self.cutterToRas = vtk.vtkMatrix4x4()
+    self.vesselToRasElements = [0.0] * 16
+    self.cutterToRasElements = [0.0] * 16
+    self.cutterTipToVesselModel = vtk.vtkMatrix4x4()
+    self.rasToVesselModel = vtk.vtkMatrix4x4()
+    self.jawIntersectionPoints = vtk.vtkPoints()
+    self.targetAngleRange = TARGET_ANGLE_RANGE
+    self.recenteringEnabled = False
+    self.recenteringOffset = numpy.zeros(3) # translation of the vessel model in model coordinates
+    self.vesselAxisPoints = numpy.zeros((0, 3)) # in vessel model coordinates
+    self.vesselModelToVesselCalibration = vtk.vtkMatrix4x4()
+    self.calibratedVesselModelToRas = vtk.vtkMatrix4x4()
+    self.recenteredVesselModelToVessel = vtk.vtkTransform()
+    self.retractorReferenceRas = [0,0,0,0]
+
+    self.profiler = StageProfiler()
+    self.trackerEventCount = 0
+    self.trackerFrameCount = 0
+    self.unstampedFrameCount = 0 # live frames timed by the callback, the tracker sent no timestamp
+    self.jawsClosed = False
+
+    self.visualizationTimer = qt.QTimer()
+    self.visualizationTimer.setInterval(VISUALIZATION_INTERVAL_MS)
+    self.visualizationTimer.connect('timeout()', self.updateVisualization)
+
+
+  def cleanup(self):
+    """Stops the visualization timer and the session log, and removes the observers of this session."""
+    self.visualizationTimer.stop()
+    self.stopSessionLog()
+    if self.nodes is not None:
+      self.nodes.removeAllObservers()
+    self.getRenderMonitor().removeSession(self)
+
+
+  def getNodeName(self, name):
+    return self.sessionName + name
+
+
+  def getSessionParameterNode(self):
+    """Parameter node of this session, the default session uses the parameter node of the module."""
+    if self.parameterNode is None or self.parameterNode.GetScene() is None:
+      singletonTag = 'VesselHarvestingTutor' + self.sessionName
+      # an existing parameter node of the same session is reused with its input references
+      self.parameterNode = slicer.mrmlScene.GetSingletonNode(singletonTag, 'vtkMRMLScriptedModuleNode')
+      if self.parameterNode is None:
+        self.parameterNode = slicer.vtkMRMLScriptedModuleNode()
+        self.parameterNode.SetName(self.getNodeName('VesselHarvestingTutor'))
+        self.parameterNode.SetModuleName('VesselHarvestingTutor')
+        self.parameterNode.SetSingletonTag(singletonTag)
+        self.parameterNode = slicer.mrmlScene.AddNode(self.parameterNode)
+      self.parameterNode.SetParameter('SessionName', self.sessionName)
+    return self.parameterNode
 
 
   def resetModels(self):
     print 'Resetting models'
-    for i in range(0, NUM_MODELS):
-      self.visiblePolydata['Model_' + str(i)] = True
+    for name in self.modelPolydata:
+      self.visiblePolydata[name] = True
+    self.clippedPolydata = {}
     self.updateSkeletonModel()
     
 
@@ -376,397 +1613,972 @@ class VesselHarvestingTutorLogic(ScriptedLoadableModuleLogic):
       'maxAngle': 0,
       'trajectorySlope': 0,
       'branchesCut': 0,
-      'cutDistances': []
+      'cutDistances': [],
+      'stumpLengths': []
     }
-    self.pathFiducialsX = []
-    self.pathFiducialsY = []
-    self.path = []
-    self.lastTimestamp = time.time()
-      
-    # remove existing fiducials if they exist 
-    fidNode = slicer.util.getNode('MarkupsFiducial_*')
-    if fidNode != None:
-      fidNode = slicer.util.getNode('MarkupsFiducial_*')
-    slicer.mrmlScene.RemoveNode(fidNode)
+    self.cutDistanceStatistics = RunningStatistics()
+    self.stumpLengthStatistics = RunningStatistics()
+    self.trajectoryFit = RunningLinearFit()
+    if self.coverage is not None:
+      self.coverage.reset()
+      self.coverageModified = True
+    self.trajectory.clear()
+    self.sampleBuffer.clear()
+    self.pathSimplifier.reset()
+    # both on the tracker clock, set by the first frames of the session
+    self.sessionStartTimestamp = None
+    self.lastCutTimestamp = float('-inf')
+    # tracker frame of the latest sample, the messages of a frame update the same sample
+    self.frameTimestamp = None
+    self.frameTriggerMTime = None
+    self.frameCallbackTime = None
+    # tracker frame that closed the jaws, a closure cuts at most one branch
+    self.closureFrame = None
+    self.closureCut = False
+
+
+  def getTransformNode(self, role, filePath=None):
+    """Finds the transform of a role by its name in the session, or creates it, from a file if given."""
+    transformNode = self.nodes.findNode(self.getNodeName(role), 'vtkMRMLTransformNode')
+    if transformNode is None:
+      if filePath is not None:
+        [success, transformNode] = slicer.util.loadTransform(filePath, returnNode=True)
+      else:
+        transformNode = slicer.mrmlScene.AddNode(slicer.vtkMRMLLinearTransformNode())
+      transformNode.SetName(self.getNodeName(role))
+    self.nodes.register(role, transformNode)
+    return transformNode
 
 
   def loadTransforms(self):
     moduleDir = os.path.dirname(slicer.modules.vesselharvestingtutor.path)
-
-    vesselToRetractor = slicer.util.getNode('VesselToRetractor')
-    if vesselToRetractor == None:
-      vesselToRetractor = slicer.vtkMRMLLinearTransformNode()
-      vesselToRetractor.SetName('VesselToRetractor')
-      slicer.mrmlScene.AddNode(vesselToRetractor)
-    
-    vesselModelToVessel = slicer.util.getNode('VesselModelToVessel') 
-    if vesselModelToVessel == None: 
-      vesselModelToVessel = slicer.vtkMRMLLinearTransformNode()
-      vesselModelToVessel.SetName('VesselModelToVessel')
-      slicer.mrmlScene.AddNode(vesselModelToVessel)
-    vesselModelToVessel.SetAndObserveTransformNodeID(vesselToRetractor.GetID())
-
-    triggerToCutter = slicer.util.getNode('TriggerToCutter')
-    if triggerToCutter == None:
-      triggerToCutter = slicer.vtkMRMLLinearTransformNode()
-      triggerToCutter.SetName('TriggerToCutter')
-      slicer.mrmlScene.AddNode(triggerToCutter)
-    
-    cutterToRetractor = slicer.util.getNode('CutterToRetractor')
-    if cutterToRetractor == None:
-      cutterToRetractor = slicer.vtkMRMLLinearTransformNode()
-      cutterToRetractor.SetName('CutterToRetractor')
-      slicer.mrmlScene.AddNode(cutterToRetractor)
-    
-    cutterMovingToTip = slicer.util.getNode('CutterMovingToCutterTip')
-    if cutterMovingToTip == None:
-      cutterMovingToTip = slicer.vtkMRMLLinearTransformNode()
-      cutterMovingToTip.SetName('CutterMovingToCutterTip')
-      slicer.mrmlScene.AddNode(cutterMovingToTip)
-    
-    cutterTipToCutter = slicer.util.getNode('CutterTipToCutter')
-    if cutterTipToCutter == None:
-      filePath = os.path.join(moduleDir, os.pardir, 'Transforms', 'CutterTipToCutter.h5')
-      [success, cutterTipToCutter] = slicer.util.loadTransform(filePath, returnNode=True)
-      cutterTipToCutter.SetName('CutterTipToCutter')
-
-    cameraToRetractor = slicer.util.getNode('CameraToRetractor')
-    if cameraToRetractor == None:
-      filePath = os.path.join(moduleDir, os.pardir, 'Transforms', 'CameraToRetractor.h5')
-      [success, cameraToRetractor] = slicer.util.loadTransform(filePath, returnNode=True)
-      cameraToRetractor.SetName('CameraToRetractor')
-
-    defaultSceneCamera = slicer.util.getNode('Default Scene Camera')
+    if self.nodes is None:
+      self.nodes = NodeRegistry(slicer.mrmlScene)
+
+    parameterNode = self.getSessionParameterNode()
+    for role in REPLAY_TRANSFORM_NAMES:
+      inputNode = parameterNode.GetNodeReference(role)
+      if inputNode is not None:
+        self.nodes.register(role, inputNode)
+      else:
+        inputNode = self.getTransformNode(role)
+      parameterNode.SetNodeReferenceID(role, inputNode.GetID())
+    vesselModelToVessel = self.getTransformNode('VesselModelToVessel')
+    cutterMovingToTip = self.getTransformNode('CutterMovingToCutterTip')
+    cutterTipToCutter = self.getTransformNode('CutterTipToCutter', os.path.join(moduleDir, os.pardir, 'Transforms', 'CutterTipToCutter.h5'))
+    cameraToRetractor = self.getTransformNode('CameraToRetractor', os.path.join(moduleDir, os.pardir, 'Transforms', 'CameraToRetractor.h5'))
+
+    defaultSceneCamera = self.nodes.findNode('Default Scene Camera', 'vtkMRMLCameraNode')
     cameraToRetractorID = cameraToRetractor.GetID()
-    defaultSceneCamera.SetAndObserveTransformNodeID(cameraToRetractorID)
+    # no camera when running without a main window, when several sessions are loaded the first one moves the camera
+    if defaultSceneCamera and not defaultSceneCamera.GetTransformNodeID():
+      defaultSceneCamera.SetAndObserveTransformNodeID(cameraToRetractorID)
 
-    cutterToRetractorID = cutterToRetractor.GetID()
     # Create and set fiducial point on the cutter tip, used to calculate distance metrics
-    fidNode = slicer.util.getNode("F")
+    fidNode = self.nodes.findNode(self.getNodeName('F'), 'vtkMRMLMarkupsFiducialNode')
+    if fidNode == None:
+      fidNode = slicer.vtkMRMLMarkupsFiducialNode()
+      fidNode.SetName(self.getNodeName('F'))
+      slicer.mrmlScene.AddNode(fidNode)
+      fidNode.AddFiducial(0, 0, 0)
     fidNode.SetNthFiducialVisibility(0, 0)    
     fidNode.SetAndObserveTransformNodeID(cutterTipToCutter.GetID())
+    self.nodes.register('CutterTipFiducial', fidNode)
 
-    cutterTipToCutter.SetAndObserveTransformNodeID(cutterToRetractorID)
-    triggerToCutter.SetAndObserveTransformNodeID(cutterToRetractorID)
     cutterMovingToTip.SetAndObserveTransformNodeID(cutterTipToCutter.GetID())
-    triggerToCutter.AddObserver(slicer.vtkMRMLLinearTransformNode.TransformModifiedEvent, self.updateTransforms)
+    self.connectInputTransforms()
+    self.addTrackingObservers()
+    # webcam image streamed by PLUS, may connect later or not at all
+    webcamNode = parameterNode.GetNodeReference('Webcam')
+    if webcamNode is not None:
+      self.nodes.register('Webcam', webcamNode)
+    else:
+      self.nodes.registerName('Webcam', self.getNodeName(WEBCAM_DEVICE_NAME), 'vtkMRMLVolumeNode')
+    self.nodes.addObserver('Webcam', slicer.vtkMRMLVolumeNode.ImageDataModifiedEvent, self.onWebcamFrame)
+    self.getRenderMonitor().addSession(self)
+    self.visualizationTimer.start()
+
+
+  def connectInputTransforms(self):
+    """Places the tool models of the session under its input transforms."""
+    cutterToRetractorID = self.nodes.getID('CutterToRetractor')
+    self.nodes.get('TriggerToCutter').SetAndObserveTransformNodeID(cutterToRetractorID)
+    self.nodes.get('CutterTipToCutter').SetAndObserveTransformNodeID(cutterToRetractorID)
+    self.nodes.get('VesselModelToVessel').SetAndObserveTransformNodeID(self.nodes.getID('VesselToRetractor'))
+
+
+  def setInputNode(self, role, node):
+    """Streams the transform of a role of REPLAY_TRANSFORM_NAMES, or the 'Webcam' image, from the given node,
+    e.g. the CutterToRetractor node of the OpenIGTLink connection of a station. The observers move to the node.
+    """
+    self.nodes.register(role, node)
+    self.getSessionParameterNode().SetNodeReferenceID(role, node.GetID())
+    self.connectInputTransforms()
 
 
-  def loadModels(self):
-    
+  def addTrackingObservers(self):
+    # the observers follow the nodes if they are replaced, e.g. by a reconnected OpenIGTLink connector
+    for role in TRACKING_OBSERVER_ROLES:
+      self.nodes.addObserver(role, slicer.vtkMRMLLinearTransformNode.TransformModifiedEvent, self.updateTransforms)
+
+
+  def removeTrackingObservers(self):
+    for role in TRACKING_OBSERVER_ROLES:
+      self.nodes.removeObserver(role, self.updateTransforms)
+
+
+  def getAssetCache(self):
+    if VesselHarvestingTutorLogic.sharedAssetCache is None:
+      VesselHarvestingTutorLogic.sharedAssetCache = AssetCache(os.path.join(slicer.app.temporaryPath, 'VesselHarvestingTutorAssetCache'))
+    return VesselHarvestingTutorLogic.sharedAssetCache
+
+
+  def getRenderMonitor(self):
+    if VesselHarvestingTutorLogic.sharedRenderMonitor is None:
+      VesselHarvestingTutorLogic.sharedRenderMonitor = RenderMonitor()
+    return VesselHarvestingTutorLogic.sharedRenderMonitor
+
+
+  def loadCadModel(self, role, fileName, color):
+    modelNode = self.nodes.findNode(self.getNodeName(role), 'vtkMRMLModelNode')
+    if modelNode == None:
+      moduleDir = os.path.dirname(slicer.modules.vesselharvestingtutor.path)
+      modelFilePath = os.path.join(moduleDir, os.pardir, 'CadModels', fileName)
+      modelNode = slicer.modules.models.logic().AddModel(self.getAssetCache().getPolyData(modelFilePath))
+      modelNode.SetName(self.getNodeName(role))
+      modelNode.GetDisplayNode().SetColor(color)
+    self.nodes.register(role, modelNode)
+    return modelNode
+
+
+  def loadMarkups(self, role, fileName):
+    markupsNode = self.nodes.findNode(self.getNodeName(role), 'vtkMRMLMarkupsFiducialNode')
+    if markupsNode is None:
+      moduleDir = os.path.dirname(slicer.modules.vesselharvestingtutor.path)
+      [success, markupsNode] = slicer.util.loadMarkupsFiducialList(os.path.join(moduleDir, os.pardir, 'CadModels', 'vessel', fileName), returnNode=True)
+      markupsNode.SetName(self.getNodeName(role))
+    self.nodes.register(role, markupsNode)
+    return markupsNode
+
+
+  def buildAssetCache(self):
+    """Parses all CAD models and fiducial lists once, so later module startups only read the binary cache.
+    Run by Data Analysis/buildAssetCache.py when a training cart is set up.
+    """
     moduleDir = os.path.dirname(slicer.modules.vesselharvestingtutor.path)
-    self.retractorModel= slicer.util.getNode('RetractorModel')
-    if not self.retractorModel:
-      modelFilePath = os.path.join(moduleDir, os.pardir,'CadModels', 'VesselRetractorHead.stl')
-      [success, self.retractorModel] = slicer.util.loadModel(modelFilePath, returnNode=True)
-      self.retractorModel.SetName('RetractorModel')
-      self.retractorModel.GetDisplayNode().SetColor(0.9, 0.9, 0.9)
-    
-    self.cutterBaseModel = slicer.util.getNode('CutterBaseModel')
-    if self.cutterBaseModel == None:
-      modelFilePath = os.path.join(moduleDir, os.pardir, 'CadModels', 'CutterBaseModel.stl')
-      [success, self.cutterBaseModel] = slicer.util.loadModel(modelFilePath, returnNode=True)
-      self.cutterBaseModel.SetName('CutterBaseModel')
-      self.cutterBaseModel.GetDisplayNode().SetColor(0.8, 0.9, 1.0)
-
-    cutterTipToCutter = slicer.util.getNode('CutterTipToCutter')
-    if cutterTipToCutter == None:
-      logging.error('Load transforms before models!')
-      return
-    self.cutterBaseModel.SetAndObserveTransformNodeID(cutterTipToCutter.GetID())
-    
-    self.cutterMovingModel = slicer.util.getNode('CutterMovingModel')
-    if self.cutterMovingModel == None:
-      modelFilePath = os.path.join(moduleDir, os.pardir, 'CadModels', 'CutterMovingModel.stl')
-      [success, self.cutterMovingModel] = slicer.util.loadModel(modelFilePath, returnNode=True)
-      self.cutterMovingModel.SetName('CutterMovingModel')
-      self.cutterMovingModel.GetDisplayNode().SetColor(0.8, 0.9, 1.0)
-
-    cutterMovingToTip = slicer.util.getNode('CutterMovingToCutterTip')
-    if cutterMovingToTip == None:
+    cache = self.getAssetCache()
+    for fileName in ['VesselRetractorHead.stl', 'CutterBaseModel.stl', 'CutterMovingModel.stl']:
+      cache.getPolyData(os.path.join(moduleDir, os.pardir, 'CadModels', fileName))
+    cache.getFiducialPositions(os.path.join(moduleDir, os.pardir, 'CadModels', 'vessel', 'Vessel Axis.fcsv'))
+    for setName in self.getVesselSetNames():
+      self.loadVesselSet(setName)
+
+
+  def loadModels(self):
+    if self.nodes is None or self.nodes.get('CutterTipToCutter') is None:
       logging.error('Load transforms before models!')
       return
-    self.cutterMovingModel.SetAndObserveTransformNodeID(cutterMovingToTip.GetID())
-	
-    self.vesselModelToVessel = slicer.util.getNode('VesselModelToVessel')
-    if not self.vesselModelToVessel:
-      transformFilePath = os.path.join(moduleDir, os.pardir,'Transforms', 'VesselModelToVessel.h5')
-      [success, self.vesselModelToVessel] = slicer.util.loadTransform(transformFilePath, returnNode=True)
-      if success == False:
-        logging.error('Could not read needle tip to needle transform!')
-      else:
-        self.vesselModelToVessel.SetName("VesselModelToVessel")
-    vesselToRetractor = slicer.util.getNode('VesselToRetractor')
-    
-    vesselID = self.vesselModelToVessel.GetID()
-    # get transform to world from vesselID
-    vesselToWorld = self.vesselModelToVessel.GetTransformToParent()
-    skeletonModel = slicer.util.getNode(self.SKELETON_MODEL_NAME)
+    cutterTipToCutterID = self.nodes.getID('CutterTipToCutter')
+    vesselID = self.nodes.getID('VesselModelToVessel')
+
+    self.loadCadModel('RetractorModel', 'VesselRetractorHead.stl', (0.9, 0.9, 0.9))
+    self.loadCadModel('CutterBaseModel', 'CutterBaseModel.stl', (0.8, 0.9, 1.0)).SetAndObserveTransformNodeID(cutterTipToCutterID)
+    self.loadCadModel('CutterMovingModel', 'CutterMovingModel.stl', (0.8, 0.9, 1.0)).SetAndObserveTransformNodeID(self.nodes.getID('CutterMovingToCutterTip'))
+
+    skeletonModel = self.nodes.findNode(self.getNodeName(self.SKELETON_MODEL_NAME), 'vtkMRMLModelNode')
     if skeletonModel == None: 
       skeletonModel = slicer.mrmlScene.AddNode(slicer.vtkMRMLModelNode())
-      skeletonModel.SetName(self.SKELETON_MODEL_NAME)
+      skeletonModel.SetName(self.getNodeName(self.SKELETON_MODEL_NAME))
       skeletonModel.CreateDefaultDisplayNodes()
       skeletonModel.GetDisplayNode().SetScalarVisibility(True)
-      vesselModelToVessel = slicer.util.getNode('VesselModelToVessel') 
-      skeletonModel.SetAndObserveTransformNodeID(vesselID)
-
+    skeletonModel.SetAndObserveTransformNodeID(vesselID)
+    self.nodes.register('SkeletonModel', skeletonModel)
 
     #load vessel
-    appender = vtk.vtkAppendPolyData()
-    self.vesselModel = slicer.util.getNode('Model_0')
-    self.vesselModelToVesselID = slicer.util.getNode('VesselModelToVessel').GetID()
-    self.branchStartsFiducialsNode = slicer.mrmlScene.CreateNodeByClass('vtkMRMLMarkupsFiducialNode')
-    
-    if not self.vesselModel: 
-      for i in range(NUM_MODELS): 
-        if i > 0: # load points for vessel branch
-          fiducialFilename = 'Points_' + str(i) + '.fcsv'
-          fiducialFilePath = os.path.join(moduleDir, os.pardir,'CadModels/vessel', fiducialFilename)
-          slicer.util.loadMarkupsFiducialList(fiducialFilePath)
-          fiducialNode = slicer.util.getNode('Points_' + str(i))
-          world = [0,0,0]
-          fiducialNode.GetNthFiducialPosition(0,world)
-          self.branchStartsFiducialsNode.AddFiducial(world[0], world[1], world[2])
-          self.branchStartsFiducialsNode.SetNthFiducialVisibility(i-1, 0) 
-          fiducialNode.SetAndObserveTransformNodeID(self.vesselModelToVesselID)
-
-        # load stl file for vessel branch 
-        filename = 'Model_' + str(i) + '.stl' 
-        filePath = os.path.join(moduleDir, os.pardir,'CadModels/vessel', filename)
-        [success, vesselBranch] = slicer.util.loadModel(filePath, returnNode=True)
-        poly = vesselBranch.GetPolyData()
-
-        # set vessel color to red 
-        colors = vtk.vtkIntArray()
-        numPoints = poly.GetNumberOfPoints()
-        colors.SetNumberOfValues(numPoints)
-        for j in range(numPoints):
-          colors.SetValue(j, 3) # 3 = red 
-        poly.GetPointData().SetScalars(colors)
-        
-        self.modelPolydata['Model_' + str(i)] = poly
-        self.visiblePolydata['Model_' + str(i)] = True 
-        transformFilter = vtk.vtkTransformPolyDataFilter()
-        transformFilter.SetTransform(vesselToWorld) # transform used here 
-        transformFilter.SetInputData(poly)
-        transformFilter.Update()
-        appender.AddInputData(transformFilter.GetOutput())
-        slicer.mrmlScene.RemoveNode(vesselBranch)
-      appender.Update()
-      skeletonModel.SetAndObservePolyData(appender.GetOutput()) 
-
-      slicer.mrmlScene.AddNode(self.branchStartsFiducialsNode)
-      fidNode = slicer.util.getNode("MarkupsFiducial_*")
-      fidNode.SetName("Vessel Branch Starts")
-      fidNode.SetAndObserveTransformNodeID(vesselID)
-
-      # load fiducials to keep vessel model in camera view
-      # load fiducials on vessel axis
-      axisfiducialFilename = 'Vessel Axis.fcsv'
-      axisfiducialFilePath = os.path.join(moduleDir, os.pardir,'CadModels/vessel', axisfiducialFilename)
-      slicer.util.loadMarkupsFiducialList(axisfiducialFilePath)
-      axisfiducialNode = slicer.util.getNode('Vessel Axis')
-      axisfiducialNode.SetAndObserveTransformNodeID(self.vesselModelToVesselID)
-      # load the reference 
-      retractorfiducialFilename = 'Retractor Reference.fcsv'
-      retractorfiducialFilePath = os.path.join(moduleDir, os.pardir,'CadModels/vessel', retractorfiducialFilename)
-      slicer.util.loadMarkupsFiducialList(retractorfiducialFilePath)      
-
-
-  def calculateVesselToRetractorAngle(self, vesselVector, retractorVector):
-    angleRadians = vtk.vtkMath.AngleBetweenVectors(vesselVector[0:3], retractorVector[0:3])
-    angleDegrees = round(vtk.vtkMath.DegreesFromRadians(angleRadians), 1)
-    if self.metrics['maxAngle'] < angleDegrees:
-      self.metrics['maxAngle'] = angleDegrees
-    elif self.metrics['minAngle'] > angleDegrees:
-      self.metrics['minAngle'] = angleDegrees
-  
-  
-  def updateTransforms(self, event, caller):
-    triggerToCutter = slicer.mrmlScene.GetFirstNodeByName('TriggerToCutter')    
-    if triggerToCutter == None:
-      logging.error('Could not found TriggerToCutter!')
+    self.skeletonAppender = vtk.vtkAppendPolyData()
+    self.skeletonAppender.UserManagedInputsOn()
+    self.skeletonInputIndices = {}
+    self.skeletonInputPolydata = {}
+    # Placeholder input for hidden branches, carries the same scalar array so appended colors are kept
+    self.emptyPolydata = vtk.vtkPolyData()
+    self.emptyPolydata.SetPoints(vtk.vtkPoints())
+    self.emptyPolydata.GetPointData().SetScalars(vtk.vtkIntArray())
+    skeletonModel.SetAndObservePolyData(self.skeletonAppender.GetOutput()) 
+
+    branchStartsFiducialsNode = self.nodes.findNode(self.getNodeName('Vessel Branch Starts'), 'vtkMRMLMarkupsFiducialNode')
+    if branchStartsFiducialsNode is None:
+      branchStartsFiducialsNode = slicer.mrmlScene.AddNode(slicer.vtkMRMLMarkupsFiducialNode())
+      branchStartsFiducialsNode.SetName(self.getNodeName('Vessel Branch Starts'))
+    branchStartsFiducialsNode.SetAndObserveTransformNodeID(vesselID)
+    self.nodes.register('BranchStarts', branchStartsFiducialsNode)
+
+    # load fiducials to keep vessel model in camera view
+    # load fiducials on vessel axis
+    self.loadMarkups('VesselAxis', 'Vessel Axis.fcsv').SetAndObserveTransformNodeID(vesselID)
+    moduleDir = os.path.dirname(slicer.modules.vesselharvestingtutor.path)
+    self.vesselAxisPoints = self.getAssetCache().getFiducialPositions(os.path.join(moduleDir, os.pardir, 'CadModels', 'vessel', 'Vessel Axis.fcsv'))
+    # load the reference 
+    self.loadMarkups('RetractorReference', 'Retractor Reference.fcsv')
 
-    triggerToCutterTransform = triggerToCutter.GetTransformToParent()    
-    angles = triggerToCutterTransform.GetOrientation()    
+    # dissection coverage is shown on the main vessel through the colors of the skeleton model
+    skeletonModel.GetDisplayNode().SetAndObserveColorNodeID(self.getCoverageColorNode().GetID())
+    skeletonModel.GetDisplayNode().SetScalarRangeFlag(slicer.vtkMRMLDisplayNode.UseColorNodeScalarRange)
+    self.setVesselSet(self.vesselSetName)
 
-    shaftDirection_Cutter = [0,1,0]
-    triggerDirection_Trigger = [1,0,0]
-    triggerDirection_Cutter = triggerToCutterTransform.TransformFloatVector(triggerDirection_Trigger)    
 
-    triggerAngle_Rad = vtk.vtkMath().AngleBetweenVectors(triggerDirection_Cutter, shaftDirection_Cutter)
-    triggerAngle_Deg = vtk.vtkMath().DegreesFromRadians(triggerAngle_Rad)
-    
+  def getCoverageColorNode(self):
+    """Color table of the skeleton model: vessel scalars below COVERAGE_SCALAR_OFFSET are red as before,
+    coverage levels go from red to green.
+    """
+    colorNode = self.nodes.findNode(self.getNodeName('Coverage Colors'), 'vtkMRMLColorTableNode')
+    if colorNode is None:
+      colorNode = slicer.vtkMRMLColorTableNode()
+      colorNode.SetName(self.getNodeName('Coverage Colors'))
+      colorNode.SetTypeToUser()
+      colorNode.HideFromEditorsOn()
+      colorNode.SetNumberOfColors(COVERAGE_SCALAR_OFFSET + COVERAGE_LEVELS)
+      colorNode.GetLookupTable().SetTableRange(0, COVERAGE_SCALAR_OFFSET + COVERAGE_LEVELS - 1)
+      for i in range(COVERAGE_SCALAR_OFFSET):
+        colorNode.SetColor(i, 'Vessel', 1.0, 0.0, 0.0, 1.0)
+      for level in range(COVERAGE_LEVELS):
+        fraction = level / float(COVERAGE_LEVELS - 1)
+        colorNode.SetColor(COVERAGE_SCALAR_OFFSET + level, 'Coverage ' + str(level), min(1.0, 2.0 - 2.0 * fraction), min(1.0, 2.0 * fraction), 0.0, 1.0)
+      slicer.mrmlScene.AddNode(colorNode)
+    self.nodes.register('CoverageColors', colorNode)
+    return colorNode
+
+
+  def calculateVesselToRetractorAngles(self, vesselToRas, cutterToRas):
+    """Angles in degrees between the vessel and retractor z axes, for stacked (N,4,4) matrix arrays."""
+    vesselDirections = vesselToRas[:, :3, 2]
+    cutterDirections = cutterToRas[:, :3, 2]
+    # same formula as vtkMath::AngleBetweenVectors, accurate for small and large angles
+    crossNorms = numpy.linalg.norm(numpy.cross(vesselDirections, cutterDirections), axis=1)
+    dots = numpy.einsum('ij,ij->i', vesselDirections, cutterDirections)
+    return numpy.degrees(numpy.arctan2(crossNorms, dots))
+  
+  
+  def getTrackerTimestamp(self, node, callbackTime):
+    """Timestamp of the transform as stamped by the tracker, or the callback time if the message had none."""
+    value = node.GetAttribute(TRACKER_TIMESTAMP_ATTRIBUTE)
+    if value:
+      try:
+        return float(value), True
+      except ValueError:
+        pass
+    return callbackTime, False
+
+
+  def getCurrentTimestamp(self):
+    """Current time on the tracker clock, extrapolated from the latest frame, the wall clock before any frame."""
+    if self.latestTimestamp is None:
+      return time.time()
+    return self.latestTimestamp + time.time() - self.latestCallbackTime
+
+
+  def getSessionElapsed(self):
+    """Seconds on the tracker clock since the first frame recorded in the session, 0 before it."""
+    if self.sessionStartTimestamp is None:
+      return 0.0
+    return max(0.0, self.getCurrentTimestamp() - self.sessionStartTimestamp)
+
+
+  def isNewTrackerFrame(self, timestamp, stamped, triggerMTime, callbackTime):
+    """The connector sets the transforms of a tracker frame one message at a time, each message calls the
+    tracking callback. Messages of a frame share the tracker timestamp. Without timestamps a frame starts with
+    a new trigger transform, the first transform PLUS sends, or when the previous frame is half a period old.
+    """
+    if self.frameTimestamp is None:
+      return True
+    if stamped:
+      return timestamp != self.frameTimestamp
+    return triggerMTime != self.frameTriggerMTime or callbackTime - self.frameCallbackTime > 0.5 / TRACKING_RATE_HZ
+
+
+  def updateTransforms(self, caller, event):
+    # Sample processing stage, runs for every tracker message and records one sample per tracker frame
+    self.profiler.start('updateTransforms')
+    self.trackerEventCount += 1
+    callbackTime = time.time()
+    triggerToCutterNode = self.nodes.get('TriggerToCutter')
+    triggerToCutterTransform = triggerToCutterNode.GetTransformToParent()
+    if self.replayTimestamp is not None:
+      timestamp, stamped = self.replayTimestamp, True
+    else:
+      # timing metrics follow the tracker, not the delay of the event queue
+      timestamp, stamped = self.getTrackerTimestamp(triggerToCutterNode, callbackTime)
+    newFrame = self.isNewTrackerFrame(timestamp, stamped, triggerToCutterTransform.GetMTime(), callbackTime)
+    if newFrame:
+      self.trackerFrameCount += 1
+      self.frameTimestamp = timestamp
+      self.frameTriggerMTime = triggerToCutterTransform.GetMTime()
+      self.frameCallbackTime = callbackTime
+      if self.replayTimestamp is None:
+        if stamped:
+          self.profiler.addDuration('trackerToCallback', callbackTime - timestamp)
+        else:
+          self.unstampedFrameCount += 1
+          if self.unstampedFrameCount == 1:
+            logging.warning('Tracker frames without ' + TRACKER_TIMESTAMP_ATTRIBUTE + ' metadata, timed by the callback, drift of the tracker clock is not seen')
+        self.latestTimestamp = timestamp
+        self.latestCallbackTime = callbackTime
+    timestamp = self.frameTimestamp
+    triggerDirection_Cutter = triggerToCutterTransform.TransformFloatVector(self.triggerDirection_Trigger)
+
+    triggerAngle_Rad = vtkMath.AngleBetweenVectors(triggerDirection_Cutter, self.shaftDirection_Cutter)
+    triggerAngle_Deg = vtkMath.DegreesFromRadians(triggerAngle_Rad)
+    self.openAngle = self.getOpenAngle(triggerAngle_Deg)
+    jawsClosed = math.fabs(self.openAngle) < 0.25
+    if jawsClosed and not self.jawsClosed:
+      # cuts are checked when the jaws close, not while closed jaws are dragged across the vessel
+      self.closureFrame = self.trackerFrameCount
+      self.closureCut = False
+    self.jawsClosed = jawsClosed
+
+    if not self.tutorRunning:
+      self.profiler.stop('updateTransforms')
+      return
+    if self.sessionStartTimestamp is None:
+      self.sessionStartTimestamp = timestamp
+
+    self.profiler.start('sampleCapture')
+    self.nodes.get('CutterTipFiducial').GetNthFiducialWorldCoordinates(0, self.cutterTipWorld)
+    # matrices are stored with the sample, angle metrics are computed in batches by the visualization stage
+    self.nodes.get('VesselModelToVessel').GetMatrixTransformToWorld(self.vesselToRas)
+    self.vesselToRas.DeepCopy(self.vesselToRasElements, self.vesselToRas)
+    self.nodes.get('CutterTipToCutter').GetMatrixTransformToWorld(self.cutterToRas)
+    self.cutterToRas.DeepCopy(self.cutterToRasElements, self.cutterToRas)
+    sample = (timestamp, self.cutterTipWorld[:3], triggerAngle_Deg, 0.0, self.vesselToRasElements, self.cutterToRasElements)
+    if newFrame:
+      self.sampleBuffer.push(sample)
+    else:
+      # later messages of the frame complete the pose, unless the sample was already drained
+      self.sampleBuffer.replaceLast(sample)
+    self.profiler.stop('sampleCapture')
+
+    # every message of the closing frame may complete the pose of the jaws
+    if jawsClosed and self.closureFrame == self.trackerFrameCount and not self.closureCut:
+      self.profiler.start('checkModel')
+      self.checkModel(timestamp)
+      self.profiler.stop('checkModel')
+    self.profiler.stop('updateTransforms')
+
+
+  def getOpenAngle(self, triggerAngle_Deg):
     # adjusting values for openAngle calculation 
     if triggerAngle_Deg < 90.0:
       triggerAngle_Deg = 90.0
     if triggerAngle_Deg > 102.0:
       triggerAngle_Deg = 102.0
+    return (triggerAngle_Deg - 90.0) * -2.2 # angle of cutter tip to shaft 
+
+
+  def updateVisualization(self):
+    # Visualization stage, runs on its own timer independent of the tracking rate
+    self.profiler.start('updateVisualization')
+    samples = self.sampleBuffer.drain()
+    if len(samples) > 0:
+      self.profiler.start('updateAngleMetrics')
+      self.updateAngleMetrics(samples)
+      self.profiler.stop('updateAngleMetrics')
+      self.profiler.start('updateCoverage')
+      self.updateCoverage(samples)
+      self.profiler.stop('updateCoverage')
+      self.trajectory.extend(samples)
+      self.trajectoryFit.addPoints(samples['position'][:, 0], samples['position'][:, 1])
+      self.pathSimplifier.extend(samples['timestamp'], samples['position'])
+      if self.sessionLogger is not None:
+        self.sessionLogger.write(samples)
+      if self.replayTimestamp is None:
+        self.renderPendingCallbackTime = self.latestCallbackTime
+
+    # all scene changes of a tick are made in one modification block per node, so views render them once
+    sceneNodes = [node for node in [self.nodes.get(role) for role in SCENE_UPDATE_ROLES] if node is not None]
+    wasModifying = [node.StartModify() for node in sceneNodes]
+    try:
+      self.updateScene()
+    finally:
+      for node, modifying in zip(sceneNodes, wasModifying):
+        node.EndModify(modifying)
+    self.profiler.stop('updateVisualization')
+
+
+  def updateScene(self):
+    if self.openAngle != self.displayedOpenAngle:
+      self.cutterMovingToTipTransform.Identity()
+      # By default transformations occur in reverse order compared to source code line order.
+      # Translate center of rotation back to the original position
+      self.cutterMovingToTipTransform.Translate(0,0,-20)
+      # Rotate cutter moving part
+      self.cutterMovingToTipTransform.RotateY(self.openAngle)
+      # Translate center of rotation of the moving part to origin
+      self.cutterMovingToTipTransform.Translate(0,0, 20)
+      self.nodes.get('CutterMovingToCutterTip').SetMatrixTransformToParent(self.cutterMovingToTipTransform.GetMatrix())
+      self.displayedOpenAngle = self.openAngle
+    if self.skeletonModelPending:
+      # branches cut by the sample processing stage
+      self.profiler.start('updateSkeletonModel')
+      self.updateSkeletonModel()
+      self.profiler.stop('updateSkeletonModel')
+      self.skeletonModelPending = False
+    if self.coverageModified:
+      self.profiler.start('updateCoverageModel')
+      self.updateCoverageModel()
+      self.profiler.stop('updateCoverageModel')
+      self.coverageModified = False
+    if self.recenteringEnabled:
+      self.profiler.start('checkVesselLocation')
+      self.checkVesselLocation()
+      self.profiler.stop('checkVesselLocation')
+
+
+  def updateCoverage(self, samples):
+    """Counts the cutter tip and retractor reference point of the samples in the coverage map, in vessel model coordinates."""
+    retractorReferenceNode = self.nodes.get('RetractorReference')
+    if self.coverage is None or retractorReferenceNode is None:
+      return
+    rasToVesselModel = numpy.linalg.inv(samples['vesselToRas'].reshape(-1, 4, 4))
+    cutterTips = numpy.einsum('nij,nj->ni', rasToVesselModel[:, :3, :3], samples['position']) + rasToVesselModel[:, :3, 3]
+    retractorReferenceNode.GetNthFiducialWorldCoordinates(0, self.retractorReferenceRas)
+    retractorReferences = numpy.dot(rasToVesselModel[:, :3, :3], self.retractorReferenceRas[:3]) + rasToVesselModel[:, :3, 3]
+    cutterInside = self.coverage.add('cutter', cutterTips)
+    retractorInside = self.coverage.add('retractor', retractorReferences)
+    if cutterInside or retractorInside:
+      self.coverageModified = True
+
+
+  def getVesselCenterline(self, mainVesselPolydata, sliceThickness=COVERAGE_BIN_LENGTH):
+    """Vessel axis points moved to the center of the main vessel cross section around them, the axis fiducials
+    are placed on the vessel surface.
+    """
+    axisPoints = self.vesselAxisPoints
+    points = numpy_support.vtk_to_numpy(mainVesselPolydata.GetPoints().GetData())
+    directions = numpy.gradient(axisPoints, axis=0)
+    directions /= numpy.linalg.norm(directions, axis=1)[:, numpy.newaxis]
+    along = numpy.einsum('nak,ak->na', points[:, numpy.newaxis, :] - axisPoints[numpy.newaxis], directions)
+    inSlice = (numpy.abs(along) <= sliceThickness / 2.0).astype(float)
+    counts = inSlice.sum(axis=0)
+    centers = numpy.dot(inSlice.T, points) / numpy.maximum(counts, 1)[:, numpy.newaxis]
+    return numpy.where(counts[:, numpy.newaxis] > 0, centers, axisPoints)
+
+
+  def buildCoverageModel(self, mainVesselPolydata):
+    """Coverage map around the main vessel, and a copy of the main vessel with finer triangles,
+    so the coverage colors follow the cells of the map.
+    """
+    self.coverage = CoverageMap(self.getVesselCenterline(mainVesselPolydata))
+    subdivisionFilter = vtk.vtkLinearSubdivisionFilter()
+    subdivisionFilter.SetInputData(mainVesselPolydata)
+    subdivisionFilter.SetNumberOfSubdivisions(2)
+    subdivisionFilter.Update()
+    self.coveragePolydata = subdivisionFilter.GetOutput()
+    points = numpy_support.vtk_to_numpy(self.coveragePolydata.GetPoints().GetData())
+    bins, sectors, _ = self.coverage.getCells(points, radius=float('inf'))
+    self.coverageCells = bins * self.coverage.sectorCount + sectors
+    self.coverageScalars = numpy_support.vtk_to_numpy(self.coveragePolydata.GetPointData().GetScalars())
+    self.coverageModified = True
+
+
+  def updateCoverageModel(self):
+    if self.coveragePolydata is None:
+      return
+    self.coverageScalars[:] = COVERAGE_SCALAR_OFFSET + self.coverage.getLevels()[self.coverageCells]
+    self.coveragePolydata.GetPointData().GetScalars().Modified()
+    self.skeletonAppender.Update()
 
-    openAngle = (triggerAngle_Deg - 90.0) * -2.2 # angle of cutter tip to shaft 
 
-    cutterMovingToTipTransform = vtk.vtkTransform()
-    # By default transformations occur in reverse order compared to source code line order.
-    # Translate center of rotation back to the original position
-    cutterMovingToTipTransform.Translate(0,0,-20)
-    # Rotate cutter moving part
-    cutterMovingToTipTransform.RotateY(openAngle)
-    # Translate center of rotation of the moving part to origin
-    cutterMovingToTipTransform.Translate(0,0, 20)
-    
-    cutterMovingToTip = slicer.mrmlScene.GetFirstNodeByName('CutterMovingToCutterTip')
-    cutterMovingToTip.SetAndObserveTransformToParent(cutterMovingToTipTransform)   
+  def getSkeletonInputPolydata(self, name):
+    # the main vessel is shown with its coverage colors
+    if name == 'Model_0' and self.coveragePolydata is not None:
+      return self.coveragePolydata
+    return self.modelPolydata[name]
 
-    # current timestamp is time.time()
-    # save fiducial point and update model polydata every 0.25 seconds 
-    if (time.time() - self.lastTimestamp) > 0.25 and self.tutorRunning: 
-      self.updateSkeletonModel()
-      #self.checkVesselLocation()
-      cutterTipWorld = [0,0,0,0]
-      fiducial = slicer.util.getNode("F")
-      fiducial.GetNthFiducialWorldCoordinates(0,cutterTipWorld) # z coordinate not important for linear slope calculation
-
-      # add path fiducials to separate node
-      self.pathFiducialsNode = slicer.util.getNode('MarkupsFiducial_*')
-      if self.pathFiducialsNode == None:
-        self.pathFiducialsNode = slicer.mrmlScene.CreateNodeByClass('vtkMRMLMarkupsFiducialNode')
-        slicer.mrmlScene.AddNode(self.pathFiducialsNode)
-      slicer.modules.markups.logic().AddFiducial(cutterTipWorld[0], cutterTipWorld[1], cutterTipWorld[2])
-      # set new fiducial's label and hide from 3D view
-      n = self.pathFiducialsNode.GetNumberOfFiducials() - 1
-      self.pathFiducialsNode.SetNthFiducialLabel(n, str(n))
-      self.pathFiducialsNode.SetNthFiducialVisibility(n, 0)  
-
-      self.pathFiducialsX.append(cutterTipWorld[0])
-      self.pathFiducialsY.append(cutterTipWorld[1])
-      self.path.append(cutterTipWorld[:-1])
-      self.lastTimestamp = time.time()
-
-      self.updateAngleMetrics()
-      if math.fabs(openAngle) < 0.25 and self.tutorRunning and self.lastTimestamp - self.lastCutTimestamp > 3:
-        self.lastCutTimestamp = time.time()
-        self.checkModel()
-
-  def checkVesselLocation(self): #TODO implement re-centering for vessel and cutter models 
-    vesselToRasTransform = vtk.vtkGeneralTransform()
-    self.vesselModelToVessel.GetTransformToWorld(vesselToRasTransform) # vesselToRasTransform updated in place 
-    rasToVesselTransform = vtk.vtkGeneralTransform()
-    vtk.vtkMatrix4x4.Invert(vesselToRasTransform, rasToVesselTransform)
-    #rasToVesselTransform = vesselToRasTransform.GetMatrix().Inverse()
-
-    # get retractor fiducial point in RAS coordinates 
-    reftractorReferenceNode = slicer.util.getNode('Retractor Reference')
-    retractorRascoordinates = [0, 0, 0, 0]
-    reftractorReferenceNode.GetNthFiducialWorldCoordinates(0, retractorRascoordinates)
-    retractorLocationRAS = retractorRascoordinates[:-1]
-    # transform retractor reference point from RAS to vessel coordinate system
-    retractorLocationVesselCoordinates = rasToVesselTransform.TransformFloatPoint(retractorLocationRAS)   
-    minDistance = float('inf')
-    closestPoint = []
-    for i in range(NUM_VESSEL_FIDS):
-      pathFiducialRas = [0, 0, 0, 0]
-      pathFiducialsNode.GetNthFiducialWorldCoordinates(i, vesselFiducialRas)
-      pathFiducialVesselCoordinates = rasToVesselTransform.TransformFloatPoint(pathFiducialRas[:-1])
-      distance = math.sqrt(vtkMath.Distance2BetweenPoints(retractorLocationVesselCoordinates, pathFiducialVesselCoordinates))
-      if distance < minDistance:
-        minDistance = distance
-        closestPoint = pathFiducialVesselCoordinates
-    if minDistance > 400:
-      translateVesselToRetractor_vessel = [ retractorLocationVesselCoordinates[0] - closestPoint[0], retractorLocationVesselCoordinates[1] - vesselLocation[1], retractorLocationVesselCoordinates[2] - vesselLocation[2]]
-      vesselToPath = vtk.vtkTransform()
-      vesselToPath.Translate(translateVesselToRetractor_vessel[0], translateVesselToRetractor_vessel[1], translateVesselToRetractor_vessel[2])
-      vesselModelToVessel = slicer.util.getNode('VesselModelToVessel') 
-      vesselModelToVessel.SetAndObserveTransformToParent(vesselToPath)
-
-
-  def getClosestBranch(self, cutLocation):
+
+  def onWebcamFrame(self, caller, event):
+    if not self.tutorRunning or self.videoStore is None:
+      return
+    self.profiler.start('webcamFrame')
+    # same clock as the tracker samples
+    timestamp, stamped = self.getTrackerTimestamp(caller, self.getCurrentTimestamp())
+    imageData = caller.GetImageData()
+    if imageData is not None and imageData.GetPointData().GetScalars() is not None:
+      dimensions = imageData.GetDimensions()
+      scalars = numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars())
+      self.videoStore.addFrame(timestamp, scalars.reshape(dimensions[1], dimensions[0], -1))
+    self.profiler.stop('webcamFrame')
+
+
+  def startSessionLog(self, sessionDirectory):
+    self.stopSessionLog()
+    self.sessionLogger = SessionLogger(sessionDirectory)
+    self.videoStore = VideoFrameStore(sessionDirectory)
+
+
+  def stopSessionLog(self, summary=None):
+    if self.sessionLogger is None:
+      return
+    if summary is not None:
+      summary = dict(summary, videoFrames=self.videoStore.frameCount)
+    self.videoStore.close()
+    self.videoStore = None
+    self.sessionLogger.close(summary)
+    self.sessionLogger = None
+
+
+  def getProfilingCounters(self):
+    return {
+      'trackerEvents': self.trackerEventCount,
+      'trackerFrames': self.trackerFrameCount,
+      'unstampedFrames': self.unstampedFrameCount,
+      'samplesRecorded': len(self.trajectory),
+      'samplesDropped': self.sampleBuffer.droppedCount
+    }
+
+
+  def getProfilingStatistics(self):
+    statistics = self.profiler.getStatistics()
+    statistics.update(self.getProfilingCounters())
+    return statistics
+
+
+  def setRecenteringEnabled(self, enabled):
+    vesselModelToVessel = self.nodes.get('VesselModelToVessel')
+    if enabled and not self.recenteringEnabled:
+      # re-centering translates the vessel model on top of its calibration
+      vesselModelToVessel.GetMatrixTransformToParent(self.vesselModelToVesselCalibration)
+      self.recenteringOffset = numpy.zeros(3)
+    elif not enabled and self.recenteringEnabled:
+      vesselModelToVessel.SetMatrixTransformToParent(self.vesselModelToVesselCalibration)
+    self.recenteringEnabled = enabled
+
+
+  def checkVesselLocation(self):
+    """Moves the vessel model when the retractor reference point is farther than RECENTERING_DISTANCE from
+    the vessel axis, so the vessel stays in the camera view. The closest axis point is moved to the reference point.
+    Returns True if the vessel model was moved.
+    """
+    if len(self.vesselAxisPoints) == 0:
+      return False
+    # reference point in vessel model coordinates without re-centering, one inverse per call
+    self.nodes.get('VesselToRetractor').GetMatrixTransformToWorld(self.calibratedVesselModelToRas)
+    vtk.vtkMatrix4x4.Multiply4x4(self.calibratedVesselModelToRas, self.vesselModelToVesselCalibration, self.calibratedVesselModelToRas)
+    self.calibratedVesselModelToRas.Invert()
+    self.nodes.get('RetractorReference').GetNthFiducialWorldCoordinates(0, self.retractorReferenceRas)
+    referenceCalibrated = numpy.array(self.calibratedVesselModelToRas.MultiplyPoint(tuple(self.retractorReferenceRas[:3]) + (1,))[:3])
+
+    distances2 = numpy.square(self.vesselAxisPoints - (referenceCalibrated - self.recenteringOffset)).sum(axis=1)
+    closestPoint = numpy.argmin(distances2)
+    if distances2[closestPoint] <= RECENTERING_DISTANCE * RECENTERING_DISTANCE:
+      return False
+    self.recenteringOffset = referenceCalibrated - self.vesselAxisPoints[closestPoint]
+    self.recenteredVesselModelToVessel.Identity()
+    self.recenteredVesselModelToVessel.Concatenate(self.vesselModelToVesselCalibration)
+    self.recenteredVesselModelToVessel.Translate(self.recenteringOffset)
+    self.nodes.get('VesselModelToVessel').SetMatrixTransformToParent(self.recenteredVesselModelToVessel.GetMatrix())
+    return True
+
+
+  def getVesselSetNames(self):
+    """Vessel model sets are the top level of CadModels/vessel and each subfolder containing branch models."""
+    vesselDir = os.path.join(os.path.dirname(slicer.modules.vesselharvestingtutor.path), os.pardir, 'CadModels', 'vessel')
+    setNames = [DEFAULT_VESSEL_SET]
+    for folderName in sorted(os.listdir(vesselDir)):
+      folderPath = os.path.join(vesselDir, folderName)
+      if os.path.isdir(folderPath) and self.getBranchNumbers(folderPath):
+        setNames.append(folderName)
+    return setNames
+
+
+  def getVesselSetDirectory(self, setName):
+    vesselDir = os.path.join(os.path.dirname(slicer.modules.vesselharvestingtutor.path), os.pardir, 'CadModels', 'vessel')
+    return vesselDir if setName == DEFAULT_VESSEL_SET else os.path.join(vesselDir, setName)
+
+
+  def getBranchNumbers(self, folderPath):
+    branchNumbers = []
+    for fileName in os.listdir(folderPath):
+      name, extension = os.path.splitext(fileName)
+      if extension.lower() == '.stl' and name.startswith('Model_') and name[len('Model_'):].isdigit():
+        number = int(name[len('Model_'):])
+        if number > 0:
+          branchNumbers.append(number)
+    return sorted(branchNumbers)
+
+
+  def loadVesselSet(self, setName):
+    """Parses the geometry of a vessel model set and builds its locators. Results are kept, so each set is loaded once."""
+    if setName in self.vesselSets:
+      return self.vesselSets[setName]
+    cache = self.getAssetCache()
+    setDir = self.getVesselSetDirectory(setName)
+    # sets without their own main vessel share the top level one
+    mainVesselPath = os.path.join(setDir, 'Model_0.stl')
+    if not os.path.exists(mainVesselPath):
+      mainVesselPath = os.path.join(self.getVesselSetDirectory(DEFAULT_VESSEL_SET), 'Model_0.stl')
+
+    # vessel branches have their color set to red (3 = red)
+    modelPolydata = {'Model_0': cache.getPolyData(mainVesselPath, 3)}
+    branchNumbers = self.getBranchNumbers(setDir)
+    branchStarts = []
+    branchCenterlines = {}
+    for branchNumber in branchNumbers:
+      modelPolydata['Model_' + str(branchNumber)] = cache.getPolyData(os.path.join(setDir, 'Model_' + str(branchNumber) + '.stl'), 3)
+      # the vessel branch points follow the branch centerline, the first point is the branch start
+      branchCenterlines[branchNumber] = cache.getFiducialPositions(os.path.join(setDir, 'Points_' + str(branchNumber) + '.fcsv'))
+      branchStarts.append(branchCenterlines[branchNumber][0])
+
+    vesselSet = {
+      'modelPolydata': modelPolydata,
+      'branchNumbers': branchNumbers,
+      'branchStarts': numpy.array(branchStarts).reshape(-1, 3),
+      'branchCenterlines': branchCenterlines,
+      'clippedBranches': {} # clipped branch polydata by (branch number, rounded cut position)
+    }
+    self.buildLocators(vesselSet)
+    self.vesselSets[setName] = vesselSet
+    return vesselSet
+
+
+  def preloadVesselSets(self):
+    """Loads the vessel sets that are not in use yet, one per event loop iteration so the GUI stays responsive."""
+    for setName in self.getVesselSetNames():
+      if setName not in self.vesselSets:
+        self.loadVesselSet(setName)
+        qt.QTimer.singleShot(0, self.preloadVesselSets)
+        return
+
+
+  def setVesselSet(self, setName):
+    vesselSet = self.loadVesselSet(setName)
+    self.vesselSetName = setName
+    self.getSessionParameterNode().SetParameter('VesselSet', setName)
+    self.modelPolydata = vesselSet['modelPolydata']
+    self.visiblePolydata = {}
+    self.clippedPolydata = {}
+    self.vesselCellLocator = vesselSet['vesselCellLocator']
+    self.branchStartsPolydata = vesselSet['branchStartsPolydata']
+    self.branchStartsLocator = vesselSet['branchStartsLocator']
+    self.branchNumbers = vesselSet['branchNumbers']
+    self.branchObbTrees = vesselSet['branchObbTrees']
+    self.branchCenterlines = vesselSet['branchCenterlines']
+    self.clippedBranches = vesselSet['clippedBranches']
+    self.buildCoverageModel(self.modelPolydata['Model_0'])
+
+    # inputs of the skeleton model are ordered by branch number, Model_0 being the main vessel
+    names = sorted(self.modelPolydata.keys(), key=lambda name: int(name[len('Model_'):]))
+    self.skeletonAppender.SetNumberOfInputs(len(names))
+    self.skeletonInputIndices = {}
+    self.skeletonInputPolydata = {}
+    for i, name in enumerate(names):
+      self.visiblePolydata[name] = True
+      self.skeletonInputIndices[name] = i
+      self.skeletonInputPolydata[name] = self.getSkeletonInputPolydata(name)
+      self.skeletonAppender.SetInputDataByNumber(i, self.skeletonInputPolydata[name])
+    self.skeletonAppender.Update()
+
+    branchStartsFiducialsNode = self.nodes.get('BranchStarts')
+    wasModifying = branchStartsFiducialsNode.StartModify()
+    branchStartsFiducialsNode.RemoveAllMarkups()
+    for i, position in enumerate(vesselSet['branchStarts']):
+      branchStartsFiducialsNode.AddFiducial(position[0], position[1], position[2])
+      branchStartsFiducialsNode.SetNthFiducialVisibility(i, 0)
+    branchStartsFiducialsNode.EndModify(wasModifying)
+
+
+  def buildLocators(self, vesselSet):
+    # Locators are built once in vessel model coordinates, queries transform the cut location instead
+    # The cell locator gives the distance to the vessel surface, independent of the mesh resolution
+    vesselCellLocator = vtk.vtkCellLocator()
+    vesselCellLocator.SetDataSet(vesselSet['modelPolydata']['Model_0'])
+    vesselCellLocator.BuildLocator()
+
+    # Branch start point n belongs to the n-th entry of the branch numbers
+    branchStartPoints = vtk.vtkPoints()
+    for position in vesselSet['branchStarts']:
+      branchStartPoints.InsertNextPoint(position)
+    branchStartsPolydata = vtk.vtkPolyData()
+    branchStartsPolydata.SetPoints(branchStartPoints)
+    branchStartsLocator = vtk.vtkStaticPointLocator()
+    branchStartsLocator.SetDataSet(branchStartsPolydata)
+    branchStartsLocator.BuildLocator()
+
+    # Oriented bounding box trees of the branches, for intersection tests with the cutter jaws
+    branchObbTrees = {}
+    for branchNumber in vesselSet['branchNumbers']:
+      obbTree = vtk.vtkOBBTree()
+      obbTree.SetDataSet(vesselSet['modelPolydata']['Model_' + str(branchNumber)])
+      obbTree.BuildLocator()
+      branchObbTrees[branchNumber] = obbTree
+
+    vesselSet['vesselCellLocator'] = vesselCellLocator
+    vesselSet['branchObbTrees'] = branchObbTrees
+    vesselSet['branchStartsPolydata'] = branchStartsPolydata
+    vesselSet['branchStartsLocator'] = branchStartsLocator
+
+
+  def getVesselModelCoordinates(self, rasPoint):
+    self.nodes.get('VesselModelToVessel').GetMatrixTransformFromWorld(self.rasToVesselModel)
+    return self.rasToVesselModel.MultiplyPoint(tuple(rasPoint[:3]) + (1,))[:3]
+
+
+  def getCuttingBranch(self):
+    """Number of the visible branch intersected by the closed cutter jaws and the first intersection
+    in vessel model coordinates, (0, None) if none.
+    The jaw segments are brought into vessel model coordinates, so the branch OBB trees never need rebuilding.
+    """
+    self.nodes.get('CutterTipToCutter').GetMatrixTransformToWorld(self.cutterToRas)
+    self.nodes.get('VesselModelToVessel').GetMatrixTransformFromWorld(self.rasToVesselModel)
+    vtk.vtkMatrix4x4.Multiply4x4(self.rasToVesselModel, self.cutterToRas, self.cutterTipToVesselModel)
+    segments = []
+    for start, end in JAW_SEGMENTS_CUTTER_TIP:
+      segments.append((self.cutterTipToVesselModel.MultiplyPoint(start + (1,))[:3], self.cutterTipToVesselModel.MultiplyPoint(end + (1,))[:3]))
+    for branchNumber in self.branchNumbers:
+      if not self.visiblePolydata['Model_' + str(branchNumber)]:
+        continue
+      obbTree = self.branchObbTrees[branchNumber]
+      for start, end in segments:
+        if obbTree.IntersectWithLine(start, end, self.jawIntersectionPoints, None) != 0:
+          return branchNumber, self.jawIntersectionPoints.GetPoint(0)
+    return 0, None
+
+
+  def getCenterlineArcLength(self, centerline, point):
+    """Distance along a centerline polyline from its first point to the point closest to the given point."""
+    segmentStarts = centerline[:-1]
+    segments = centerline[1:] - segmentStarts
+    segmentLengths2 = numpy.maximum(numpy.einsum('ij,ij->i', segments, segments), 1e-12)
+    # parametric position of the closest point on each segment
+    t = numpy.clip(numpy.einsum('ij,ij->i', numpy.asarray(point) - segmentStarts, segments) / segmentLengths2, 0.0, 1.0)
+    closestPoints = segmentStarts + t[:, numpy.newaxis] * segments
+    closestSegment = numpy.argmin(numpy.linalg.norm(closestPoints - point, axis=1))
+    segmentLengths = numpy.sqrt(segmentLengths2)
+    return segmentLengths[:closestSegment].sum() + t[closestSegment] * segmentLengths[closestSegment]
+
+
+  def getCenterlinePoint(self, centerline, arcLength):
+    """Point at the given distance along a centerline polyline and the direction of the centerline there."""
+    segments = numpy.diff(centerline, axis=0)
+    segmentLengths = numpy.linalg.norm(segments, axis=1)
+    segmentEnds = numpy.cumsum(segmentLengths)
+    segmentIndex = min(numpy.searchsorted(segmentEnds, arcLength), len(segments) - 1)
+    t = (arcLength - (segmentEnds[segmentIndex] - segmentLengths[segmentIndex])) / max(segmentLengths[segmentIndex], 1e-12)
+    return centerline[segmentIndex] + t * segments[segmentIndex], segments[segmentIndex] / max(segmentLengths[segmentIndex], 1e-12)
+
+
+  def clipBranch(self, branchNumber, cutLocationVesselModel):
+    """Clips a branch at the cut location, keeping the stump attached to the main vessel. The cut position
+    is rounded along the branch centerline, and clipped branches are cached by branch and cut position.
+    Returns the stump length along the centerline.
+    """
+    centerline = self.branchCenterlines[branchNumber]
+    if len(centerline) < 2:
+      self.clippedPolydata['Model_' + str(branchNumber)] = self.emptyPolydata
+      return 0.0
+    arcLength = self.getCenterlineArcLength(centerline, cutLocationVesselModel)
+    cutPositionIndex = int(round(arcLength / CLIP_POSITION_RESOLUTION))
+    stumpLength = cutPositionIndex * CLIP_POSITION_RESOLUTION
+    key = (branchNumber, cutPositionIndex)
+    if key not in self.clippedBranches:
+      origin, direction = self.getCenterlinePoint(centerline, stumpLength)
+      plane = vtk.vtkPlane()
+      plane.SetOrigin(origin)
+      # the clip filter keeps the side the normal points to, which is towards the branch start
+      plane.SetNormal(-direction)
+      clipper = vtk.vtkClipPolyData()
+      clipper.SetInputData(self.modelPolydata['Model_' + str(branchNumber)])
+      clipper.SetClipFunction(plane)
+      clipper.Update()
+      stump = vtk.vtkPolyData()
+      stump.DeepCopy(clipper.GetOutput())
+      self.clippedBranches[key] = stump
+    self.clippedPolydata['Model_' + str(branchNumber)] = self.clippedBranches[key]
+    return stumpLength
+
+
+  def getClosestBranch(self, cutLocationVesselModel):
     branchNum = 0
     minDistance = float("inf")
-    numBranches = NUM_MODELS -1
-    for i in range(numBranches):
-      RAScoordinates = [0,0,0,0]
-      self.branchStartsFiducialsNode.GetNthFiducialWorldCoordinates(i,RAScoordinates)
-      p = RAScoordinates[:-1]
-      distance = math.sqrt(vtkMath.Distance2BetweenPoints(cutLocation, p))
-      if distance < minDistance:
-        minDistance = distance
-        branchNum = i + 1
+    closestStartId = self.branchStartsLocator.FindClosestPoint(cutLocationVesselModel)
+    if closestStartId >= 0:
+      p = self.branchStartsPolydata.GetPoint(closestStartId)
+      minDistance = math.sqrt(vtkMath.Distance2BetweenPoints(cutLocationVesselModel, p))
+      branchNum = self.branchNumbers[closestStartId]
     print '\n', 'Distance to closest branch: ', minDistance, ', closest branch number: ', branchNum
     return minDistance, branchNum
 
 
-  def checkModel(self): # check if vessel branch needs to be snipped  
-    removebranch = ""     
-    cutterTip = slicer.util.getNode("CutterMovingModel")
-    branchNum = 0 # tracks which vessel should be cut if applicable 
+  def getDistanceToVessel(self, cutLocationVesselModel):
+    closestPoint = [0,0,0]
+    cellId = vtk.mutable(0)
+    subId = vtk.mutable(0)
+    distance2 = vtk.mutable(0.0)
+    self.vesselCellLocator.FindClosestPoint(cutLocationVesselModel, closestPoint, cellId, subId, distance2)
+    if cellId < 0:
+      return float('inf')
+    return math.sqrt(distance2)
 
-    cutterTipWorld = [0,0,0,0]
-    fiducial = slicer.util.getNode("F")
-    fiducial.GetNthFiducialWorldCoordinates(0,cutterTipWorld) # Get point on cutter tip 
+
+  def checkModel(self, timestamp): # check if vessel branch needs to be snipped  
+    cutterTipWorld = self.cutterTipWorld # Point on cutter tip, updated by the sample processing stage
     cutLocation = (cutterTipWorld[0], cutterTipWorld[1], cutterTipWorld[2])
-    self.lastCutTimestamp = time.time()
-    # finds closest branch to be cut 
-    minDistance, branchNum = self.getClosestBranch(cutLocation)
+    # vessel geometry and locators are in model coordinates, bring the cut location into the same frame
+    cutLocationVesselModel = self.getVesselModelCoordinates(cutLocation)
+
+    # branch between the closed jaws, checked on the frame the cutter closes
+    branchNum, clipLocationVesselModel = self.getCuttingBranch() # tracks which vessel should be cut if applicable 
+    cutMethod = 'jaws'
+    if branchNum == 0:
+      # fall back to the closest branch start, at most once per debounce interval
+      if timestamp - self.lastCutTimestamp <= self.cutDebounceSec:
+        return
+      self.lastCutTimestamp = timestamp
+      minDistance, branchNum = self.getClosestBranch(cutLocationVesselModel)
+      if minDistance >= self.branchCutRadius or not self.visiblePolydata.get('Model_' + str(branchNum), False):
+        branchNum = 0
+      clipLocationVesselModel = cutLocationVesselModel
+      cutMethod = 'radius'
      
     if branchNum != 0: # block deletion of the main vessel 
-      vesselAxis = self.modelPolydata['Model_0']
-      n = vesselAxis.GetNumberOfPoints()
-      distanceToAxis = float('inf')
-      for i in range(n):
-        distance = math.sqrt(vtkMath.Distance2BetweenPoints(cutLocation, vesselAxis.GetPoint(i)))
-        if distance < distanceToAxis:
-          distanceToAxis = distance
-      if minDistance < 280: 
-        removeBranch = 'Model_' + str(branchNum)
-        print 'Removing branch ' + str(branchNum)
-        self.visiblePolydata[removeBranch] = False
-        self.updateSkeletonModel()
-        self.metrics['cutDistances'].append(distanceToAxis)
+      distanceToAxis = self.getDistanceToVessel(cutLocationVesselModel)
+      removeBranch = 'Model_' + str(branchNum)
+      print 'Removing branch ' + str(branchNum)
+      # no fallback cut right after a cut
+      self.lastCutTimestamp = timestamp
+      self.closureCut = True
+      self.visiblePolydata[removeBranch] = False
+      self.profiler.start('clipBranch')
+      stumpLength = self.clipBranch(branchNum, clipLocationVesselModel)
+      self.profiler.stop('clipBranch')
+      # the skeleton model is updated by the visualization stage, the callback does not modify the scene
+      self.skeletonModelPending = True
+      self.metrics['cutDistances'].append(distanceToAxis)
+      self.metrics['stumpLengths'].append(stumpLength)
+      self.metrics['branchesCut'] += 1
+      self.cutDistanceStatistics.add(distanceToAxis)
+      self.stumpLengthStatistics.add(stumpLength)
+      if self.sessionLogger is not None:
+        event = {'timestamp': timestamp, 'event': 'cut', 'branch': branchNum, 'method': cutMethod,
+          'cutDistance': distanceToAxis, 'stumpLength': stumpLength}
+        if self.videoStore is not None and self.videoStore.frameCount > 0:
+          # latest webcam frame when the cut was detected
+          event['videoFrame'] = self.videoStore.frameCount - 1
+        self.sessionLogger.logEvent(event)
      
 
-  def npArrayFromVtkMatrix(self, vtkMatrix):
-    npArray = numpy.zeros((4,4))
-    for row in range(4):
-      for column in range(4):
-          npArray[row][column] = vtkMatrix.GetElement(row,column)
-    return npArray
+  def updateAngleMetrics(self, samples):
+    angles = self.calculateVesselToRetractorAngles(samples['vesselToRas'].reshape(-1, 4, 4), samples['cutterToRas'].reshape(-1, 4, 4))
+    samples['retractorAngle'] = angles
+    self.metrics['minAngle'] = min(self.metrics['minAngle'], round(angles.min(), 1))
+    self.metrics['maxAngle'] = max(self.metrics['maxAngle'], round(angles.max(), 1))
+
+
+  def getAngleMetrics(self):
+    """Angle statistics over the whole recorded trajectory, computed in one vectorized pass."""
+    samples = self.trajectory.getSamples()
+    if len(samples) == 0:
+      return {}
+    angles = samples['retractorAngle']
+    timestamps = samples['timestamp']
+    # each sample holds until the next one
+    durations = numpy.diff(timestamps)
+    inRange = (angles[:-1] >= self.targetAngleRange[0]) & (angles[:-1] <= self.targetAngleRange[1])
+    percentiles = numpy.percentile(angles, [5, 50, 95])
+    totalTime = timestamps[-1] - timestamps[0]
+    timeInRange = durations[inRange].sum()
+    return {
+      'minAngle': round(angles.min(), 1),
+      'maxAngle': round(angles.max(), 1),
+      'angle5thPercentile': round(percentiles[0], 1),
+      'medianAngle': round(percentiles[1], 1),
+      'angle95thPercentile': round(percentiles[2], 1),
+      'timeInTargetAngleRange': round(timeInRange, 2),
+      'fractionInTargetAngleRange': round(timeInRange / totalTime, 3) if totalTime > 0 else 0
+    }
 
-    
-  def updateAngleMetrics(self):
-    vesselModelToVessel = slicer.mrmlScene.GetFirstNodeByName('VesselModelToVessel')  
-    vesselToRas = vtk.vtkMatrix4x4()
-    vesselModelToVessel.GetMatrixTransformToWorld(vesselToRas)
-    vesselDirection = numpy.dot(self.npArrayFromVtkMatrix(vesselToRas), numpy.array([ 0, 0, 1, 0]))
-
-    cutterTipToCutter = slicer.mrmlScene.GetFirstNodeByName('CutterTipToCutter')  
-    cutterToRas = vtk.vtkMatrix4x4()
-    cutterTipToCutter.GetMatrixTransformToWorld(cutterToRas)
-    cutterDirection = numpy.dot(self.npArrayFromVtkMatrix(cutterToRas), numpy.array([ 0, 0, 1, 0]))
-
-    self.calculateVesselToRetractorAngle(vesselDirection, cutterDirection)
         
-  
+  def getRunningMetrics(self):
+    """Metrics kept by the streaming estimators, cheap enough to query while recording."""
+    cutDistances = self.cutDistanceStatistics
+    if cutDistances.count > 0:
+      self.metrics['minDistance'] = round(cutDistances.minimum, 2)
+      self.metrics['maxDistance'] = round(cutDistances.maximum, 2)
+      self.metrics['meanDistance'] = round(cutDistances.mean, 2)
+      self.metrics['stdDevCutDistances'] = round(cutDistances.getStandardDeviation(), 2)
+    else:
+      self.metrics['minDistance'] = self.metrics['maxDistance'] = self.metrics['meanDistance'] = self.metrics['stdDevCutDistances'] = 0
+    if self.stumpLengthStatistics.count > 0:
+      self.metrics['meanStumpLength'] = round(self.stumpLengthStatistics.mean, 2)
+      self.metrics['maxStumpLength'] = round(self.stumpLengthStatistics.maximum, 2)
+    # x and y of the cutter tip give the slope of the linear trajectory
+    self.metrics['trajectorySlope'] = round(self.trajectoryFit.getSlope(), 2)
+    if self.coverage is not None:
+      self.metrics['dissectionCoverage'] = round(self.coverage.getCoveredFraction(['retractor']), 3)
+      self.metrics['cutterCoverage'] = round(self.coverage.getCoveredFraction(['cutter']), 3)
+    return self.metrics
+
+
   def getDistanceMetrics(self): 
-    if len(self.metrics['cutDistances']) == 0:
-      self.metrics['cutDistances'] = [0]
-    self.metrics['minDistance'] = round(min(self.metrics['cutDistances']), 2)
-    self.metrics['maxDistance'] = round(max(self.metrics['cutDistances']), 2)
-    self.metrics['meanDistance'] = round(sum(self.metrics['cutDistances']) / len(self.metrics['cutDistances']), 2)
-    self.metrics['stdDevCutDistances'] = round(numpy.array(self.metrics['cutDistances']).std(), 2)
-    for key in self.visiblePolydata:
-      if not self.visiblePolydata[key]:
-        self.metrics['branchesCut'] += 1
-    if len(self.pathFiducialsX) > 0:
-      x = numpy.array(self.pathFiducialsX)
-      y = numpy.array(self.pathFiducialsY)
-      # x and y points used to compute slope of linear trajectory
-      A = numpy.vstack([x, numpy.ones(len(x))]).T
-      slope, _ = numpy.linalg.lstsq(A, y)[0]
-      self.metrics['trajectorySlope'] = round(slope, 2)
-      self.metrics['points'] = self.path
+    self.getRunningMetrics()
+    self.metrics.update(self.getAngleMetrics())
     return self.metrics
 
 
+  def readTrackingRecording(self, filePath):
+    """Timestamps and (N,4,4) matrices of the REPLAY_TRANSFORM_NAMES transforms of a PLUS sequence metafile or CSV recording."""
+    return readTrackingRecording(filePath, REPLAY_TRANSFORM_NAMES)
+
+
+  def replaySession(self, filePath, branchCutRadius=BRANCH_CUT_RADIUS, cutDebounceSec=CUT_DEBOUNCE_SEC, vesselSetName=None):
+    """Scores a recorded session without the GUI, using the recorded timestamps instead of the wall clock.
+    Transforms and models have to be loaded. Returns the metrics of the session.
+    """
+    timestamps, matrices = self.readTrackingRecording(filePath)
+    if vesselSetName is not None and vesselSetName != self.vesselSetName:
+      self.setVesselSet(vesselSetName)
+    self.branchCutRadius = branchCutRadius
+    self.cutDebounceSec = cutDebounceSec
+    self.resetMetrics()
+    self.resetModels()
+    if len(timestamps) == 0:
+      logging.warning('No tracking frames in ' + filePath)
+      return self.getDistanceMetrics()
+
+    transformNodes = dict((name, self.nodes.get(name)) for name in REPLAY_TRANSFORM_NAMES)
+    # Frames are processed explicitly with their recorded timestamp, not through the live observer
+    self.removeTrackingObservers()
+    self.visualizationTimer.stop()
+    self.tutorRunning = True
+    # jaws closed on the first frame of the recording count as a closure
+    self.jawsClosed = False
+    matrix = vtk.vtkMatrix4x4()
+    lastVisualizationTimestamp = timestamps[0]
+    try:
+      for i in range(len(timestamps)):
+        for name in REPLAY_TRANSFORM_NAMES:
+          elements = matrices[name][i]
+          if numpy.isnan(elements).any():
+            continue # keep the last valid pose
+          matrix.DeepCopy(elements.ravel().tolist())
+          transformNodes[name].SetMatrixTransformToParent(matrix)
+        self.replayTimestamp = timestamps[i]
+        self.updateTransforms(transformNodes['TriggerToCutter'], None)
+        if (timestamps[i] - lastVisualizationTimestamp) * 1000.0 >= VISUALIZATION_INTERVAL_MS:
+          self.updateVisualization()
+          lastVisualizationTimestamp = timestamps[i]
+      self.updateVisualization()
+    finally:
+      self.tutorRunning = False
+      self.replayTimestamp = None
+      # recorded timestamps are not on the clock of the live tracker
+      self.lastCutTimestamp = float('-inf')
+      self.addTrackingObservers()
+      self.visualizationTimer.start()
+
+    metrics = dict(self.getDistanceMetrics())
+    metrics['procedureTime'] = self.getTimestamp(timestamps[0], timestamps[-1])
+    return metrics
+
+
   def getTimestamp(self, start, stop):
     elapsed = stop - start 
     formattedTime = time.strftime('%H:%M:%S', time.gmtime(elapsed)) # convert seconds to HH:MM:SS timestamp
@@ -774,23 +2586,18 @@ class VesselHarvestingTutorLogic(ScriptedLoadableModuleLogic):
     
 
   def updateSkeletonModel(self):
-    appender = vtk.vtkAppendPolyData()
-    vesselToWorld = self.vesselModelToVessel.GetTransformToParent()
+    # Only swap the appender inputs that changed, the vessel transform is applied by the model node
+    modified = False
     for name, visiblilityFlag in self.visiblePolydata.iteritems():
-      if visiblilityFlag:
-        poly = self.modelPolydata[name]
-        transformFilter = vtk.vtkTransformPolyDataFilter()
-        transformFilter.SetTransform(vesselToWorld)
-        transformFilter.SetInputData(poly)
-        transformFilter.Update()
-        transformedPoly = transformFilter.GetOutput()
-        appender.AddInputData(transformedPoly)
-        self.modelPolydata[name] = transformedPoly
-    appender.Update()
-    modelNode = slicer.util.getFirstNodeByName(self.SKELETON_MODEL_NAME)
-    if modelNode is None:
-      logging.error("Model node not found: {0}".format(self.SKELETON_MODEL_NAME))
-    modelNode.SetAndObservePolyData(appender.GetOutput())  
+      # cut branches show their clipped stump
+      poly = self.getSkeletonInputPolydata(name) if visiblilityFlag else self.clippedPolydata.get(name, self.emptyPolydata)
+      if self.skeletonInputPolydata.get(name) is poly:
+        continue
+      self.skeletonAppender.SetInputDataByNumber(self.skeletonInputIndices[name], poly)
+      self.skeletonInputPolydata[name] = poly
+      modified = True
+    if modified:
+      self.skeletonAppender.Update()
 
 
 class VesselHarvestingTutorTest(ScriptedLoadableModuleTest):
@@ -805,16 +2612,531 @@ class VesselHarvestingTutorTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_VesselHarvestingTutor1()
+    self.tearDown()
+    self.setUp()
+    self.test_BranchCut()
+    self.tearDown()
+    self.setUp()
+    self.test_ClosedJawsDrag()
+    self.tearDown()
+    self.setUp()
+    self.test_ClosedBeforeContact()
+    self.tearDown()
+    self.setUp()
+    self.test_Metrics()
+    self.tearDown()
+    self.setUp()
+    self.test_TrackerMessages()
+    self.tearDown()
+    self.setUp()
+    self.test_StationSessions()
+    self.tearDown()
+    self.setUp()
+    self.test_TrackingBenchmark()
+    self.tearDown()
+    self.setUp()
+    self.test_NodeRegistry()
+    self.tearDown()
+    self.setUp()
+    self.test_WebcamFrames()
+    self.tearDown()
+    self.setUp()
+    self.test_VideoFrameStore()
+    self.tearDown()
+    self.setUp()
+    self.test_VesselRecentering()
+    self.tearDown()
+    self.setUp()
+    self.test_CoverageMap()
+    self.tearDown()
 
 
   def setUp(self):
     """ Do whatever is needed to reset the state - typically a scene clear will be enough.
     """
     slicer.mrmlScene.Clear(0)
+    self.logics = []
+
+
+  def tearDown(self):
+    # logics left running would keep observing the nodes of the next test
+    for logic in self.logics:
+      logic.cleanup()
+    self.logics = []
+
+
+  def createLogic(self, sessionName=''):
+    logic = VesselHarvestingTutorLogic(sessionName)
+    self.logics.append(logic)
+    logic.loadTransforms()
+    logic.loadModels()
+    logic.nodes.get('VesselToRetractor').SetMatrixTransformToParent(vtk.vtkMatrix4x4())
+    return logic
+
+
+  def getMatrixArray(self, vtkMatrix):
+    return numpy.array([[vtkMatrix.GetElement(i, j) for j in range(4)] for i in range(4)])
+
+
+  def getTriggerToCutter(self, jawsOpen):
+    # trigger direction at 100 degrees from the cutter shaft opens the jaws, at 90 degrees they are closed
+    angle = math.radians(-10.0 if jawsOpen else 0.0)
+    triggerToCutter = numpy.identity(4)
+    triggerToCutter[:2, :2] = [[math.cos(angle), -math.sin(angle)], [math.sin(angle), math.cos(angle)]]
+    return triggerToCutter
+
+
+  def getCutterToRetractors(self, logic, cutterTipPositions):
+    """CutterToRetractor matrices that place the cutter tip at the given RAS positions, jaws along the z axis."""
+    cutterTipToCutter = self.getMatrixArray(logic.nodes.get('CutterTipToCutter').GetMatrixTransformToParent())
+    cutterTipToRas = numpy.tile(numpy.identity(4), (len(cutterTipPositions), 1, 1))
+    cutterTipToRas[:, :3, 3] = cutterTipPositions
+    return numpy.einsum('nij,jk->nik', cutterTipToRas, numpy.linalg.inv(cutterTipToCutter))
+
+
+  def writeRecording(self, filePath, timestamps, cutterToRetractors, triggerToCutters):
+    """Writes a synthetic tracking recording in the CSV format read by replaySession, the vessel does not move."""
+    with open(filePath, 'w') as f:
+      writer = csv.writer(f)
+      writer.writerow(['Timestamp'] + REPLAY_TRANSFORM_NAMES)
+      matrices = {'CutterToRetractor': cutterToRetractors, 'TriggerToCutter': triggerToCutters,
+        'VesselToRetractor': numpy.tile(numpy.identity(4), (len(timestamps), 1, 1))}
+      for i, timestamp in enumerate(timestamps):
+        writer.writerow([timestamp] + [' '.join(str(value) for value in matrices[name][i].ravel()) for name in REPLAY_TRANSFORM_NAMES])
 
 
   def test_VesselHarvestingTutor1(self):
     logic = VesselHarvestingTutorLogic()
+    self.logics.append(logic)
     logic.loadTransforms()
     logic.loadModels()
 
+
+  def getBranchCutPoint(self, logic, branchNumber):
+    """RAS position in the middle of the centerline of a branch and the half arc length of the branch."""
+    centerline = logic.branchCenterlines[branchNumber]
+    arcLength = numpy.linalg.norm(numpy.diff(centerline, axis=0), axis=1).sum() / 2
+    cutPointVesselModel, _ = logic.getCenterlinePoint(centerline, arcLength)
+    vesselModelToRas = vtk.vtkMatrix4x4()
+    logic.nodes.get('VesselModelToVessel').GetMatrixTransformToWorld(vesselModelToRas)
+    return numpy.array(vesselModelToRas.MultiplyPoint(tuple(cutPointVesselModel) + (1,))[:3]), arcLength
+
+
+  def test_BranchCut(self):
+    self.delayDisplay('Closing the cutter across a vessel branch')
+    logic = self.createLogic()
+    branchNumber = logic.branchNumbers[0]
+    cutPoint, arcLength = self.getBranchCutPoint(logic, branchNumber)
+
+    # approach from above with open jaws for 2 seconds, then keep them closed around the branch for 1 second
+    rateHz = TRACKING_RATE_HZ
+    timestamps = numpy.arange(3 * rateHz) / float(rateHz)
+    approaching = timestamps < 2.0
+    heights = numpy.where(approaching, 10.0 + 50.0 * (2.0 - timestamps) / 2.0, 10.0)
+    cutterTipPositions = cutPoint + heights[:, numpy.newaxis] * [0, 0, 1]
+    triggerToCutters = numpy.array([self.getTriggerToCutter(jawsOpen) for jawsOpen in approaching])
+    recordingPath = os.path.join(slicer.app.temporaryPath, 'VesselHarvestingTutorBranchCut.csv')
+    self.writeRecording(recordingPath, timestamps, self.getCutterToRetractors(logic, cutterTipPositions), triggerToCutters)
+
+    metrics = logic.replaySession(recordingPath)
+    self.assertEqual(metrics['branchesCut'], 1)
+    self.assertFalse(logic.visiblePolydata['Model_' + str(branchNumber)])
+    self.assertTrue(all(visible for name, visible in logic.visiblePolydata.items() if name != 'Model_' + str(branchNumber)))
+    # the stump ends where the jaws enter the branch, close to the middle of the branch
+    self.assertGreater(metrics['stumpLengths'][0], 0)
+    self.assertLess(metrics['stumpLengths'][0], 2 * arcLength)
+    self.assertGreater(logic.clippedPolydata['Model_' + str(branchNumber)].GetNumberOfPoints(), 0)
+    self.delayDisplay('Test passed!')
+
+
+  def test_ClosedJawsDrag(self):
+    self.delayDisplay('Dragging closed jaws from a cut branch across another branch')
+    logic = self.createLogic()
+    firstBranch, secondBranch = logic.branchNumbers[:2]
+    firstCutPoint, _ = self.getBranchCutPoint(logic, firstBranch)
+    secondCutPoint, _ = self.getBranchCutPoint(logic, secondBranch)
+
+    # approach the first branch with open jaws, close them around it, then drag them closed to the second branch
+    rateHz = TRACKING_RATE_HZ
+    timestamps = numpy.arange(8 * rateHz) / float(rateHz)
+    approaching = timestamps < 2.0
+    dragFraction = numpy.clip((timestamps - 3.0) / 2.0, 0.0, 1.0)[:, numpy.newaxis]
+    cutterTipPositions = (1 - dragFraction) * firstCutPoint + dragFraction * secondCutPoint
+    cutterTipPositions[:, 2] += numpy.where(approaching, 10.0 + 50.0 * (2.0 - timestamps) / 2.0, 10.0)
+    triggerToCutters = numpy.array([self.getTriggerToCutter(jawsOpen) for jawsOpen in approaching])
+    recordingPath = os.path.join(slicer.app.temporaryPath, 'VesselHarvestingTutorClosedJawsDrag.csv')
+    self.writeRecording(recordingPath, timestamps, self.getCutterToRetractors(logic, cutterTipPositions), triggerToCutters)
+
+    # the drag and the hold at the second branch outlast the debounce interval
+    metrics = logic.replaySession(recordingPath)
+    self.assertEqual(metrics['branchesCut'], 1)
+    self.assertFalse(logic.visiblePolydata['Model_' + str(firstBranch)])
+    self.assertTrue(logic.visiblePolydata['Model_' + str(secondBranch)])
+    self.delayDisplay('Test passed!')
+
+
+  def test_ClosedBeforeContact(self):
+    self.delayDisplay('Closing the jaws above a branch, then lowering them onto it')
+    logic = self.createLogic()
+    branchNumber = logic.branchNumbers[0]
+    cutPoint, _ = self.getBranchCutPoint(logic, branchNumber)
+
+    # jaws open for 1 second, closed 60 mm above the branch, lowered onto it for 2 seconds and held for 1 second
+    rateHz = TRACKING_RATE_HZ
+    timestamps = numpy.arange(4 * rateHz) / float(rateHz)
+    heights = 10.0 + 50.0 * numpy.clip((3.0 - timestamps) / 2.0, 0.0, 1.0)
+    cutterTipPositions = cutPoint + heights[:, numpy.newaxis] * [0, 0, 1]
+    triggerToCutters = numpy.array([self.getTriggerToCutter(timestamp < 1.0) for timestamp in timestamps])
+    recordingPath = os.path.join(slicer.app.temporaryPath, 'VesselHarvestingTutorClosedBeforeContact.csv')
+    self.writeRecording(recordingPath, timestamps, self.getCutterToRetractors(logic, cutterTipPositions), triggerToCutters)
+
+    # no cuts at a distance, only the jaws cut
+    metrics = logic.replaySession(recordingPath, branchCutRadius=0)
+    self.assertEqual(metrics['branchesCut'], 0)
+    self.assertTrue(all(logic.visiblePolydata.values()))
+    self.delayDisplay('Test passed!')
+
+
+  def test_Metrics(self):
+    self.delayDisplay('Checking metrics of a straight cutter path')
+    logic = self.createLogic()
+    rateHz = TRACKING_RATE_HZ
+    timestamps = numpy.arange(10 * rateHz) / float(rateHz)
+    # straight line with slope 0.5 in x-y, far from the vessel and with open jaws
+    x = 1000.0 + 10.0 * timestamps
+    cutterTipPositions = numpy.column_stack([x, 0.5 * x, numpy.full(len(x), 1000.0)])
+    triggerToCutters = numpy.array([self.getTriggerToCutter(True)] * len(timestamps))
+    recordingPath = os.path.join(slicer.app.temporaryPath, 'VesselHarvestingTutorMetrics.csv')
+    self.writeRecording(recordingPath, timestamps, self.getCutterToRetractors(logic, cutterTipPositions), triggerToCutters)
+
+    metrics = logic.replaySession(recordingPath)
+    self.assertEqual(metrics['branchesCut'], 0)
+    self.assertEqual(len(logic.trajectory), len(timestamps))
+    self.assertAlmostEqual(metrics['trajectorySlope'], 0.5, places=2)
+    # cutter and vessel keep their orientation
+    self.assertAlmostEqual(metrics['minAngle'], metrics['maxAngle'], delta=0.1)
+    self.assertEqual(metrics['procedureTime'], '00:00:09')
+    # the cutter stayed outside the vessel tunnel
+    self.assertEqual(metrics['cutterCoverage'], 0)
+    self.delayDisplay('Test passed!')
+
+
+  def sendTrackerFrame(self, logic, matrices, timestamp=None):
+    """Sets the transforms of a tracker frame one at a time in the order PLUS sends them, as the OpenIGTLink
+    connector does, each stamped with the tracker timestamp if given.
+    """
+    matrix = vtk.vtkMatrix4x4()
+    for role in ['TriggerToCutter', 'CutterToRetractor', 'VesselToRetractor']:
+      node = logic.nodes.get(role)
+      if timestamp is not None:
+        node.SetAttribute(TRACKER_TIMESTAMP_ATTRIBUTE, repr(timestamp))
+      else:
+        node.RemoveAttribute(TRACKER_TIMESTAMP_ATTRIBUTE)
+      matrix.DeepCopy(matrices[role].ravel().tolist())
+      node.SetMatrixTransformToParent(matrix)
+
+
+  def test_TrackerMessages(self):
+    self.delayDisplay('Merging the transform messages of each tracker frame')
+    logic = self.createLogic()
+    logic.resetMetrics()
+    frameCount = 20
+    cutterTipPositions = numpy.column_stack([1000.0 + 5.0 * numpy.arange(frameCount), numpy.zeros(frameCount), numpy.full(frameCount, 1000.0)])
+    cutterToRetractors = self.getCutterToRetractors(logic, cutterTipPositions)
+    framesBefore = logic.trackerFrameCount
+    unstampedBefore = logic.unstampedFrameCount
+    logic.tutorRunning = True
+    try:
+      for i in range(frameCount):
+        vesselToRetractor = numpy.identity(4)
+        vesselToRetractor[0, 3] = i
+        matrices = {'TriggerToCutter': self.getTriggerToCutter(True), 'CutterToRetractor': cutterToRetractors[i],
+          'VesselToRetractor': vesselToRetractor}
+        # stamped by the tracker in the first half, without timestamps in the second half
+        if i < frameCount // 2:
+          self.sendTrackerFrame(logic, matrices, 100.0 + i / float(TRACKING_RATE_HZ))
+        else:
+          self.sendTrackerFrame(logic, matrices)
+          time.sleep(1.0 / TRACKING_RATE_HZ)
+    finally:
+      logic.tutorRunning = False
+    logic.updateVisualization()
+
+    # one sample per frame, with the poses of all messages of its frame
+    samples = logic.trajectory.getSamples()
+    self.assertEqual(len(samples), frameCount)
+    self.assertEqual(logic.trackerFrameCount - framesBefore, frameCount)
+    self.assertEqual(logic.unstampedFrameCount - unstampedBefore, frameCount - frameCount // 2)
+    self.assertTrue(numpy.allclose(samples['position'], cutterTipPositions))
+    self.assertTrue(numpy.allclose(samples['vesselToRas'][:, 3], numpy.arange(frameCount)))
+    self.assertTrue(numpy.allclose(samples['timestamp'][:frameCount // 2], 100.0 + numpy.arange(frameCount // 2) / float(TRACKING_RATE_HZ)))
+    self.delayDisplay('Test passed!')
+
+
+  def test_StationSessions(self):
+    self.delayDisplay('Scoring two stations in one scene')
+    firstLogic = self.createLogic()
+    # inputs of the second station are selected, their names are not prefixed with the session name
+    secondLogic = self.createLogic('Station2')
+    for role in REPLAY_TRANSFORM_NAMES:
+      inputNode = slicer.mrmlScene.AddNode(slicer.vtkMRMLLinearTransformNode())
+      inputNode.SetName('S2' + role)
+      secondLogic.setInputNode(role, inputNode)
+      self.assertEqual(secondLogic.nodes.get(role).GetID(), inputNode.GetID())
+      self.assertEqual(secondLogic.getSessionParameterNode().GetNodeReferenceID(role), inputNode.GetID())
+      self.assertNotEqual(firstLogic.nodes.getID(role), inputNode.GetID())
+    self.assertEqual(secondLogic.nodes.get('TriggerToCutter').GetTransformNodeID(), secondLogic.nodes.getID('CutterToRetractor'))
+    self.assertEqual(secondLogic.nodes.get('VesselModelToVessel').GetTransformNodeID(), secondLogic.nodes.getID('VesselToRetractor'))
+    self.assertEqual(firstLogic.nodes.get('TriggerToCutter').GetTransformNodeID(), firstLogic.nodes.getID('CutterToRetractor'))
+
+    # frames streamed for the second station are recorded only by its session
+    frameCount = 10
+    cutterTipPositions = numpy.column_stack([1000.0 + 5.0 * numpy.arange(frameCount), numpy.zeros(frameCount), numpy.full(frameCount, 1000.0)])
+    cutterToRetractors = self.getCutterToRetractors(secondLogic, cutterTipPositions)
+    firstLogic.resetMetrics()
+    secondLogic.resetMetrics()
+    firstLogic.tutorRunning = True
+    secondLogic.tutorRunning = True
+    try:
+      for i in range(frameCount):
+        matrices = {'TriggerToCutter': self.getTriggerToCutter(True), 'CutterToRetractor': cutterToRetractors[i],
+          'VesselToRetractor': numpy.identity(4)}
+        self.sendTrackerFrame(secondLogic, matrices, 100.0 + i / float(TRACKING_RATE_HZ))
+    finally:
+      firstLogic.tutorRunning = False
+      secondLogic.tutorRunning = False
+    firstLogic.updateVisualization()
+    secondLogic.updateVisualization()
+    self.assertEqual(len(firstLogic.trajectory), 0)
+    self.assertEqual(len(secondLogic.trajectory), frameCount)
+
+    # a branch cut at the second station leaves the vessel of the first station intact
+    branchNumber = secondLogic.branchNumbers[0]
+    cutPoint, _ = self.getBranchCutPoint(secondLogic, branchNumber)
+    rateHz = TRACKING_RATE_HZ
+    timestamps = numpy.arange(3 * rateHz) / float(rateHz)
+    approaching = timestamps < 2.0
+    heights = numpy.where(approaching, 10.0 + 50.0 * (2.0 - timestamps) / 2.0, 10.0)
+    cutterTipPositions = cutPoint + heights[:, numpy.newaxis] * [0, 0, 1]
+    triggerToCutters = numpy.array([self.getTriggerToCutter(jawsOpen) for jawsOpen in approaching])
+    recordingPath = os.path.join(slicer.app.temporaryPath, 'VesselHarvestingTutorStationSessions.csv')
+    self.writeRecording(recordingPath, timestamps, self.getCutterToRetractors(secondLogic, cutterTipPositions), triggerToCutters)
+    metrics = secondLogic.replaySession(recordingPath)
+    self.assertEqual(metrics['branchesCut'], 1)
+    self.assertFalse(secondLogic.visiblePolydata['Model_' + str(branchNumber)])
+    self.assertTrue(all(firstLogic.visiblePolydata.values()))
+    self.assertEqual(firstLogic.metrics['branchesCut'], 0)
+    self.assertEqual(len(firstLogic.trajectory), 0)
+    self.delayDisplay('Test passed!')
+
+
+  def getBenchmarkStream(self, logic, random, rateHz, durationSec):
+    """Random walk of the cutter tip around the vessel, jaws closing every 2 seconds."""
+    timestamps = numpy.arange(int(durationSec * rateHz)) / float(rateHz)
+    vesselModelToRas = vtk.vtkMatrix4x4()
+    logic.nodes.get('VesselModelToVessel').GetMatrixTransformToWorld(vesselModelToRas)
+    center = vesselModelToRas.MultiplyPoint(tuple(logic.branchCenterlines[logic.branchNumbers[0]][0]) + (1,))[:3]
+    cutterTipPositions = numpy.array(center) + numpy.cumsum(random.normal(scale=0.5, size=(len(timestamps), 3)), axis=0)
+    triggerToCutters = numpy.array([self.getTriggerToCutter(timestamp % 2.0 < 1.5) for timestamp in timestamps])
+    return timestamps, self.getCutterToRetractors(logic, cutterTipPositions), triggerToCutters
+
+
+  def streamInRealTime(self, logic, cutterToRetractors, triggerToCutters, rateHz):
+    """Sends each frame when it is due on the wall clock, stamped with its due time, so the live observer and
+    the visualization timer run as with a tracker. Frames that fall behind are sent right away, as a backed up
+    event queue delivers them. Returns the due times.
+    """
+    vesselToRetractor = numpy.identity(4)
+    dueTimes = []
+    startTime = time.time()
+    for i in range(len(triggerToCutters)):
+      dueTime = startTime + i / float(rateHz)
+      while time.time() < dueTime:
+        slicer.app.processEvents()
+        time.sleep(0.001)
+      # one message per transform, as the connector receives them
+      matrices = {'TriggerToCutter': triggerToCutters[i], 'CutterToRetractor': cutterToRetractors[i],
+        'VesselToRetractor': vesselToRetractor}
+      self.sendTrackerFrame(logic, matrices, dueTime)
+      dueTimes.append(dueTime)
+    slicer.app.processEvents()
+    return numpy.array(dueTimes)
+
+
+  def test_TrackingBenchmark(self, rates=(50, 100, 250, 500), durationSec=10.0, realTimeDurationSec=5.0):
+    """Replays simulated tracker streams as fast as possible at each rate, then streams at the tracker rate
+    in real time through the live observer and checks that every frame is recorded. Callback timings, frames
+    per second and tracker-to-callback latency are only reported, they depend on the load of the machine.
+    """
+    self.delayDisplay('Benchmarking the tracking callback')
+    logic = self.createLogic()
+    logic.profiler.enabled = True
+    random = numpy.random.RandomState(0)
+    recordingPath = os.path.join(slicer.app.temporaryPath, 'VesselHarvestingTutorBenchmark.csv')
+    for rateHz in rates:
+      timestamps, cutterToRetractors, triggerToCutters = self.getBenchmarkStream(logic, random, rateHz, durationSec)
+      self.writeRecording(recordingPath, timestamps, cutterToRetractors, triggerToCutters)
+
+      logic.profiler.reset()
+      startTime = timeit.default_timer()
+      logic.replaySession(recordingPath)
+      elapsedSec = timeit.default_timer() - startTime
+      statistics = logic.getProfilingStatistics()
+      callback = statistics['updateTransforms']
+      logging.info('{0} Hz replay: callback p50 {1:.3f} ms, p95 {2:.3f} ms, max {3:.3f} ms, {4:.0f} frames/s'.format(
+        rateHz, callback['p50'], callback['p95'], callback['max'], len(timestamps) / elapsedSec))
+      self.assertEqual(statistics['samplesDropped'], 0)
+      self.assertEqual(len(logic.trajectory), len(timestamps))
+
+    # live stream at the tracker rate, the callback has to keep up with it
+    timestamps, cutterToRetractors, triggerToCutters = self.getBenchmarkStream(logic, random, TRACKING_RATE_HZ, realTimeDurationSec)
+    logic.resetMetrics()
+    logic.resetModels()
+    logic.profiler.reset()
+    framesBefore = logic.trackerFrameCount
+    logic.tutorRunning = True
+    try:
+      dueTimes = self.streamInRealTime(logic, cutterToRetractors, triggerToCutters, TRACKING_RATE_HZ)
+    finally:
+      logic.tutorRunning = False
+    logic.updateVisualization()
+    statistics = logic.getProfilingStatistics()
+    callback = statistics['updateTransforms']
+    latency = statistics['trackerToCallback']
+    logging.info('{0} Hz live: callback p95 {1:.3f} ms, tracker to callback p50 {2:.3f} ms, p95 {3:.3f} ms, max {4:.3f} ms'.format(
+      TRACKING_RATE_HZ, callback['p95'], latency['p50'], latency['p95'], latency['max']))
+    self.assertEqual(statistics['samplesDropped'], 0)
+    # one sample per frame, not one per transform message
+    self.assertEqual(logic.trackerFrameCount - framesBefore, len(timestamps))
+    self.assertEqual(len(logic.trajectory), len(timestamps))
+    self.assertTrue(numpy.array_equal(logic.trajectory.getSamples()['timestamp'], dueTimes))
+    logic.profiler.enabled = False
+    self.delayDisplay('Test passed!')
+
+
+  def test_NodeRegistry(self):
+    self.delayDisplay('Moving observers to a node added back to the scene')
+    registry = NodeRegistry(slicer.mrmlScene)
+    callbacks = []
+    node = slicer.mrmlScene.AddNode(slicer.vtkMRMLLinearTransformNode())
+    node.SetName('RegistryTransform')
+    registry.register('Transform', node)
+    registry.addObserver('Transform', slicer.vtkMRMLLinearTransformNode.TransformModifiedEvent, lambda caller, event: callbacks.append(caller))
+    try:
+      # the same node removed and added back, as when a scene view is restored
+      slicer.mrmlScene.RemoveNode(node)
+      slicer.mrmlScene.AddNode(node)
+      self.assertEqual(registry.get('Transform').GetID(), node.GetID())
+      node.SetMatrixTransformToParent(vtk.vtkMatrix4x4())
+      self.assertEqual(len(callbacks), 1)
+
+      # a new node of the same name, as when an OpenIGTLink connector reconnects
+      slicer.mrmlScene.RemoveNode(node)
+      replacement = slicer.mrmlScene.AddNode(slicer.vtkMRMLLinearTransformNode())
+      replacement.SetName('RegistryTransform')
+      self.assertEqual(registry.get('Transform').GetID(), replacement.GetID())
+      del callbacks[:]
+      node.SetMatrixTransformToParent(vtk.vtkMatrix4x4())
+      replacement.SetMatrixTransformToParent(vtk.vtkMatrix4x4())
+      self.assertEqual(callbacks, [replacement])
+    finally:
+      registry.removeAllObservers()
+    self.delayDisplay('Test passed!')
+
+
+  def test_WebcamFrames(self):
+    self.delayDisplay('Recording the webcam image of the PLUS configuration')
+    logic = self.createLogic()
+    sessionDirectory = os.path.join(slicer.app.temporaryPath, 'VesselHarvestingTutorWebcam')
+    for path in glob.glob(os.path.join(sessionDirectory, 'frame*.npy')):
+      os.remove(path)
+    logic.startSessionLog(sessionDirectory)
+    logic.tutorRunning = True
+    try:
+      # the webcam connects after the session is loaded, with the device name PLUS gives it
+      webcamNode = slicer.vtkMRMLVectorVolumeNode()
+      webcamNode.SetName(WEBCAM_DEVICE_NAME)
+      slicer.mrmlScene.AddNode(webcamNode)
+      self.assertEqual(logic.nodes.getID('Webcam'), webcamNode.GetID())
+      imageData = vtk.vtkImageData()
+      imageData.SetDimensions(64, 48, 1)
+      imageData.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 3)
+      webcamNode.SetAndObserveImageData(imageData)
+      frameCount = logic.videoStore.frameCount
+    finally:
+      logic.tutorRunning = False
+      logic.stopSessionLog()
+    self.assertGreater(frameCount, 0)
+    timestamp, frame = VideoFrameStore(sessionDirectory).getFrame(0)
+    self.assertEqual(frame.shape, (48, 64, 3))
+    self.delayDisplay('Test passed!')
+
+
+  def test_VideoFrameStore(self):
+    self.delayDisplay('Seeking webcam frames by timestamp')
+    storeDirectory = os.path.join(slicer.app.temporaryPath, 'VesselHarvestingTutorVideo')
+    for path in glob.glob(os.path.join(storeDirectory, 'frame*.npy')):
+      os.remove(path)
+    store = VideoFrameStore(storeDirectory, chunkSize=4)
+    timestamps = 100.0 + numpy.arange(10) / float(WEBCAM_FRAME_RATE)
+    for i, timestamp in enumerate(timestamps):
+      store.addFrame(timestamp, numpy.full((48, 64, 1), i, dtype=numpy.uint8))
+    store.close()
+
+    store = VideoFrameStore(storeDirectory)
+    # the frame shown at a time is the last one received before it
+    timestamp, frame = store.getFrameAt(timestamps[5] + 0.01)
+    self.assertEqual(timestamp, timestamps[5])
+    self.assertEqual(frame[0, 0, 0], 5)
+    self.assertEqual(store.getFrame(9)[1][0, 0, 0], 9)
+    self.assertEqual(store.getFrameNumber(0.0), 0)
+    self.delayDisplay('Test passed!')
+
+
+  def test_VesselRecentering(self):
+    self.delayDisplay('Keeping the vessel in view')
+    logic = self.createLogic()
+    logic.setRecenteringEnabled(True)
+    # vessel tracked far away from the retractor
+    vesselToRetractor = vtk.vtkTransform()
+    vesselToRetractor.Translate(1000, 500, 0)
+    logic.nodes.get('VesselToRetractor').SetMatrixTransformToParent(vesselToRetractor.GetMatrix())
+    self.assertTrue(logic.checkVesselLocation())
+    # the closest axis point is now at the reference point, no further move while the vessel stays
+    retractorReference = [0,0,0,0]
+    logic.nodes.get('RetractorReference').GetNthFiducialWorldCoordinates(0, retractorReference)
+    vesselModelToRas = vtk.vtkMatrix4x4()
+    logic.nodes.get('VesselModelToVessel').GetMatrixTransformToWorld(vesselModelToRas)
+    axisPointsRas = [vesselModelToRas.MultiplyPoint(tuple(point) + (1,))[:3] for point in logic.vesselAxisPoints]
+    distances = numpy.linalg.norm(numpy.array(axisPointsRas) - retractorReference[:3], axis=1)
+    self.assertAlmostEqual(distances.min(), 0.0, places=3)
+    self.assertFalse(logic.checkVesselLocation())
+
+    logic.setRecenteringEnabled(False)
+    vesselModelToVessel = self.getMatrixArray(logic.nodes.get('VesselModelToVessel').GetMatrixTransformToParent())
+    self.assertTrue(numpy.allclose(vesselModelToVessel, numpy.identity(4)))
+    self.delayDisplay('Test passed!')
+
+
+  def test_CoverageMap(self):
+    self.delayDisplay('Counting samples along the vessel axis')
+    coverage = CoverageMap([[0, 0, 0], [50, 0, 0], [100, 0, 0]], binLength=10, sectorCount=4, radius=5)
+    self.assertEqual(coverage.binCount, 10)
+    # one point on each side of the axis at 15 mm, one at the far end, one outside the tunnel
+    bins, sectors, inside = coverage.getCells([[15, 0, 1], [15, 1, 0], [15, 0, -1], [15, -1, 0], [95, 0, 1], [50, 10, 0]])
+    self.assertEqual(list(bins[:5]), [1, 1, 1, 1, 9])
+    self.assertEqual(len(set(sectors[:4])), 4)
+    self.assertEqual(list(inside), [True] * 5 + [False])
+
+    # the grid does not grow with the number of samples
+    points = numpy.column_stack([numpy.linspace(0, 49, 5000), numpy.ones(5000), numpy.zeros(5000)])
+    for i in range(10):
+      coverage.add('retractor', points)
+    self.assertEqual(coverage.counts['retractor'].shape, (10, 4))
+    self.assertEqual(coverage.counts['retractor'].sum(), 50000)
+    self.assertAlmostEqual(coverage.getCoveredFraction(['retractor']), 5 / 40.0)
+    self.assertEqual(coverage.getCoveredFraction(['cutter']), 0)
+    self.assertEqual(coverage.getLevels().max(), COVERAGE_LEVELS - 1)
+    coverage.reset()
+    self.assertEqual(coverage.getCoveredFraction(), 0)
+    self.delayDisplay('Test passed!')